@@ -1,8 +1,9 @@
 from django.contrib import admin
 from .models import (
     User, Permission, Role, RolePermission, UserRole,
-    Conversation, PrivateChat, GroupChat, GroupMember,
-    Message, Attachment, MessageStatus, Reaction, AuditLog
+    Conversation, ConversationMember, PrivateChat, GroupChat, GroupMember,
+    Message, Attachment, MessageStatus, UnreadCounter, Reaction, AuditLog,
+    ArchivedMessage, DeletionJob, CompactionRun
 )
 
 # Inline classes
@@ -18,6 +19,10 @@ class GroupMemberInline(admin.TabularInline):
     model = GroupMember
     extra = 0
 
+class ConversationMemberInline(admin.TabularInline):
+    model = ConversationMember
+    extra = 0
+
 class AttachmentInline(admin.TabularInline):
     model = Attachment
     extra = 0
@@ -75,10 +80,10 @@ class UserRoleAdmin(admin.ModelAdmin):
 
 @admin.register(Conversation)
 class ConversationAdmin(admin.ModelAdmin):
-    list_display = ('conversation_id', 'type', 'title', 'created_at', 'last_message')
+    list_display = ('conversation_id', 'type', 'title', 'created_at', 'last_message', 'last_activity_at')
     search_fields = ('title', 'type')
     list_filter = ('type', 'created_at')
-    inlines = [PrivateChatInline, GroupChatInline]
+    inlines = [PrivateChatInline, GroupChatInline, ConversationMemberInline]
 
 @admin.register(PrivateChat)
 class PrivateChatAdmin(admin.ModelAdmin):
@@ -99,6 +104,12 @@ class GroupMemberAdmin(admin.ModelAdmin):
     search_fields = ('group_chat__conversation__title', 'user__username', 'role')
     list_filter = ('role', 'joined_at')
 
+@admin.register(ConversationMember)
+class ConversationMemberAdmin(admin.ModelAdmin):
+    list_display = ('conversation', 'user', 'role', 'joined_at')
+    search_fields = ('conversation__title', 'user__username')
+    list_filter = ('role', 'joined_at')
+
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
     list_display = ('message_id', 'conversation', 'sender', 'type', 'content', 'sent_at', 'is_edited', 'is_deleted')
@@ -118,14 +129,37 @@ class MessageStatusAdmin(admin.ModelAdmin):
     search_fields = ('message__message_id', 'user__username', 'status')
     list_filter = ('status', 'updated_at')
 
+@admin.register(UnreadCounter)
+class UnreadCounterAdmin(admin.ModelAdmin):
+    list_display = ('conversation', 'user', 'unread_count', 'updated_at')
+    search_fields = ('conversation__title', 'user__username')
+
 @admin.register(Reaction)
 class ReactionAdmin(admin.ModelAdmin):
     list_display = ('reaction_id', 'message', 'user', 'emoji', 'created_at')
     search_fields = ('message__message_id', 'user__username', 'emoji')
     list_filter = ('emoji', 'created_at')
 
+@admin.register(ArchivedMessage)
+class ArchivedMessageAdmin(admin.ModelAdmin):
+    list_display = ('message_id', 'conversation', 'sender', 'type', 'sent_at', 'archived_at', 'is_deleted')
+    search_fields = ('sender__username', 'conversation__title')
+    list_filter = ('type', 'is_deleted', 'archived_at')
+
+@admin.register(DeletionJob)
+class DeletionJobAdmin(admin.ModelAdmin):
+    list_display = ('job_id', 'target_type', 'target_id', 'status', 'step', 'rows_deleted', 'files_deleted', 'created_at', 'finished_at')
+    list_filter = ('status', 'target_type')
+    readonly_fields = ('rows_deleted', 'files_deleted', 'step', 'error', 'started_at', 'finished_at')
+
+@admin.register(CompactionRun)
+class CompactionRunAdmin(admin.ModelAdmin):
+    list_display = ('run_id', 'started_at', 'finished_at', 'hard_delete', 'messages_compacted', 'messages_purged', 'rows_reclaimed', 'files_deleted')
+    list_filter = ('hard_delete', 'started_at')
+    readonly_fields = ('grace_days', 'hard_delete', 'messages_compacted', 'messages_purged', 'statuses_deleted', 'reactions_deleted', 'attachments_deleted', 'files_deleted', 'rows_reclaimed', 'started_at', 'finished_at')
+
 @admin.register(AuditLog)
 class AuditLogAdmin(admin.ModelAdmin):
-    list_display = ('log_id', 'actor', 'action', 'target_type', 'target_id', 'timestamp', 'ip_address')
-    search_fields = ('actor__username', 'action', 'target_type', 'ip_address')
+    list_display = ('log_id', 'actor_name', 'action', 'target_type', 'target_id', 'timestamp', 'ip_address')
+    search_fields = ('actor_name', 'action', 'target_type', 'ip_address')
     list_filter = ('action', 'target_type', 'timestamp')
@@ -2,33 +2,157 @@ from rest_framework import generics, permissions, status
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 from django.shortcuts import get_object_or_404
-from django.db import models
+from django.http import StreamingHttpResponse
+from django.conf import settings
+from django.db import models, transaction
 from django.db.models import Q
-from django.contrib.postgres.search import SearchVector, SearchQuery, SearchRank
 from django.views.decorators.csrf import csrf_exempt
+from django.utils.cache import patch_cache_control
 from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+import hashlib
 import logging
+from datetime import datetime
+from .archive import TieredMessageList, conversation_messages, keyset_window
+from .db_router import set_acting_user, use_replica
+from .audit import parse_boundary
+from .batch import run_batch
+from .conversation_state import (
+    conversation_list_version, conversation_version, deliver_message, get_conversation_titles, get_unread_counts,
+    inbox_queryset, record_message_deleted
+)
+from .directory import DIRECTORY_FIELDS, directory_page
+from .cursors import TIMESTAMP_POSITION, decode_cursor, encode_cursor
+from .export import export_lines
+from .membership_cache import get_user_conversation_ids, is_member
 from .models import User, Conversation, Message, Attachment, PrivateChat, GroupChat, GroupMember
-from .serializers import UserSerializer, ConversationSerializer, MessageSerializer, AttachmentSerializer, MessageSearchSerializer
+from .search import compile_matcher, filter_messages, get_search_backend
+from .user_index import autocomplete_users
+from .serializers import UserSerializer, ConversationSerializer, InboxSerializer, MessageSerializer, AttachmentSerializer, MessageSearchSerializer
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+class ReplicaReadMixin:
+    """Serve safe requests from a read replica; the router keeps recent writers on the primary."""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # DRF authenticates here, after ReplicaRoutingMiddleware has run
+        if request.user.is_authenticated:
+            set_acting_user(request.user.pk)
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method in permissions.SAFE_METHODS:
+            with use_replica():
+                return super().dispatch(request, *args, **kwargs)
+        return super().dispatch(request, *args, **kwargs)
+
+class ConditionalGetMixin:
+    """
+    Answer If-None-Match with 304 before the queryset or serializer runs. Views return a cheap
+    validator of what the response shows from get_version(), or None to skip the check.
+    """
+
+    def get(self, request, *args, **kwargs):
+        response = condition(etag_func=self.get_etag)(super().get)(request, *args, **kwargs)
+        # Per-user data: no shared caches, and clients revalidate on every poll
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def get_etag(self, request, *args, **kwargs):
+        try:
+            version = self.get_version(request, *args, **kwargs)
+        except Exception as e:
+            logger.error(f"Error computing ETag for {request.get_full_path()}: {str(e)}")
+            return None
+        if version is None:
+            return None
+        # The same data renders differently per user, page and format
+        key = f"{request.user.pk}|{version}|{request.get_full_path()}|{request.META.get('HTTP_ACCEPT', '')}"
+        return hashlib.md5(key.encode('utf-8'), usedforsecurity=False).hexdigest()
+
+    def get_version(self, request, *args, **kwargs):
+        return None
+
+    def get_conversation_version(self, request, conversation_id):
+        """Validator of a live conversation the user may read, from one small query."""
+        conversation = Conversation.objects.filter(
+            conversation_id=conversation_id,
+            deleted_at__isnull=True
+        ).only('conversation_id', 'type', 'version', 'last_activity_at').first()
+        if conversation is None or not request.user.can_access_conversation(conversation):
+            return None
+        return conversation_version(conversation)
+
 # User API Views
-class UserListView(generics.ListAPIView):
-    queryset = User.objects.all()
-    serializer_class = UserSerializer
+class UserListView(ReplicaReadMixin, generics.GenericAPIView):
+    """
+    The user directory, ordered by username. `q` narrows it to usernames or display names starting
+    with the text (typeahead); `cursor` continues after the previous page.
+    """
     permission_classes = [IsAuthenticated]
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
 
-    def list(self, request, *args, **kwargs):
+    def get(self, request, *args, **kwargs):
         try:
-            return super().list(request, *args, **kwargs)
+            limit = min(int(request.query_params.get(self.page_size_query_param, self.page_size)), self.max_page_size)
+        except ValueError:
+            limit = self.page_size
+
+        try:
+            users, next_cursor = directory_page(
+                request.query_params.get('q', ''),
+                cursor=request.query_params.get('cursor'),
+                limit=max(limit, 1),
+                exclude_user_id=request.user.pk
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             logger.error(f"Error listing users for {request.user.username}: {str(e)}")
             return Response({'error': 'Failed to retrieve users'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+        next_url = replace_query_param(request.build_absolute_uri(), 'cursor', next_cursor) if next_cursor else None
+        return Response({'next': next_url, 'results': users})
+
+class MentionView(generics.GenericAPIView):
+    """
+    Mention autocomplete for a conversation: users whose username or a word of their display name
+    starts with `q`, members first. Served from the in-process user index, not a table scan.
+    """
+    permission_classes = [IsAuthenticated]
+    page_size = 10
+    max_page_size = 50
+    page_size_query_param = 'page_size'
+
+    def get(self, request, conversation_id, *args, **kwargs):
+        if not is_member(request.user.pk, conversation_id):
+            return Response({'error': 'Conversation not found'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            limit = min(int(request.query_params.get(self.page_size_query_param, self.page_size)), self.max_page_size)
+        except ValueError:
+            limit = self.page_size
+
+        try:
+            users = autocomplete_users(
+                request.query_params.get('q', ''),
+                limit=max(limit, 1),
+                conversation_id=conversation_id,
+                exclude_user_id=request.user.pk
+            )
+        except Exception as e:
+            logger.error(f"Error completing mentions in conversation {conversation_id}: {str(e)}")
+            return Response({'error': 'Failed to retrieve users'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response({'results': [{field: getattr(user, field) for field in DIRECTORY_FIELDS} for user in users]})
+
 class UserDetailView(generics.RetrieveUpdateAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
@@ -51,22 +175,117 @@ class UserDetailView(generics.RetrieveUpdateAPIView):
             logger.error(f"Error updating user details for {request.user.username}: {str(e)}")
             return Response({'error': 'Failed to update user details'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class KeysetPagination(BasePagination):
+    """
+    Keyset pagination on a two-column key the queryset is ordered by, both descending. `cursor`
+    continues after the last row of the previous page; no total count is run.
+    """
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    # (field, parse) for the leading and tie-breaking column of the ordering
+    keyset = ()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        cursor = self.decode_cursor(request.query_params.get('cursor'))
+
+        try:
+            limit = min(int(request.query_params.get(self.page_size_query_param, self.page_size)), self.max_page_size)
+        except ValueError:
+            limit = self.page_size
+        limit = max(limit, 1)
+
+        if cursor is not None and not queryset.query.is_empty():
+            (leading, _), (tie_breaker, _) = self.keyset
+            queryset = queryset.filter(
+                Q(**{f'{leading}__lt': cursor[0]}) | Q(**{leading: cursor[0], f'{tie_breaker}__lt': cursor[1]})
+            )
+        results = list(queryset[:limit + 1])
+        self.has_next = len(results) > limit
+        self.page = results[:limit]
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_link(self.page[-1]) if self.has_next else None,
+            'results': data,
+        })
+
+    def get_link(self, row):
+        return replace_query_param(self.request.build_absolute_uri(), 'cursor', self.encode_cursor(row))
+
+    def encode_cursor(self, row):
+        return encode_cursor(*(getattr(row, field) for field, _ in self.keyset))
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            return decode_cursor(cursor, *(parse for _, parse in self.keyset))
+        except ValueError as e:
+            raise ValidationError({'error': str(e)})
+
+class SearchCursorPagination(KeysetPagination):
+    """Search results by (search_rank, message_id), best match first."""
+    keyset = (('search_rank', float), ('message_id', int))
+
+class InboxPagination(KeysetPagination):
+    """Conversations by (last_activity_at, conversation_id), most recently active first."""
+    page_size = 30
+    keyset = (('last_activity_at', datetime.fromisoformat), ('conversation_id', int))
+
+class BatchView(generics.GenericAPIView):
+    """
+    Several API reads in one round trip, e.g. the calls a client makes at startup. POST
+    {"requests": [{"path": "/api/users/me/"}, ...]}; each entry may carry an If-None-Match header.
+    Authentication, session and permission lookups happen once for the whole batch.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        specs = request.data.get('requests') if isinstance(request.data, dict) else None
+        if not isinstance(specs, list) or not specs:
+            return Response({'error': 'requests must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(specs) > settings.BATCH_MAX_REQUESTS:
+            return Response({'error': f'At most {settings.BATCH_MAX_REQUESTS} requests per batch'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            responses = run_batch(request, specs, exclude_view=BatchView)
+        except Exception as e:
+            logger.error(f"Error running batch for {request.user.username}: {str(e)}")
+            return Response({'error': 'Failed to run batch'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response({'responses': responses})
+
 # Conversation API Views
-class ConversationListView(generics.ListCreateAPIView):
+class ConversationListView(ConditionalGetMixin, generics.ListCreateAPIView):
     serializer_class = ConversationSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_version(self, request, *args, **kwargs):
+        return conversation_list_version(request.user) if request.user.is_authenticated else None
+
     def get_queryset(self):
         try:
             from .views import get_user_conversations
-            return get_user_conversations(self.request.user)
+            return get_user_conversations(self.request.user).order_by('-last_activity_at')
         except Exception as e:
             logger.error(f"Error getting conversations for user {self.request.user.username}: {str(e)}")
             return Conversation.objects.none()
 
     def list(self, request, *args, **kwargs):
         try:
-            return super().list(request, *args, **kwargs)
+            page = self.paginate_queryset(self.get_queryset())
+            conversations = page if page is not None else list(self.get_queryset())
+
+            # Unread badges for the whole page in one query
+            context = self.get_serializer_context()
+            context['unread_counts'] = get_unread_counts(request.user, [c.conversation_id for c in conversations])
+            serializer = self.get_serializer(conversations, many=True, context=context)
+
+            if page is not None:
+                return self.get_paginated_response(serializer.data)
+            return Response(serializer.data)
         except Exception as e:
             logger.error(f"Error listing conversations for {request.user.username}: {str(e)}")
             return Response({'error': 'Failed to retrieve conversations'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -75,12 +294,36 @@ class ConversationListView(generics.ListCreateAPIView):
         # This will be handled by specific create views for private/group chats
         pass
 
-class ConversationDetailView(generics.RetrieveAPIView):
-    queryset = Conversation.objects.all()
+class InboxView(ReplicaReadMixin, generics.ListAPIView):
+    """
+    The conversation list screen in one request: title, last message, other participant, member and
+    unread counts, most recently active first. A page costs the same queries however long it is.
+    """
+    serializer_class = InboxSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = InboxPagination
+
+    def get_queryset(self):
+        return inbox_queryset(self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        try:
+            return super().list(request, *args, **kwargs)
+        except ValidationError:
+            raise
+        except Exception as e:
+            logger.error(f"Error listing inbox for {request.user.username}: {str(e)}")
+            return Response({'error': 'Failed to retrieve conversations'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class ConversationDetailView(ConditionalGetMixin, generics.RetrieveAPIView):
+    queryset = Conversation.objects.filter(deleted_at__isnull=True)
     serializer_class = ConversationSerializer
     permission_classes = [IsAuthenticated]
     lookup_field = 'conversation_id'
 
+    def get_version(self, request, *args, **kwargs):
+        return self.get_conversation_version(request, kwargs['conversation_id'])
+
     def retrieve(self, request, *args, **kwargs):
         try:
             conversation = self.get_object()
@@ -99,33 +342,97 @@ class ConversationDetailView(generics.RetrieveAPIView):
             return Response({'error': 'Failed to retrieve conversation'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 # Message API Views
-class MessageListView(generics.ListCreateAPIView):
+class MessageCursorPagination(BasePagination):
+    """
+    Keyset pagination on (sent_at, message_id). Without a cursor it returns the newest page;
+    `before` pages towards older messages and `after` towards newer ones. No total count is run.
+    """
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = 'page_size'
+    # Name used before page_size was shared by all endpoints; still honoured for existing clients
+    legacy_page_size_query_param = 'limit'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        before = self.decode_cursor(request.query_params.get('before'))
+        after = self.decode_cursor(request.query_params.get('after'))
+        if before and after:
+            raise ValidationError({'error': 'Use either before or after, not both'})
+
+        requested = request.query_params.get(self.page_size_query_param, request.query_params.get(self.legacy_page_size_query_param))
+        try:
+            limit = min(int(requested or self.page_size), self.max_page_size)
+        except ValueError:
+            limit = self.page_size
+        limit = max(limit, 1)
+
+        tiers = [queryset.archived, queryset.hot] if isinstance(queryset, TieredMessageList) else [queryset]
+        page, has_more = keyset_window(tiers, before=before, after=after, limit=limit)
+
+        # The cursor we came from proves there is data on the other side of this page
+        if after is not None:
+            self.has_older, self.has_newer = True, has_more
+        else:
+            self.has_older, self.has_newer = has_more, before is not None
+        self.page = page
+        return page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_link('after', self.page[-1]) if self.has_newer and self.page else None,
+            'previous': self.get_link('before', self.page[0]) if self.has_older and self.page else None,
+            'results': data,
+        })
+
+    def get_link(self, direction, message):
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, 'before' if direction == 'after' else 'after')
+        return replace_query_param(url, direction, self.encode_cursor(message))
+
+    @staticmethod
+    def encode_cursor(message):
+        return encode_cursor(message.sent_at, message.message_id)
+
+    @staticmethod
+    def decode_cursor(cursor):
+        if not cursor:
+            return None
+        try:
+            return decode_cursor(cursor, *TIMESTAMP_POSITION)
+        except ValueError as e:
+            raise ValidationError({'error': str(e)})
+
+class MessageListView(ReplicaReadMixin, ConditionalGetMixin, generics.ListCreateAPIView):
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
-    pagination_class = PageNumberPagination
+    pagination_class = MessageCursorPagination
+
+    def get_version(self, request, *args, **kwargs):
+        return self.get_conversation_version(request, kwargs['conversation_id'])
+
+    @property
+    def paginator(self):
+        """Keyset pagination by default; ?pagination=page keeps the old numbered pages."""
+        if not hasattr(self, '_paginator'):
+            if self.request.query_params.get('pagination') == 'page':
+                self._paginator = PageNumberPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
 
     def get_queryset(self):
         try:
             conversation_id = self.kwargs['conversation_id']
-            conversation = Conversation.objects.get(conversation_id=conversation_id)
+            conversation = Conversation.objects.get(conversation_id=conversation_id, deleted_at__isnull=True)
 
             # Check if user has access to this conversation
             user = self.request.user
             if not user.can_access_conversation(conversation):
                 return Message.objects.none()
 
-            # Optimized query with select_related and prefetch_related
-            return Message.objects.filter(
-                conversation_id=conversation_id,
-                is_deleted=False
-            ).select_related(
-                'sender',
-                'reply_to',
-                'reply_to__sender'
-            ).prefetch_related(
-                'reaction_set',
-                'attachment_set'
-            ).order_by('sent_at')
+            # Archived messages first, then the hot table, each with select_related and prefetch_related
+            return conversation_messages(conversation_id)
         except Conversation.DoesNotExist:
             logger.warning(f"User {self.request.user.username} attempted to access messages from non-existent conversation {self.kwargs.get('conversation_id')}")
             return Message.objects.none()
@@ -143,6 +450,8 @@ class MessageListView(generics.ListCreateAPIView):
 
             serializer = self.get_serializer(self.get_queryset(), many=True)
             return Response(serializer.data)
+        except ValidationError:
+            raise
         except Exception as e:
             logger.error(f"Error listing messages for {request.user.username}: {str(e)}")
             return Response({'error': 'Failed to retrieve messages'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -150,14 +459,16 @@ class MessageListView(generics.ListCreateAPIView):
     def perform_create(self, serializer):
         try:
             conversation_id = self.kwargs['conversation_id']
-            conversation = get_object_or_404(Conversation, conversation_id=conversation_id)
+            conversation = get_object_or_404(Conversation, conversation_id=conversation_id, deleted_at__isnull=True)
 
             # Check if user has access to this conversation
             user = self.request.user
             if not user.can_access_conversation(conversation):
                 raise PermissionError("Access denied")
 
-            serializer.save(conversation=conversation)
+            with transaction.atomic():
+                message = serializer.save(conversation=conversation)
+                deliver_message(message)
         except Conversation.DoesNotExist:
             logger.warning(f"User {self.request.user.username} attempted to create message in non-existent conversation {conversation_id}")
             raise
@@ -168,6 +479,31 @@ class MessageListView(generics.ListCreateAPIView):
             logger.error(f"Error creating message for user {self.request.user.username}: {str(e)}")
             raise
 
+class ConversationExportView(generics.GenericAPIView):
+    """
+    The whole history of a conversation as NDJSON, oldest first, with reactions and attachment
+    metadata. Streamed in keyset batches; `after` takes the `cursor` of the last line received.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, conversation_id, *args, **kwargs):
+        # The whole history goes to members only, not to every user can_access_conversation() lets in
+        live = Conversation.objects.filter(conversation_id=conversation_id, deleted_at__isnull=True)
+        if not is_member(request.user.pk, conversation_id) or not live.exists():
+            return Response({'error': 'Conversation not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        after = request.query_params.get('after')
+        try:
+            after = decode_cursor(after, *TIMESTAMP_POSITION) if after else None
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        logger.info(f"User {request.user.username} exporting conversation {conversation_id}")
+        response = StreamingHttpResponse(export_lines(conversation_id, after=after), content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="conversation-{conversation_id}.ndjson"'
+        patch_cache_control(response, private=True, no_store=True)
+        return response
+
 class MessageDetailView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
@@ -190,6 +526,11 @@ class MessageDetailView(generics.RetrieveUpdateDestroyAPIView):
             logger.error(f"Error updating message for {request.user.username}: {str(e)}")
             return Response({'error': 'Failed to update message'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            record_message_deleted(instance)
+            instance.delete()
+
     def destroy(self, request, *args, **kwargs):
         try:
             return super().destroy(request, *args, **kwargs)
@@ -207,7 +548,7 @@ class AttachmentListView(generics.ListCreateAPIView):
             message_id = self.kwargs.get('message_id')
             if message_id:
                 # Check if user has access to the message
-                message = Message.objects.filter(message_id=message_id).first()
+                message = Message.objects.select_related('conversation').filter(message_id=message_id).first()
                 if message and not self.request.user.can_access_conversation(message.conversation):
                     return Attachment.objects.none()
                 return Attachment.objects.filter(message_id=message_id)
@@ -237,7 +578,7 @@ class AttachmentListView(generics.ListCreateAPIView):
             raise
 
 class AttachmentDetailView(generics.RetrieveAPIView):
-    queryset = Attachment.objects.all()
+    queryset = Attachment.objects.select_related('message__conversation')
     serializer_class = AttachmentSerializer
     permission_classes = [IsAuthenticated]
     lookup_field = 'attachment_id'
@@ -265,10 +606,53 @@ class MessageSearchPagination(PageNumberPagination):
     page_size_query_param = 'page_size'
     max_page_size = 100
 
-class MessageSearchView(generics.ListAPIView):
+class MessageSearchView(ReplicaReadMixin, generics.ListAPIView):
+    """
+    Full-text message search. Optional filters: conversation_id, sender_id, after/before (ISO date
+    or datetime; after is inclusive, before exclusive), has_attachment and mime_type (e.g. image/*).
+    """
     serializer_class = MessageSearchSerializer
     permission_classes = [IsAuthenticated]
-    pagination_class = MessageSearchPagination
+    pagination_class = SearchCursorPagination
+
+    @property
+    def paginator(self):
+        """Keyset pagination by default; ?pagination=page keeps the old numbered pages."""
+        if not hasattr(self, '_paginator'):
+            if self.request.query_params.get('pagination') == 'page':
+                self._paginator = MessageSearchPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_search_filters(self):
+        params = self.request.query_params
+        try:
+            filters = {
+                'conversation_id': self._int_param('conversation_id'),
+                'sender_id': self._int_param('sender_id'),
+                'after': parse_boundary(params['after']) if params.get('after') else None,
+                'before': parse_boundary(params['before']) if params.get('before') else None,
+                'mime_type': params.get('mime_type') or None,
+                'has_attachment': None,
+            }
+            if params.get('has_attachment'):
+                value = params['has_attachment'].lower()
+                if value not in ('true', 'false', '1', '0'):
+                    raise ValueError('has_attachment must be true or false')
+                filters['has_attachment'] = value in ('true', '1')
+        except ValueError as e:
+            raise ValidationError({'error': str(e)})
+        return filters
+
+    def _int_param(self, name):
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise ValueError(f'{name} must be an integer')
 
     def get_queryset(self):
         try:
@@ -277,31 +661,28 @@ class MessageSearchView(generics.ListAPIView):
                 return Message.objects.none()
 
             user = self.request.user
+            filters = self.get_search_filters()
 
             # Get conversations the user has access to
-            from .views import get_user_conversations
-            accessible_conversations = get_user_conversations(user)
-
-            # Filter messages by accessible conversations and search query
-            # Using PostgreSQL full-text search if available, otherwise fallback to icontains
-            try:
-                search_vector = SearchVector('content')
-                search_query = SearchQuery(query)
-                messages = Message.objects.filter(
-                    conversation__in=accessible_conversations
-                ).annotate(
-                    search_rank=SearchRank(search_vector, search_query)
-                ).filter(
-                    search_vector=search_query
-                ).order_by('-search_rank', '-sent_at')
-            except:
-                # Fallback for databases without full-text search
-                messages = Message.objects.filter(
-                    conversation__in=accessible_conversations,
-                    content__icontains=query
-                ).order_by('-sent_at')
+            accessible_conversations = get_user_conversation_ids(user.user_id)
+            if filters['conversation_id'] is not None:
+                # A scoped search only looks at that conversation instead of every accessible one
+                if filters['conversation_id'] not in accessible_conversations:
+                    return Message.objects.none()
+                messages = Message.objects.all()
+            else:
+                messages = Message.objects.filter(conversation_id__in=accessible_conversations)
+
+            # Filters go into the same query as the index lookup, so only matching rows get ranked
+            messages = filter_messages(messages, **filters)
+
+            # Full-text search through the index of the database engine (FTS5 on SQLite, tsvector on PostgreSQL)
+            messages = messages.select_related('sender').prefetch_related('reaction_set__user')
+            messages = get_search_backend(messages.db).search(messages, query)
 
             return messages
+        except ValidationError:
+            raise
         except Exception as e:
             logger.error(f"Error searching messages for user {self.request.user.username}: {str(e)}")
             return Message.objects.none()
@@ -310,12 +691,23 @@ class MessageSearchView(generics.ListAPIView):
         try:
             queryset = self.get_queryset()
             page = self.paginate_queryset(queryset)
+            results = page if page is not None else list(queryset)
+
+            # Titles for every conversation on the page in one lookup instead of several queries per result
+            context = self.get_serializer_context()
+            context['search_query'] = request.query_params.get('q', '')
+            # One compiled matcher for the whole page, used where the database builds no snippet
+            context['search_matcher'] = compile_matcher(context['search_query'])
+            context['conversation_titles'] = get_conversation_titles(
+                request.user,
+                {message.conversation_id for message in results}
+            )
+            serializer = self.get_serializer_class()(results, many=True, context=context)
             if page is not None:
-                serializer = self.get_serializer(page, many=True, context={'request': request, 'search_query': request.query_params.get('q', '')})
                 return self.get_paginated_response(serializer.data)
-
-            serializer = self.get_serializer(queryset, many=True, context={'request': request, 'search_query': request.query_params.get('q', '')})
             return Response(serializer.data)
+        except ValidationError:
+            raise
         except Exception as e:
             logger.error(f"Error listing search results for {request.user.username}: {str(e)}")
             return Response({'error': 'Failed to search messages'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
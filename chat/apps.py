@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
+
+    def ready(self):
+        from django.core.checks import register
+
+        from . import signals  # noqa: F401
+        from .persistence import check_persistence_mode
+
+        register(check_persistence_mode)
@@ -0,0 +1,221 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import (
+    Attachment, ArchivedAttachment, ArchivedMessage, ArchivedMessageStatus,
+    ArchivedReaction, Message, MessageStatus, Reaction
+)
+
+logger = logging.getLogger(__name__)
+
+# reply_to is not joined: its target may be archived, which the foreign key cannot see (see reply_targets)
+MESSAGE_RELATED = ('sender',)
+MESSAGE_PREFETCH = ('reaction_set', 'reaction_set__user', 'attachment_set')
+
+
+def archive_messages(older_than_days=None, batch_size=None, compress=None, max_batches=None):
+    """Move messages older than the cutoff into the archive tables in batches. Returns the number archived."""
+    older_than_days = settings.MESSAGE_ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    batch_size = batch_size or settings.MESSAGE_ARCHIVE_BATCH_SIZE
+    compress = settings.MESSAGE_ARCHIVE_COMPRESS if compress is None else compress
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+
+    # A conversation's preview stays hot so last_message keeps pointing at a real row.
+    # Primary key order follows sent_at closely and lets each batch start at the front of the table.
+    candidates = Message.objects.filter(
+        sent_at__lt=cutoff,
+        last_message_conversations__isnull=True
+    ).order_by('message_id')
+
+    archived = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        message_ids = list(candidates.values_list('message_id', flat=True)[:batch_size])
+        if not message_ids:
+            break
+        archive_batch(message_ids, compress=compress)
+        archived += len(message_ids)
+        batches += 1
+        logger.info(f"Archived {archived} messages older than {cutoff.isoformat()}")
+    return archived
+
+
+def archive_batch(message_ids, compress=False):
+    """Copy one batch of messages and their attachments, statuses and reactions to the archive, then delete them."""
+    with transaction.atomic():
+        messages = list(Message.objects.filter(message_id__in=message_ids))
+        ArchivedMessage.objects.bulk_create([ArchivedMessage.from_message(message, compress) for message in messages])
+        ArchivedAttachment.objects.bulk_create([
+            ArchivedAttachment(
+                attachment_id=attachment.attachment_id,
+                message_id=attachment.message_id,
+                file=attachment.file.name,
+                file_name=attachment.file_name,
+                mime_type=attachment.mime_type,
+                file_size=attachment.file_size,
+                thumbnail_url=attachment.thumbnail_url,
+            )
+            for attachment in Attachment.objects.filter(message_id__in=message_ids)
+        ])
+        ArchivedMessageStatus.objects.bulk_create([
+            ArchivedMessageStatus(
+                id=message_status.id,
+                message_id=message_status.message_id,
+                user_id=message_status.user_id,
+                status=message_status.status,
+                updated_at=message_status.updated_at,
+            )
+            for message_status in MessageStatus.objects.filter(message_id__in=message_ids)
+        ])
+        ArchivedReaction.objects.bulk_create([
+            ArchivedReaction(
+                reaction_id=reaction.reaction_id,
+                message_id=reaction.message_id,
+                user_id=reaction.user_id,
+                emoji=reaction.emoji,
+                created_at=reaction.created_at,
+            )
+            for reaction in Reaction.objects.filter(message_id__in=message_ids)
+        ])
+        # Attachments, statuses and reactions go with the messages via CASCADE
+        Message.objects.filter(message_id__in=message_ids).delete()
+    return len(messages)
+
+
+class TieredMessageList:
+    """
+    Read-only, sliceable view of a conversation's archived messages followed by its
+    hot messages in sent_at order. Works with Django's Paginator.
+    """
+
+    def __init__(self, archived, hot):
+        self.archived = archived
+        self.hot = hot
+        self._archived_count = None
+        self._hot_count = None
+
+    @property
+    def archived_count(self):
+        if self._archived_count is None:
+            self._archived_count = self.archived.count()
+        return self._archived_count
+
+    def count(self):
+        if self._hot_count is None:
+            self._hot_count = self.hot.count()
+        return self.archived_count + self._hot_count
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, index):
+        if isinstance(index, int):
+            items = self[index:index + 1]
+            if not items:
+                raise IndexError(index)
+            return items[0]
+
+        start = index.start or 0
+        stop = index.stop if index.stop is not None else self.count()
+        boundary = self.archived_count
+        items = []
+        if start < boundary:
+            items.extend(self.archived[start:min(stop, boundary)])
+        if stop > boundary:
+            items.extend(self.hot[max(start - boundary, 0):stop - boundary])
+        return items
+
+
+def keyset_window(tiers, before=None, after=None, limit=50):
+    """
+    Read up to `limit` messages strictly before or after a (sent_at, message_id) position,
+    walking `tiers` (oldest tier first) without COUNT or OFFSET.
+    Returns (messages oldest first, whether more exist in the direction read).
+    """
+    if after is not None:
+        sent_at, message_id = after
+        position = Q(sent_at__gt=sent_at) | Q(sent_at=sent_at, message_id__gt=message_id)
+        ordering = ('sent_at', 'message_id')
+        ordered_tiers = tiers
+    else:
+        position = Q()
+        if before is not None:
+            sent_at, message_id = before
+            position = Q(sent_at__lt=sent_at) | Q(sent_at=sent_at, message_id__lt=message_id)
+        ordering = ('-sent_at', '-message_id')
+        ordered_tiers = list(reversed(tiers))
+
+    # One extra row tells us whether another page exists
+    messages = []
+    for tier in ordered_tiers:
+        wanted = limit + 1 - len(messages)
+        if wanted <= 0:
+            break
+        messages.extend(tier.filter(position).order_by(*ordering)[:wanted])
+
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if after is None:
+        messages.reverse()
+    return messages, has_more
+
+
+def conversation_messages(conversation_id):
+    """All live messages of a conversation across both tiers, oldest first."""
+    hot = Message.objects.filter(
+        conversation_id=conversation_id,
+        is_deleted=False
+    ).select_related(*MESSAGE_RELATED).prefetch_related(*MESSAGE_PREFETCH).order_by('sent_at')
+    archived = ArchivedMessage.objects.filter(
+        conversation_id=conversation_id,
+        is_deleted=False
+    ).select_related(*MESSAGE_RELATED).prefetch_related(*MESSAGE_PREFETCH).order_by('sent_at')
+    return TieredMessageList(archived, hot)
+
+
+def recent_messages(conversation_id, limit=50):
+    """The newest `limit` live messages of a conversation, oldest first, reading the archive only when needed."""
+    messages = list(Message.objects.filter(
+        conversation_id=conversation_id,
+        is_deleted=False
+    ).select_related(*MESSAGE_RELATED).prefetch_related(*MESSAGE_PREFETCH).order_by('-sent_at')[:limit])
+
+    if len(messages) < limit:
+        messages.extend(ArchivedMessage.objects.filter(
+            conversation_id=conversation_id,
+            is_deleted=False
+        ).select_related(*MESSAGE_RELATED).prefetch_related(*MESSAGE_PREFETCH).order_by('-sent_at')[:limit - len(messages)])
+
+    messages.reverse()
+    return messages
+
+
+def reply_targets(messages):
+    """
+    The messages that `messages` reply to, keyed by message_id, from whichever tier holds them.
+    At most two queries; targets that no longer exist are left out.
+    """
+    wanted = {message.reply_to_id for message in messages if message.reply_to_id}
+    if not wanted:
+        return {}
+    targets = Message.objects.select_related('sender').in_bulk(wanted)
+    missing = wanted - targets.keys()
+    if missing:
+        targets.update(ArchivedMessage.objects.select_related('sender').in_bulk(missing))
+    return targets
+
+
+def get_reply_target(message_id):
+    """The hot or archived message with this ID and its sender, or None."""
+    return (
+        Message.objects.select_related('sender').filter(message_id=message_id).first()
+        or ArchivedMessage.objects.select_related('sender').filter(message_id=message_id).first()
+    )
@@ -0,0 +1,148 @@
+import logging
+import threading
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .audit_partitions import drop_expired_partitions, ensure_partitions, month_start
+from .cursors import TIMESTAMP_POSITION, decode_cursor, encode_cursor
+from .models import AuditLog
+from .persistence import BatchWriter
+
+logger = logging.getLogger(__name__)
+
+AUDIT_SYNC = 'sync'
+AUDIT_ASYNC = 'async'
+
+
+def log_action(actor, action, target_type, target_id, old_value='', new_value='', ip_address=None, durable=False):
+    """
+    Record an audit entry. In async mode the entry is queued once the surrounding transaction
+    commits and batch-inserted off the request path; `durable=True` waits until it is stored.
+    """
+    entry = AuditLog(
+        actor=actor,
+        actor_name=actor.username,
+        action=action,
+        target_type=target_type,
+        target_id=target_id,
+        old_value=old_value,
+        new_value=new_value,
+        ip_address=ip_address,
+        timestamp=timezone.now()
+    )
+    if get_audit_log_mode() != AUDIT_ASYNC:
+        entry.save()
+        return entry
+
+    def submit():
+        future = get_audit_writer().submit(entry)
+        if durable:
+            try:
+                future.result(timeout=getattr(settings, 'AUDIT_LOG_DURABLE_TIMEOUT', 5))
+            except Exception as e:
+                logger.error(f"Audit entry for {action} {target_type} {target_id} was not stored: {str(e)}")
+
+    transaction.on_commit(submit)
+    return entry
+
+
+class AuditLogWriter(BatchWriter):
+    """Batch-inserts queued audit entries."""
+
+    name = 'audit-log-writer'
+
+    def write_batch(self, items):
+        AuditLog.objects.bulk_create(items)
+        logger.debug(f"Persisted {len(items)} audit entries")
+
+
+_audit_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_audit_log_mode():
+    return getattr(settings, 'AUDIT_LOG_MODE', AUDIT_ASYNC)
+
+
+def get_audit_writer():
+    """Return the per-process audit writer; it drains its queue on interpreter exit."""
+    global _audit_writer
+    with _writer_lock:
+        if _audit_writer is None:
+            _audit_writer = AuditLogWriter(
+                batch_size=getattr(settings, 'AUDIT_LOG_BATCH_SIZE', 100),
+                flush_interval=getattr(settings, 'AUDIT_LOG_FLUSH_INTERVAL', 0.5),
+                max_retries=getattr(settings, 'AUDIT_LOG_MAX_RETRIES', 5),
+            )
+            _audit_writer.start()
+        return _audit_writer
+
+
+def audit_log_page(start_date=None, end_date=None, action=None, before=None, limit=50):
+    """
+    One page of audit entries, newest first, using keyset pagination on (timestamp, log_id).
+    Dates are ISO dates or datetimes; a plain end date includes that whole day.
+    Returns (entries, next_cursor). Raises ValueError for bad dates or cursors.
+    """
+    logs = AuditLog.objects.select_related('actor').order_by('-timestamp', '-log_id')
+    if start_date:
+        logs = logs.filter(timestamp__gte=parse_boundary(start_date))
+    if end_date:
+        boundary = parse_boundary(end_date)
+        if parse_date(end_date) is not None:
+            logs = logs.filter(timestamp__lt=boundary + timedelta(days=1))
+        else:
+            logs = logs.filter(timestamp__lte=boundary)
+    if action:
+        logs = logs.filter(action=action)
+    if before:
+        timestamp, log_id = decode_cursor(before, *TIMESTAMP_POSITION)
+        logs = logs.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, log_id__lt=log_id))
+
+    entries = list(logs[:limit + 1])
+    next_cursor = encode_cursor(entries[limit - 1].timestamp, entries[limit - 1].log_id) if len(entries) > limit else None
+    return entries[:limit], next_cursor
+
+
+def prune_audit_log(retention_days=None, batch_size=None):
+    """
+    Remove audit entries older than the retention period, a whole calendar month at a time. On
+    PostgreSQL each month is a partition that is dropped, and the partitions for the coming months
+    are created; elsewhere entries are deleted in batches through the timestamp index.
+    Returns the number of entries removed.
+    """
+    retention_days = settings.AUDIT_LOG_RETENTION_DAYS if retention_days is None else retention_days
+    batch_size = batch_size or settings.AUDIT_LOG_PRUNE_BATCH_SIZE
+    # Only months that have entirely aged out are dropped
+    cutoff = month_start(timezone.now() - timedelta(days=retention_days))
+
+    deleted = drop_expired_partitions(connection, cutoff)
+    ensure_partitions(connection)
+
+    # With partitions this only finds entries that landed in the default partition
+    expired = AuditLog.objects.filter(timestamp__lt=cutoff).order_by('timestamp', 'log_id')
+    while True:
+        with transaction.atomic():
+            log_ids = list(expired.values_list('log_id', flat=True)[:batch_size])
+            if not log_ids:
+                break
+            count, _ = AuditLog.objects.filter(log_id__in=log_ids).delete()
+        deleted += count
+    logger.info(f"Pruned {deleted} audit entries older than {cutoff.isoformat()}")
+    return deleted
+
+
+def parse_boundary(value):
+    """An aware datetime from an ISO date (midnight) or datetime. Raises ValueError."""
+    day = parse_date(value)
+    moment = datetime.combine(day, time.min) if day is not None else parse_datetime(value)
+    if moment is None:
+        raise ValueError(f"Invalid date: {value}")
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
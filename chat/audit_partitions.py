@@ -0,0 +1,133 @@
+import logging
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Engines where audit_log is range-partitioned by month of `timestamp`, so retention drops whole
+# partitions; elsewhere it stays one table and prune_audit_log deletes rows in batches
+PARTITIONED_VENDORS = ('postgresql',)
+
+PARTITION_PREFIX = 'audit_log_'
+# Catches entries outside every monthly partition, so an insert never fails for want of one
+DEFAULT_PARTITION = 'audit_log_default'
+
+PARTITIONS_SQL = (
+    "SELECT child.relname FROM pg_inherits "
+    "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+    "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+    "WHERE parent.relname = 'audit_log'"
+)
+
+
+def is_partitioned(connection):
+    return connection.vendor in PARTITIONED_VENDORS
+
+
+def month_start(moment):
+    return moment.astimezone(dt_timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month):
+    return f'{PARTITION_PREFIX}{month:%Y_%m}'
+
+
+def partition_month(name):
+    """The first instant (UTC) of the month a partition holds, or None for the default partition."""
+    try:
+        return datetime.strptime(name[len(PARTITION_PREFIX):], '%Y_%m').replace(tzinfo=dt_timezone.utc)
+    except ValueError:
+        return None
+
+
+def expired_partitions(names, cutoff):
+    """Monthly partitions whose whole month is before `cutoff`, oldest first."""
+    months = sorted((month, name) for name in names if (month := partition_month(name)) is not None)
+    return [name for month, name in months if add_months(month, 1) <= cutoff]
+
+
+def create_partitions(connection, months, parent='audit_log'):
+    with connection.cursor() as cursor:
+        for month in months:
+            # Bounds are literals: PostgreSQL does not take parameters in DDL
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {parent} "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+            )
+
+
+def ensure_partitions(connection, months_ahead=None):
+    """
+    Create the partitions for this month and the next `months_ahead`. A month has to exist before its
+    first entry arrives: once the default partition holds rows for a month, that month's partition
+    can no longer be created.
+    """
+    if not is_partitioned(connection):
+        return
+    months_ahead = settings.AUDIT_LOG_PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    current = month_start(timezone.now())
+    create_partitions(connection, [add_months(current, count) for count in range(months_ahead + 1)])
+
+
+def drop_expired_partitions(connection, cutoff):
+    """Drop the monthly partitions entirely older than `cutoff`. Returns the number of entries they held."""
+    if not is_partitioned(connection):
+        return 0
+    dropped = 0
+    with connection.cursor() as cursor:
+        cursor.execute(PARTITIONS_SQL)
+        for name in expired_partitions([name for name, in cursor.fetchall()], cutoff):
+            cursor.execute(f'SELECT count(*) FROM {name}')
+            count = cursor.fetchone()[0]
+            cursor.execute(f'DROP TABLE {name}')
+            logger.info(f"Dropped audit log partition {name} with {count} entries")
+            dropped += count
+    return dropped
+
+
+def partition_audit_log(schema_editor, model):
+    """
+    Rebuild audit_log as a table range-partitioned by month of `timestamp`, with a partition for
+    every month that has entries. PostgreSQL requires the partition key in the primary key, so it
+    becomes (log_id, timestamp); log_id stays unique since it still comes from one sequence. Before
+    PostgreSQL 17 a partitioned table cannot have an identity column, so log_id uses an owned sequence.
+    """
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT min("timestamp"), max("timestamp") FROM audit_log')
+        first, last = cursor.fetchone()
+        cursor.execute('CREATE SEQUENCE audit_log_partitioned_log_id_seq')
+        cursor.execute('CREATE TABLE audit_log_partitioned (LIKE audit_log INCLUDING DEFAULTS) PARTITION BY RANGE ("timestamp")')
+        cursor.execute("ALTER TABLE audit_log_partitioned ALTER COLUMN log_id SET DEFAULT nextval('audit_log_partitioned_log_id_seq')")
+        cursor.execute('ALTER TABLE audit_log_partitioned ADD PRIMARY KEY (log_id, "timestamp")')
+        cursor.execute(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF audit_log_partitioned DEFAULT')
+
+        current = month_start(timezone.now())
+        month = month_start(first) if first is not None else current
+        months = []
+        while month <= add_months(current, settings.AUDIT_LOG_PARTITION_MONTHS_AHEAD) or (last is not None and month <= last):
+            months.append(month)
+            month = add_months(month, 1)
+        create_partitions(connection, months, parent='audit_log_partitioned')
+
+        cursor.execute('INSERT INTO audit_log_partitioned SELECT * FROM audit_log')
+        cursor.execute('DROP TABLE audit_log')
+        cursor.execute('ALTER TABLE audit_log_partitioned RENAME TO audit_log')
+        cursor.execute('ALTER TABLE audit_log RENAME CONSTRAINT audit_log_partitioned_pkey TO audit_log_pkey')
+        cursor.execute('ALTER SEQUENCE audit_log_partitioned_log_id_seq RENAME TO audit_log_log_id_seq')
+        cursor.execute('ALTER SEQUENCE audit_log_log_id_seq OWNED BY audit_log.log_id')
+        cursor.execute("SELECT setval('audit_log_log_id_seq', coalesce(max(log_id), 0) + 1, false) FROM audit_log")
+
+    # The actor foreign key and the indexes, under the names Django gave them on the plain table
+    actor = model._meta.get_field('actor')
+    schema_editor.execute(schema_editor._create_index_sql(model, fields=[actor]))
+    schema_editor.execute(schema_editor._create_fk_sql(model, actor, '_fk_%(to_table)s_%(to_column)s'))
+    for index in model._meta.indexes:
+        schema_editor.add_index(model, index)
@@ -0,0 +1,102 @@
+import copy
+import json
+import logging
+from urllib.parse import urlsplit
+
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, QueryDict
+from django.urls import Resolver404, resolve
+
+logger = logging.getLogger(__name__)
+
+# Sub-request headers passed through to the view; everything else comes from the batch request
+FORWARDED_HEADERS = {'If-None-Match': 'HTTP_IF_NONE_MATCH'}
+
+# Response headers reported back per sub-request
+RETURNED_HEADERS = ('ETag', 'Cache-Control')
+
+
+def run_batch(request, specs, exclude_view=None):
+    """
+    Run read-only sub-requests against the API views in the context of `request`: the user it
+    authenticated, its session and its per-request permission cache. Returns one
+    {'status', 'headers', 'body'} dict per spec, in order; a failing sub-request does not stop the rest.
+    """
+    return [_run_one(request, spec, exclude_view) for spec in specs]
+
+
+def _run_one(request, spec, exclude_view):
+    if not isinstance(spec, dict) or not isinstance(spec.get('path'), str):
+        return _error(400, 'Each request needs a path')
+    if spec.get('method', 'GET').upper() != 'GET':
+        return _error(405, 'Only GET requests can be batched')
+
+    url = urlsplit(spec['path'])
+    if not url.path.startswith('/api/'):
+        return _error(404, 'Not found')
+    try:
+        match = resolve(url.path)
+    except Resolver404:
+        return _error(404, 'Not found')
+    if exclude_view is not None and getattr(match.func, 'view_class', match.func) is exclude_view:
+        return _error(400, 'Batches cannot be nested')
+
+    sub_request = _sub_request(request, url, spec.get('headers') or {})
+    sub_request.resolver_match = match
+    try:
+        response = match.func(sub_request, *match.args, **match.kwargs)
+        if response.streaming:
+            # The body is produced lazily and may be unbounded; it cannot be inlined in the batch
+            response.close()
+            return _error(400, 'Streaming endpoints cannot be batched')
+        body = _body(response)
+    except Http404:
+        return _error(404, 'Not found')
+    except PermissionDenied:
+        return _error(403, 'Permission denied')
+    except Exception as e:
+        logger.error(f"Error in batched request {spec['path']}: {str(e)}")
+        return _error(500, 'Request failed')
+
+    return {
+        'status': response.status_code,
+        'headers': {header: response[header] for header in RETURNED_HEADERS if response.has_header(header)},
+        'body': body,
+    }
+
+
+def _sub_request(request, url, headers):
+    """A GET copy of the batch request for `url`, already authenticated as the batch's user."""
+    outer = request._request
+    sub_request = copy.copy(outer)
+    meta = {key: value for key, value in outer.META.items() if key not in ('CONTENT_LENGTH', 'CONTENT_TYPE', 'HTTP_IF_NONE_MATCH')}
+    meta.update(REQUEST_METHOD='GET', PATH_INFO=url.path, QUERY_STRING=url.query)
+    for header, value in headers.items():
+        if header in FORWARDED_HEADERS and isinstance(value, str):
+            meta[FORWARDED_HEADERS[header]] = value
+
+    sub_request.method = 'GET'
+    sub_request.path = sub_request.path_info = url.path
+    sub_request.META = meta
+    sub_request.GET = QueryDict(url.query)
+    sub_request.POST = QueryDict()
+    sub_request.__dict__.pop('_files', None)
+    # DRF skips its authentication classes for a forced user, so auth runs once for the whole batch
+    sub_request._force_auth_user = request.user
+    sub_request._force_auth_token = request.auth
+    return sub_request
+
+
+def _body(response):
+    data = getattr(response, 'data', None)
+    if data is not None:
+        return data
+    if not response.content:
+        return None
+    if response.get('Content-Type', '').startswith('application/json'):
+        return json.loads(response.content)
+    return response.content.decode(response.charset)
+
+
+def _error(status_code, message):
+    return {'status': status_code, 'headers': {}, 'body': {'error': message}}
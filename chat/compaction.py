@@ -0,0 +1,97 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .deletion import delete_attachment_files
+from .models import (
+    ArchivedAttachment, ArchivedMessage, ArchivedMessageStatus, ArchivedReaction,
+    Attachment, CompactionRun, Message, MessageStatus, Reaction
+)
+
+logger = logging.getLogger(__name__)
+
+# (message model, status model, reaction model, attachment model, fields that hold the content)
+TIERS = (
+    (Message, MessageStatus, Reaction, Attachment, {'content': ''}),
+    (ArchivedMessage, ArchivedMessageStatus, ArchivedReaction, ArchivedAttachment, {'body': '', 'body_compressed': None}),
+)
+
+
+def compact_deleted_messages(grace_days=None, batch_size=None, hard_delete=None, throttle=None, max_batches=None):
+    """
+    Purge soft-deleted messages older than the grace period in both tiers: drop their statuses,
+    reactions and attachments, then clear the content or (with hard_delete) remove the row.
+    Returns the CompactionRun with the number of rows reclaimed.
+    """
+    grace_days = settings.MESSAGE_COMPACTION_GRACE_DAYS if grace_days is None else grace_days
+    batch_size = batch_size or settings.MESSAGE_COMPACTION_BATCH_SIZE
+    hard_delete = settings.MESSAGE_COMPACTION_HARD_DELETE if hard_delete is None else hard_delete
+    throttle = settings.MESSAGE_COMPACTION_THROTTLE if throttle is None else throttle
+    cutoff = timezone.now() - timedelta(days=grace_days)
+
+    run = CompactionRun.objects.create(grace_days=grace_days, hard_delete=hard_delete)
+    batches = 0
+    for message_model, status_model, reaction_model, attachment_model, cleared in TIERS:
+        candidates = message_model.objects.filter(
+            is_deleted=True,
+            compacted_at__isnull=True,
+            deleted_at__lt=cutoff
+        ).order_by('deleted_at')
+
+        while max_batches is None or batches < max_batches:
+            message_ids = list(candidates.values_list('message_id', flat=True)[:batch_size])
+            if not message_ids:
+                break
+            _compact_batch(run, message_ids, message_model, status_model, reaction_model, attachment_model, cleared, hard_delete)
+            batches += 1
+            if throttle:
+                # Leave room for foreground traffic between batches
+                time.sleep(throttle)
+
+    run.finished_at = timezone.now()
+    run.save(update_fields=['finished_at'])
+    run.refresh_from_db()
+    logger.info(
+        f"Compaction run {run.run_id} reclaimed {run.rows_reclaimed} rows "
+        f"({run.messages_compacted} messages compacted, {run.messages_purged} purged)"
+    )
+    return run
+
+
+def _compact_batch(run, message_ids, message_model, status_model, reaction_model, attachment_model, cleared, hard_delete):
+    with transaction.atomic():
+        files = [
+            name for name in attachment_model.objects.filter(message_id__in=message_ids).values_list('file', flat=True)
+            if name
+        ]
+        statuses, _ = status_model.objects.filter(message_id__in=message_ids).delete()
+        reactions, _ = reaction_model.objects.filter(message_id__in=message_ids).delete()
+        attachments, _ = attachment_model.objects.filter(message_id__in=message_ids).delete()
+        if hard_delete:
+            purged, _ = message_model.objects.filter(message_id__in=message_ids).delete()
+            compacted = 0
+        else:
+            purged = 0
+            compacted = message_model.objects.filter(message_id__in=message_ids).update(
+                compacted_at=timezone.now(),
+                **cleared
+            )
+
+        CompactionRun.objects.filter(run_id=run.run_id).update(
+            messages_compacted=F('messages_compacted') + compacted,
+            messages_purged=F('messages_purged') + purged,
+            statuses_deleted=F('statuses_deleted') + statuses,
+            reactions_deleted=F('reactions_deleted') + reactions,
+            attachments_deleted=F('attachments_deleted') + attachments,
+            rows_reclaimed=F('rows_reclaimed') + statuses + reactions + attachments + purged
+        )
+
+    # Same ordering as background deletion: files go only once their rows are committed as gone
+    removed = delete_attachment_files(files)
+    if removed:
+        CompactionRun.objects.filter(run_id=run.run_id).update(files_deleted=F('files_deleted') + removed)
@@ -1,15 +1,31 @@
+import asyncio
 import json
 import logging
 from channels.generic.websocket import AsyncWebsocketConsumer
 from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.utils import timezone
+from .archive import get_reply_target, recent_messages, reply_targets
+from .db_router import read_from_replica, set_acting_user
+from .membership_cache import get_member_ids, get_user_conversation_ids
+from .conversation_state import deliver_message, mark_read, record_message_deleted, touch_conversations
 from .models import Message, Conversation, Attachment, Reaction, User
 from .permissions import conversation_access_required
+from .persistence import allocate_message_id, get_message_writer
+from .serializers import summarize_reactions
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Outstanding durability acks for messages handed to the write-behind writer
+        self.pending_acks = set()
+        # Background task streaming the initial state after accept()
+        self.sync_task = None
+
     async def connect(self):
         try:
             self.room_name = self.scope['url_route']['kwargs']['room_name']
@@ -24,6 +40,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
             user = self.scope['user']
             logger.info(f"[WebSocket Debug] Authenticated user {user.username} connecting to room {self.room_name}")
+            # Lasts for this socket: the user's own writes keep their replica reads on the primary
+            set_acting_user(user.user_id)
 
             # Check if user has permission to view chat
             try:
@@ -39,9 +57,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
             # Check if conversation exists and user can access it
             try:
-                conversation = await sync_to_async(Conversation.objects.get)(conversation_id=self.room_name)
+                conversation = await sync_to_async(Conversation.objects.get)(conversation_id=self.room_name, deleted_at__isnull=True)
                 logger.info(f"[WebSocket Debug] Conversation {self.room_name} exists, checking access for user {user.username}")
-                if not user.can_access_conversation(conversation):
+                if not await sync_to_async(user.can_access_conversation)(conversation):
                     logger.warning(f"[WebSocket Debug] User {user.username} attempted to connect to unauthorized room {self.room_name}")
                     await self.close()
                     return
@@ -57,34 +75,71 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 self.channel_name
             )
 
-            # Set user online status
-            await self.set_user_online(user, True)
+            # Complete the handshake before any DB-heavy work; state is streamed afterwards
+            await self.accept()
+            logger.info(f"[WebSocket Debug] User {user.username} successfully connected to room {self.room_name}")
 
-            # Send online status to current user
-            await self.send(text_data=json.dumps({
-                'type': 'user_status',
-                'user_id': user.user_id,
-                'username': user.username,
-                'is_online': True,
-            }))
+            self.sync_task = asyncio.ensure_future(self.run_initial_sync(user, conversation))
+        except Exception as e:
+            logger.error(f"[WebSocket Debug] Error connecting user to room {self.room_name}: {str(e)}")
+            await self.close()
 
-            # Broadcast online status to participants
-            await self.broadcast_online_status(conversation, user, True)
+    async def run_initial_sync(self, user, conversation):
+        """Send presence, history and pending messages after the socket has been accepted."""
+        stages = [
+            ('presence', self.sync_presence),
+            ('history', self.send_message_history),
+            ('pending', self.deliver_pending_messages),
+        ]
+        try:
+            for step, (stage, handler) in enumerate(stages, start=1):
+                count = await handler(user, conversation)
+                await self.send(text_data=json.dumps({
+                    'type': 'sync_progress',
+                    'stage': stage,
+                    'count': count or 0,
+                    'step': step,
+                    'total_steps': len(stages),
+                }))
 
-            # Send full message history to the user
-            await self.send_message_history(user, conversation)
+            await self.send(text_data=json.dumps({'type': 'sync_complete'}))
+            logger.info(f"Initial sync finished for user {user.username} in room {self.room_name}")
+        except asyncio.CancelledError:
+            logger.info(f"Initial sync cancelled for user {user.username} in room {self.room_name}")
+            raise
+        except Exception as e:
+            logger.error(f"Error during initial sync for user {user.username} in room {self.room_name}: {str(e)}")
 
-            # Deliver pending messages to the user
-            await self.deliver_pending_messages(user, conversation)
+    async def sync_presence(self, user, conversation):
+        # Set user online status
+        await self.set_user_online(user, True)
 
-            logger.info(f"[WebSocket Debug] User {user.username} successfully connected to room {self.room_name}")
-            await self.accept()
-        except Exception as e:
-            logger.error(f"[WebSocket Debug] Error connecting user to room {self.room_name}: {str(e)}")
-            await self.close()
+        # Send online status to current user
+        await self.send(text_data=json.dumps({
+            'type': 'user_status',
+            'user_id': user.user_id,
+            'username': user.username,
+            'is_online': True,
+        }))
+
+        # Broadcast online status to participants
+        await self.broadcast_online_status(conversation, user, True)
+        return 1
 
     async def disconnect(self, close_code):
         try:
+            # Stop streaming initial state to a socket that is going away
+            if self.sync_task and not self.sync_task.done():
+                self.sync_task.cancel()
+                try:
+                    await self.sync_task
+                except asyncio.CancelledError:
+                    pass
+
+            # The writer still persists queued messages; only the acks are dropped
+            for task in self.pending_acks:
+                task.cancel()
+
             # Leave room group
             await self.channel_layer.group_discard(
                 self.room_group_name,
@@ -105,7 +160,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
             # Broadcast offline status to participants
             try:
-                conversation = await sync_to_async(Conversation.objects.get)(conversation_id=self.room_name)
+                conversation = await sync_to_async(Conversation.objects.get)(conversation_id=self.room_name, deleted_at__isnull=True)
                 await self.broadcast_online_status(conversation, user, False)
             except Conversation.DoesNotExist:
                 logger.warning(f"Conversation {self.room_name} not found during disconnect")
@@ -134,6 +189,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 message_content = text_data_json.get('message', '').strip()
                 attachment_data = text_data_json.get('attachment')
                 reply_to_id = text_data_json.get('reply_to')
+                client_seq = text_data_json.get('client_seq')
                 user = self.scope['user']
                 logger.info(f"[WebSocket Debug] Processing regular message: content='{message_content[:50]}...', reply_to={reply_to_id}")
 
@@ -143,18 +199,23 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     raise ValueError(validation_error)
 
                 # Check if user can send messages in this conversation
-                conversation = await sync_to_async(Conversation.objects.get)(conversation_id=self.room_name)
+                conversation = await sync_to_async(Conversation.objects.get)(conversation_id=self.room_name, deleted_at__isnull=True)
                 # Temporarily allow all authenticated users to send messages for LAN access
                 if not user.can_access_conversation(conversation):
                     logger.warning(f"[WebSocket Debug] User {user.username} cannot access conversation {self.room_name}")
                     raise PermissionError('You do not have access to this conversation')
 
-                # Save message to database
-                logger.info(f"[WebSocket Debug] Saving message to database for user {user.username}")
-                message = await self.save_message(message_content, user, self.room_name, attachment_data, reply_to_id)
-
-                # Get reactions for the message
-                reactions = await self.get_message_reactions(message.message_id)
+                writer = get_message_writer()
+                reply_to = await self.find_reply_target(writer, reply_to_id) if reply_to_id else None
+                if writer is not None:
+                    # Write-behind: the message is broadcast before it reaches the database
+                    message, durable = await self.queue_message(writer, message_content, user, conversation, attachment_data, reply_to)
+                    reactions = []
+                else:
+                    # Save message to database
+                    logger.info(f"[WebSocket Debug] Saving message to database for user {user.username}")
+                    message = await self.save_message(message_content, user, self.room_name, attachment_data, reply_to)
+                    reactions = []
 
                 # Send message to room group
                 logger.info(f"[WebSocket Debug] Broadcasting message to room group {self.room_group_name}")
@@ -168,13 +229,16 @@ class ChatConsumer(AsyncWebsocketConsumer):
                         'timestamp': str(message.sent_at),
                         'attachment': attachment_data,
                         'message_id': message.message_id,
-                        'reply_to': reply_to_id,
-                        'reply_to_sender': message.reply_to.sender.username if message.reply_to else None,
-                        'reply_to_content': message.reply_to.content if message.reply_to else None,
+                        'reply_to': reply_to.message_id if reply_to else None,
+                        'reply_to_sender': reply_to.sender.username if reply_to else None,
+                        'reply_to_content': reply_to.content if reply_to else None,
                         'reactions': reactions,
                     }
                 )
 
+                if writer is not None:
+                    self.track_durability(durable, message.message_id, client_seq)
+
                 # Send notification to other participants
                 await self.send_notification_to_participants(conversation, user, message_content)
         except json.JSONDecodeError as e:
@@ -272,7 +336,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
             reaction = await self.save_or_remove_reaction(message_id, user, emoji)
 
             # Get updated reactions
-            reactions = await self.get_message_reactions(message_id)
+            reactions, reactor_ids = await self.get_reaction_update(message_id)
 
             # Send reaction update to room group
             await self.channel_layer.group_send(
@@ -281,6 +345,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     'type': 'reaction_update',
                     'message_id': message_id,
                     'reactions': reactions,
+                    'reactor_ids': reactor_ids,
                 }
             )
         except Exception as e:
@@ -293,7 +358,12 @@ class ChatConsumer(AsyncWebsocketConsumer):
     # Receive reaction update from room group
     async def reaction_update(self, event):
         message_id = event['message_id']
-        reactions = event['reactions']
+        # The summary is shared by the room; `reacted` is set for this connection's user
+        user_id = self.scope['user'].pk
+        reactions = [
+            {**entry, 'reacted': user_id in event['reactor_ids'].get(entry['emoji'], ())}
+            for entry in event['reactions']
+        ]
 
         # Send reaction update to WebSocket
         await self.send(text_data=json.dumps({
@@ -372,57 +442,46 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'deleted_by': deleted_by,
         }))
 
-    async def save_message(self, content, user, room_name, attachment_data=None, reply_to_id=None):
-        from .models import MessageStatus
+    async def find_reply_target(self, writer, reply_to_id):
+        """The message being replied to, whether still queued for writing, hot or archived; None if it is gone."""
+        # The message being replied to may still be waiting in the writer's queue
+        reply_to = writer.get_pending(reply_to_id) if writer is not None else None
+        if reply_to is None:
+            reply_to = await sync_to_async(get_reply_target)(reply_to_id)
+        if reply_to is None:
+            logger.warning(f"Reply to message {reply_to_id} not found")
+        return reply_to
+
+    @sync_to_async
+    def save_message(self, content, user, room_name, attachment_data=None, reply_to=None):
+        """
+        Store the message, its attachment, recipient statuses and the conversation state in one
+        transaction, as the REST and form paths do. Errors propagate so the sender is told.
+        """
         try:
-            conversation = await sync_to_async(Conversation.objects.get)(conversation_id=room_name)
-            reply_to = None
-            if reply_to_id:
-                try:
-                    reply_to = await sync_to_async(Message.objects.get)(message_id=reply_to_id)
-                except Message.DoesNotExist:
-                    logger.warning(f"Reply to message {reply_to_id} not found")
-                    reply_to_id = None  # Reset to avoid issues
-
-            message = await sync_to_async(Message.objects.create)(
-                conversation=conversation,
-                sender=user,
-                content=content,
-                reply_to=reply_to,
-            )
+            with transaction.atomic():
+                conversation = Conversation.objects.get(conversation_id=room_name, deleted_at__isnull=True)
 
-            if attachment_data:
-                try:
-                    # Create attachment record
-                    attachment = await sync_to_async(Attachment.objects.create)(
+                # By ID: an archived target is not a Message instance
+                message = Message.objects.create(
+                    conversation=conversation,
+                    sender=user,
+                    content=content,
+                    reply_to_id=reply_to.message_id if reply_to else None,
+                )
+
+                if attachment_data:
+                    attachment = Attachment.objects.create(
                         message=message,
                         file_name=attachment_data['name'],
                         mime_type=attachment_data['type'],
                         file_size=attachment_data['size'],
                     )
                     logger.info(f"Created attachment {attachment.attachment_id} for message {message.message_id}")
-                except Exception as e:
-                    logger.error(f"Error creating attachment for message {message.message_id}: {str(e)}")
-                    # Continue without attachment
 
-            # Create message status for all participants except sender
-            try:
-                participants = await self.get_conversation_participants(conversation)
-                status_created = 0
-                for participant in participants:
-                    if participant != user:
-                        try:
-                            await sync_to_async(MessageStatus.objects.create)(
-                                message=message,
-                                user=participant,
-                                status='sent'
-                            )
-                            status_created += 1
-                        except Exception as e:
-                            logger.warning(f"Error creating message status for participant {participant.username}: {str(e)}")
-                logger.info(f"Created message status for {status_created} participants")
-            except Exception as e:
-                logger.error(f"Error creating message statuses: {str(e)}")
+                # Create message status for all participants except sender and advance conversation state
+                recipient_ids = deliver_message(message)
+                logger.info(f"Created message status for {len(recipient_ids)} participants")
 
             return message
         except Conversation.DoesNotExist:
@@ -432,6 +491,59 @@ class ChatConsumer(AsyncWebsocketConsumer):
             logger.error(f"Error saving message to conversation {room_name}: {str(e)}")
             raise
 
+    async def queue_message(self, writer, content, user, conversation, attachment_data=None, reply_to=None):
+        """Build the message with its ID assigned up front and hand it to the write-behind writer."""
+        message_id = await sync_to_async(allocate_message_id)()
+
+        message = Message(
+            message_id=message_id,
+            conversation=conversation,
+            sender=user,
+            content=content,
+            reply_to_id=reply_to.message_id if reply_to else None,
+            sent_at=timezone.now(),
+        )
+
+        attachments = []
+        if attachment_data:
+            attachments.append(Attachment(
+                message=message,
+                file_name=attachment_data['name'],
+                mime_type=attachment_data['type'],
+                file_size=attachment_data['size'],
+            ))
+
+        # Status rows for all participants except sender are written with the message
+        participants = await self.get_conversation_participants(conversation)
+        recipient_ids = [participant.user_id for participant in participants if participant != user]
+
+        durable = writer.submit(message, attachments, recipient_ids)
+        logger.info(f"Queued message {message_id} for write-behind persistence")
+        return message, durable
+
+    def track_durability(self, durable, message_id, client_seq=None):
+        task = asyncio.ensure_future(self.send_durable_ack(durable, message_id, client_seq))
+        self.pending_acks.add(task)
+        task.add_done_callback(self.pending_acks.discard)
+
+    async def send_durable_ack(self, durable, message_id, client_seq=None):
+        """Tell the sender once the writer has committed the message (or given up on it)."""
+        try:
+            await asyncio.wrap_future(durable)
+            is_durable = True
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Message {message_id} could not be persisted: {str(e)}")
+            is_durable = False
+
+        await self.send(text_data=json.dumps({
+            'type': 'message_ack',
+            'message_id': message_id,
+            'client_seq': client_seq,
+            'durable': is_durable,
+        }))
+
     @sync_to_async
     def save_or_remove_reaction(self, message_id, user, emoji):
         try:
@@ -442,6 +554,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 emoji=emoji,
                 defaults={'created_at': None}  # Will use auto_now_add
             )
+            # Reactions are part of the message history ETag
+            touch_conversations([message.conversation_id])
             if not created:
                 # If reaction already exists, remove it (toggle behavior)
                 reaction.delete()
@@ -457,34 +571,20 @@ class ChatConsumer(AsyncWebsocketConsumer):
             return None
 
     @sync_to_async
-    def get_message_reactions(self, message_id):
+    def get_reaction_update(self, message_id):
+        """
+        A message's reactions in the REST summary format, plus the IDs of the users behind each
+        emoji so that every recipient of the broadcast can set its own `reacted` flag.
+        """
         try:
-            message = Message.objects.get(message_id=message_id)
-            reactions = list(message.reaction_set.values('emoji', 'user__username'))
-            # Group reactions by emoji and collect users
-            reaction_dict = {}
+            reactions = list(Reaction.objects.filter(message_id=message_id).select_related('user'))
+            reactor_ids = {}
             for reaction in reactions:
-                emoji = reaction['emoji']
-                user = reaction['user__username']
-                if emoji not in reaction_dict:
-                    reaction_dict[emoji] = []
-                reaction_dict[emoji].append(user)
-
-            # Format for frontend
-            formatted_reactions = []
-            for emoji, users in reaction_dict.items():
-                formatted_reactions.append({
-                    'emoji': emoji,
-                    'users': users,
-                    'count': len(users)
-                })
-            return formatted_reactions
-        except Message.DoesNotExist:
-            logger.warning(f"Message {message_id} not found when getting reactions")
-            return []
+                reactor_ids.setdefault(reaction.emoji, []).append(reaction.user_id)
+            return summarize_reactions(reactions), reactor_ids
         except Exception as e:
             logger.error(f"Error getting reactions for message {message_id}: {str(e)}")
-            return []
+            return [], {}
 
     @sync_to_async
     def set_user_online(self, user, is_online):
@@ -498,9 +598,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
     @sync_to_async
     def get_user_conversation_ids(self, user):
         try:
-            from .views import get_user_conversations
-            conversations = get_user_conversations(user)
-            return list(conversations.values_list('conversation_id', flat=True))
+            return sorted(get_user_conversation_ids(user.user_id))
         except Exception as e:
             logger.error(f"Error getting conversation ids for user {user.username}: {str(e)}")
             return []
@@ -543,13 +641,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
     @staticmethod
     def _get_conversation_participants_sync(conversation):
         """Helper method to get conversation participants."""
-        participants = []
-        if conversation.type == 'private':
-            private_chat = conversation.privatechat
-            participants = [private_chat.user1, private_chat.user2]
-        elif conversation.type == 'group':
-            participants = [member.user for member in conversation.groupchat.groupmember_set.all()]
-        return participants
+        return list(User.objects.filter(user_id__in=get_member_ids(conversation.conversation_id)))
 
     @sync_to_async
     def is_user_participant(self, conversation, user):
@@ -709,16 +801,12 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
     @sync_to_async
     def update_message_read_status(self, message_id, user):
-        from .models import MessageStatus
         try:
-            updated = MessageStatus.objects.filter(
-                message_id=message_id,
-                user=user
-            ).update(status='read')
+            updated = mark_read(user, [message_id])
             if updated:
                 logger.info(f"User {user.username} marked message {message_id} as read")
             else:
-                logger.warning(f"No MessageStatus found for message {message_id} and user {user.username}")
+                logger.debug(f"No unread MessageStatus found for message {message_id} and user {user.username}")
         except Exception as e:
             logger.error(f"Error updating read status for message {message_id}: {str(e)}")
 
@@ -756,10 +844,12 @@ class ChatConsumer(AsyncWebsocketConsumer):
     @sync_to_async
     def delete_message_content(self, message_id, user):
         try:
-            message = Message.objects.get(message_id=message_id)
-            message.is_deleted = True
-            message.deleted_at = None  # Will use auto_now
-            message.save(update_fields=['is_deleted', 'deleted_at'])
+            with transaction.atomic():
+                message = Message.objects.select_for_update().get(message_id=message_id)
+                record_message_deleted(message)
+                message.is_deleted = True
+                message.deleted_at = timezone.now()
+                message.save(update_fields=['is_deleted', 'deleted_at'])
             logger.info(f"User {user.username} deleted message {message_id}")
         except Message.DoesNotExist:
             logger.warning(f"Message {message_id} not found when deleting")
@@ -770,24 +860,20 @@ class ChatConsumer(AsyncWebsocketConsumer):
     async def send_message_history(self, user, conversation, limit=50):
         try:
             # Get recent messages in this conversation that are not deleted (limited for performance)
-            messages = await sync_to_async(list)(
-                Message.objects.filter(
-                    conversation=conversation,
-                    is_deleted=False
-                ).select_related('sender', 'reply_to', 'reply_to__sender').prefetch_related('reaction_set', 'attachment_set').order_by('-sent_at')[:limit]
-            )
-            # Reverse to maintain chronological order
-            messages.reverse()
+            # Falls back to the archive tier when the hot table has fewer than `limit` messages
+            messages = await sync_to_async(read_from_replica(recent_messages))(conversation.conversation_id, limit)
+            targets = await sync_to_async(read_from_replica(reply_targets))(messages)
 
             for message in messages:
                 try:
-                    # Get reactions for the message
-                    reactions = await self.get_message_reactions(message.message_id)
+                    # Reactions and attachments come from the prefetch
+                    reactions = summarize_reactions(message.reaction_set.all(), user.pk)
 
                     # Get attachment info if exists
                     attachment = None
-                    if hasattr(message, 'attachment_set') and message.attachment_set.exists():
-                        att = message.attachment_set.first()
+                    attachments = list(message.attachment_set.all())
+                    if attachments:
+                        att = attachments[0]
                         attachment = {
                             'name': att.file_name,
                             'type': att.mime_type,
@@ -804,9 +890,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
                         'timestamp': str(message.sent_at),
                         'attachment': attachment,
                         'message_id': message.message_id,
-                        'reply_to': message.reply_to.message_id if message.reply_to else None,
-                        'reply_to_sender': message.reply_to.sender.username if message.reply_to else None,
-                        'reply_to_content': message.reply_to.content if message.reply_to else None,
+                        'reply_to': message.reply_to_id,
+                        'reply_to_sender': targets[message.reply_to_id].sender.username if message.reply_to_id in targets else None,
+                        'reply_to_content': targets[message.reply_to_id].content if message.reply_to_id in targets else None,
                         'reactions': reactions,
                         'is_edited': message.is_edited,
                         'edited_at': str(message.edited_at) if message.edited_at else None,
@@ -816,8 +902,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     continue
 
             logger.info(f"Sent {len(messages)} messages from history to user {user.username} in conversation {conversation.conversation_id}")
+            return len(messages)
         except Exception as e:
             logger.error(f"Error sending message history to user {user.username}: {str(e)}")
+            return 0
 
     async def validate_message(self, content, attachment_data):
         """Validate message content and attachment data."""
@@ -865,8 +953,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     conversation=conversation,
                     messagestatus__user=user,
                     messagestatus__status__in=['sent', 'delivered']
-                ).select_related('sender', 'reply_to', 'reply_to__sender').prefetch_related('reaction_set', 'attachment_set').order_by('sent_at')
+                ).select_related('sender').prefetch_related('reaction_set__user', 'attachment_set').order_by('sent_at')
             )
+            targets = await sync_to_async(reply_targets)(pending_messages)
 
             for message in pending_messages:
                 try:
@@ -878,8 +967,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
                         ).update
                     )(status='delivered')
 
-                    # Get reactions for the message
-                    reactions = await self.get_message_reactions(message.message_id)
+                    # Reactions come from the prefetch
+                    reactions = summarize_reactions(message.reaction_set.all(), user.pk)
 
                     # Get attachment info if exists
                     attachment = None
@@ -901,9 +990,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
                         'timestamp': str(message.sent_at),
                         'attachment': attachment,
                         'message_id': message.message_id,
-                        'reply_to': message.reply_to.message_id if message.reply_to else None,
-                        'reply_to_sender': message.reply_to.sender.username if message.reply_to else None,
-                        'reply_to_content': message.reply_to.content if message.reply_to else None,
+                        'reply_to': message.reply_to_id,
+                        'reply_to_sender': targets[message.reply_to_id].sender.username if message.reply_to_id in targets else None,
+                        'reply_to_content': targets[message.reply_to_id].content if message.reply_to_id in targets else None,
                         'reactions': reactions,
                         'is_edited': message.is_edited,
                         'edited_at': str(message.edited_at) if message.edited_at else None,
@@ -913,5 +1002,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     continue
 
             logger.info(f"Delivered {len(pending_messages)} pending messages to user {user.username} in conversation {conversation.conversation_id}")
+            return len(pending_messages)
         except Exception as e:
-            logger.error(f"Error delivering pending messages to user {user.username}: {str(e)}")
\ No newline at end of file
+            logger.error(f"Error delivering pending messages to user {user.username}: {str(e)}")
+            return 0
\ No newline at end of file
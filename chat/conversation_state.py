@@ -0,0 +1,233 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, FilteredRelation, Max, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, Greatest
+
+from .membership_cache import get_member_ids
+from .models import ArchivedMessageStatus, Conversation, ConversationMember, Message, MessageStatus, UnreadCounter
+
+UNREAD_STATUSES = ['sent', 'delivered']
+
+
+def deliver_message(message):
+    """Create 'sent' statuses for every recipient of a new message and update conversation state."""
+    recipient_ids = [user_id for user_id in get_member_ids(message.conversation_id) if user_id != message.sender_id]
+    with transaction.atomic():
+        MessageStatus.objects.bulk_create(
+            [MessageStatus(message=message, user_id=user_id, status='sent') for user_id in recipient_ids],
+            ignore_conflicts=True
+        )
+        record_messages_sent([(message, recipient_ids)])
+    return recipient_ids
+
+
+def record_messages_sent(deliveries):
+    """
+    Advance last_message/last_activity_at and bump unread counters for newly stored messages.
+    `deliveries` is a list of (message, recipient_ids); call inside the transaction that inserted them.
+    """
+    latest = {}
+    unread = defaultdict(int)
+    for message, recipient_ids in deliveries:
+        current = latest.get(message.conversation_id)
+        if current is None or (message.sent_at, message.message_id) > (current.sent_at, current.message_id):
+            latest[message.conversation_id] = message
+        for user_id in recipient_ids:
+            unread[(message.conversation_id, user_id)] += 1
+
+    stale = []
+    for conversation_id, message in latest.items():
+        # Conditional so a late write-behind flush never moves the preview backwards
+        updated = Conversation.objects.filter(conversation_id=conversation_id).filter(
+            Q(last_message__isnull=True) | Q(last_activity_at__lte=message.sent_at)
+        ).update(last_message=message, last_activity_at=message.sent_at, version=F('version') + 1)
+        if not updated:
+            stale.append(conversation_id)
+    # The history of a conversation still changed when its preview did not
+    touch_conversations(stale)
+
+    _increment_unread(unread)
+
+
+def record_message_deleted(message):
+    """Remove a message from unread counters and the conversation preview. Call before the delete is saved."""
+    with transaction.atomic():
+        if not message.is_deleted:
+            unread_user_ids = list(MessageStatus.objects.filter(
+                message=message,
+                status__in=UNREAD_STATUSES
+            ).values_list('user_id', flat=True))
+            _decrement_unread(message.conversation_id, unread_user_ids)
+
+        conversation = Conversation.objects.select_for_update().get(conversation_id=message.conversation_id)
+        changes = {'version': F('version') + 1}
+        if conversation.last_message_id == message.message_id:
+            changes['last_message'] = Message.objects.filter(
+                conversation_id=message.conversation_id,
+                is_deleted=False
+            ).exclude(message_id=message.message_id).order_by('-sent_at', '-message_id').first()
+        Conversation.objects.filter(conversation_id=conversation.conversation_id).update(**changes)
+
+
+def touch_conversations(conversation_ids):
+    """Bump the version of conversations whose content changed, so their ETags no longer match."""
+    if conversation_ids:
+        Conversation.objects.filter(conversation_id__in=conversation_ids).update(version=F('version') + 1)
+
+
+def conversation_version(conversation):
+    """Validator for one conversation and its messages, from the row alone."""
+    return f"{conversation.conversation_id}:{conversation.version}:{conversation.last_activity_at.isoformat()}"
+
+
+def conversation_list_version(user):
+    """Validator for a user's conversation list: one aggregate query over memberships and unread counters."""
+    summary = Conversation.objects.filter(
+        members__user=user,
+        deleted_at__isnull=True
+    ).annotate(
+        # At most one counter per conversation, so the join does not multiply the other sums
+        own_counter=FilteredRelation('unread_counters', condition=Q(unread_counters__user=user))
+    ).aggregate(
+        count=Count('pk'),
+        ids=Sum('conversation_id'),
+        versions=Sum('version'),
+        latest=Max('last_activity_at'),
+        unread=Sum('own_counter__unread_count')
+    )
+    latest = summary['latest'].isoformat() if summary['latest'] else ''
+    return f"{summary['count']}:{summary['ids']}:{summary['versions']}:{latest}:{summary['unread']}"
+
+
+def mark_read(user, message_ids):
+    """Mark messages read for a user, decrementing unread counters by the statuses that actually changed."""
+    per_conversation = defaultdict(int)
+    updated = 0
+    with transaction.atomic():
+        # Unread statuses of archived messages still count towards the badge
+        for status_model in (MessageStatus, ArchivedMessageStatus):
+            unread = status_model.objects.filter(
+                message_id__in=message_ids,
+                user=user,
+                status__in=UNREAD_STATUSES
+            )
+            for conversation_id, is_deleted in unread.select_for_update().values_list('message__conversation_id', 'message__is_deleted'):
+                if not is_deleted:
+                    per_conversation[conversation_id] += 1
+            updated += unread.update(status='read')
+
+        for conversation_id, count in per_conversation.items():
+            UnreadCounter.objects.filter(conversation_id=conversation_id, user=user).update(
+                unread_count=Greatest(F('unread_count') - count, 0)
+            )
+    return updated
+
+
+def get_unread_counts(user, conversation_ids):
+    """Map conversation_id -> unread count for a user."""
+    return dict(UnreadCounter.objects.filter(
+        user=user,
+        conversation_id__in=conversation_ids
+    ).values_list('conversation_id', 'unread_count'))
+
+
+def get_conversation_titles(user, conversation_ids):
+    """Map conversation_id -> display title as seen by `user`, resolved in one query."""
+    rows = Conversation.objects.filter(conversation_id__in=conversation_ids).values_list(
+        'conversation_id', 'type', 'title',
+        'privatechat__user1_id', 'privatechat__user1__display_name', 'privatechat__user2__display_name'
+    )
+    return {
+        # The other participant of a private chat names it
+        conversation_id: display_title(conversation_type, title, user2_name if user1_id == user.pk else user1_name)
+        for conversation_id, conversation_type, title, user1_id, user1_name, user2_name in rows
+    }
+
+
+def display_title(conversation_type, title, other_display_name=None):
+    """Title of a conversation as shown in lists: the other participant for private chats."""
+    if conversation_type == 'private':
+        return f"Chat with {other_display_name}"
+    return title or "Group Chat"
+
+
+def inbox_queryset(user):
+    """
+    A user's live conversations, most recently active first, with everything the conversation list
+    shows in one query: last message and its sender, the private chat's users, member and unread counts.
+    """
+    members = ConversationMember.objects.filter(conversation=OuterRef('pk')).order_by().values('conversation')
+    return Conversation.objects.filter(
+        members__user=user,
+        deleted_at__isnull=True
+    ).select_related(
+        'last_message__sender', 'privatechat__user1', 'privatechat__user2'
+    ).annotate(
+        member_count=Subquery(members.annotate(count=Count('*')).values('count')),
+        unread_count=Coalesce(
+            Subquery(UnreadCounter.objects.filter(conversation=OuterRef('pk'), user=user).values('unread_count')[:1]),
+            0
+        )
+    ).order_by('-last_activity_at', '-conversation_id')
+
+
+def recompute(conversation_ids):
+    """Rebuild last_message, last_activity_at and unread counters for a batch of conversations."""
+    latest_live = Message.objects.filter(
+        conversation_id=OuterRef('conversation_id'),
+        is_deleted=False
+    ).order_by('-sent_at', '-message_id')
+
+    with transaction.atomic():
+        Conversation.objects.filter(conversation_id__in=conversation_ids).update(
+            last_message=Subquery(latest_live.values('message_id')[:1]),
+            last_activity_at=Coalesce(
+                Subquery(
+                    Message.objects.filter(conversation_id=OuterRef('conversation_id'))
+                    .values('conversation_id').annotate(latest=Max('sent_at')).values('latest')[:1]
+                ),
+                F('created_at')
+            )
+        )
+
+        unread = defaultdict(int)
+        for status_model in (MessageStatus, ArchivedMessageStatus):
+            counts = status_model.objects.filter(
+                message__conversation_id__in=conversation_ids,
+                message__is_deleted=False,
+                status__in=UNREAD_STATUSES
+            ).values('message__conversation_id', 'user_id').annotate(unread=Count('id'))
+            for row in counts:
+                unread[(row['message__conversation_id'], row['user_id'])] += row['unread']
+
+        UnreadCounter.objects.filter(conversation_id__in=conversation_ids).delete()
+        UnreadCounter.objects.bulk_create([
+            UnreadCounter(conversation_id=conversation_id, user_id=user_id, unread_count=count)
+            for (conversation_id, user_id), count in unread.items()
+        ])
+
+
+def _increment_unread(unread):
+    if not unread:
+        return
+    UnreadCounter.objects.bulk_create(
+        [UnreadCounter(conversation_id=conversation_id, user_id=user_id) for conversation_id, user_id in unread],
+        ignore_conflicts=True
+    )
+    # One UPDATE per conversation and increment size rather than one per user
+    grouped = defaultdict(list)
+    for (conversation_id, user_id), count in unread.items():
+        grouped[(conversation_id, count)].append(user_id)
+    for (conversation_id, count), user_ids in grouped.items():
+        UnreadCounter.objects.filter(conversation_id=conversation_id, user_id__in=user_ids).update(
+            unread_count=F('unread_count') + count
+        )
+
+
+def _decrement_unread(conversation_id, user_ids):
+    if not user_ids:
+        return
+    UnreadCounter.objects.filter(conversation_id=conversation_id, user_id__in=user_ids).update(
+        unread_count=Greatest(F('unread_count') - 1, 0)
+    )
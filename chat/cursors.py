@@ -0,0 +1,27 @@
+import base64
+import binascii
+from datetime import datetime
+
+# Parsers for the (sent_at, message_id) position shared by message lists, exports and audit pages
+TIMESTAMP_POSITION = (datetime.fromisoformat, int)
+
+
+def encode_cursor(*values):
+    """
+    Opaque cursor for a keyset position. Datetimes are written as ISO 8601 and everything else
+    with str(), which round-trips floats exactly, so ties stay on the same side of the cursor.
+    """
+    position = '|'.join(value.isoformat() if isinstance(value, datetime) else str(value) for value in values)
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, *parsers):
+    """
+    The values of a cursor from encode_cursor(), each read with its parser. Only the leading value
+    may contain '|'. Raises ValueError for a malformed cursor.
+    """
+    try:
+        values = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').rsplit('|', len(parsers) - 1)
+        return tuple(parse(value) for parse, value in zip(parsers, values, strict=True))
+    except (ValueError, UnicodeError, binascii.Error):
+        raise ValueError('Invalid cursor')
@@ -0,0 +1,94 @@
+import contextvars
+import logging
+import random
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+logger = logging.getLogger(__name__)
+
+# Set around read-mostly code paths; everything else keeps using the primary
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+# The user whose request or socket is being served, for read-your-writes pinning
+_acting_user_id = contextvars.ContextVar('acting_user_id', default=None)
+
+
+def get_replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def _pin_key(user_id):
+    return f'db_primary_pin:{user_id}'
+
+
+def pin_to_primary(user_id):
+    """Send this user's replica reads to the primary for DB_REPLICA_STICKY_SECONDS."""
+    cache.set(_pin_key(user_id), True, timeout=getattr(settings, 'DB_REPLICA_STICKY_SECONDS', 5))
+
+
+def is_pinned(user_id):
+    return cache.get(_pin_key(user_id)) is not None
+
+
+def set_acting_user(user_id):
+    """Record who is being served in the current context. Returns a token for reset_acting_user()."""
+    return _acting_user_id.set(user_id)
+
+
+def reset_acting_user(token):
+    _acting_user_id.reset(token)
+
+
+@contextmanager
+def use_replica():
+    """Route reads inside the block to a replica unless the acting user recently wrote."""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def read_from_replica(func):
+    """Decorator form of use_replica() for views and sync helpers."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with use_replica():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    """
+    Sends reads made inside use_replica() to a random replica alias and every write to the
+    primary. A user's own writes pin them to the primary for a short window so they always
+    see what they just sent.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get():
+            return None
+        replicas = get_replicas()
+        if not replicas:
+            return None
+        user_id = _acting_user_id.get()
+        if user_id is not None and is_pinned(user_id):
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        user_id = _acting_user_id.get()
+        if user_id is not None and get_replicas():
+            pin_to_primary(user_id)
+        # Never fall back to instance._state.db, which may be a replica the object was read from
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas carry the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in get_replicas()
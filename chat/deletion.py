@@ -0,0 +1,198 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .conversation_state import recompute
+from .membership_cache import invalidate_conversation, invalidate_membership
+from .models import (
+    ArchivedAttachment, ArchivedMessage, ArchivedMessageStatus, ArchivedReaction,
+    Attachment, Conversation, ConversationMember, DeletionJob, GroupMember,
+    Message, MessageStatus, Reaction, UnreadCounter, User
+)
+from .persistence import BatchWriter
+
+logger = logging.getLogger(__name__)
+
+FILE_MODELS = (Attachment, ArchivedAttachment)
+
+
+def request_conversation_deletion(conversation, requested_by=None):
+    """Tombstone a conversation right away and queue the actual deletion. Returns the DeletionJob."""
+    with transaction.atomic():
+        Conversation.objects.filter(conversation_id=conversation.conversation_id).update(deleted_at=timezone.now())
+        invalidate_conversation(conversation.conversation_id)
+        job = DeletionJob.objects.create(
+            target_type='conversation',
+            target_id=conversation.conversation_id,
+            requested_by=requested_by
+        )
+        transaction.on_commit(lambda: enqueue_deletion(job))
+    return job
+
+
+def request_user_deletion(user, requested_by=None):
+    """Deactivate a user and tombstone the conversations that go with them, then queue the deletion."""
+    with transaction.atomic():
+        User.objects.filter(user_id=user.user_id).update(is_active=False, is_online=False, updated_at=timezone.now())
+        owned_conversation_ids = _owned_conversation_ids(user.user_id)
+        Conversation.objects.filter(conversation_id__in=owned_conversation_ids).update(deleted_at=timezone.now())
+        for conversation_id in owned_conversation_ids:
+            invalidate_conversation(conversation_id)
+        invalidate_membership(user_ids=[user.user_id])
+        job = DeletionJob.objects.create(target_type='user', target_id=user.user_id, requested_by=requested_by)
+        transaction.on_commit(lambda: enqueue_deletion(job))
+    return job
+
+
+def run_deletion_job(job_id, chunk_size=None):
+    """Run (or resume) a deletion job. Every step only sees rows that are still left, so re-running is safe."""
+    chunk_size = chunk_size or getattr(settings, 'DELETION_CHUNK_SIZE', 1000)
+    job = DeletionJob.objects.get(job_id=job_id)
+    if job.status == 'completed':
+        return job
+
+    DeletionJob.objects.filter(job_id=job_id).update(
+        status='running',
+        started_at=job.started_at or timezone.now(),
+        error=''
+    )
+    try:
+        if job.target_type == 'conversation':
+            steps = _conversation_steps(job.target_id)
+            affected_conversation_ids = []
+        else:
+            steps = []
+            # Private chats and groups the user created would otherwise be cascaded in one go
+            owned_conversation_ids = _owned_conversation_ids(job.target_id)
+            for conversation_id in owned_conversation_ids:
+                steps.extend(_conversation_steps(conversation_id))
+            steps.extend(_user_steps(job.target_id))
+            affected_conversation_ids = list(ConversationMember.objects.filter(
+                user_id=job.target_id
+            ).exclude(conversation_id__in=owned_conversation_ids).values_list('conversation_id', flat=True))
+
+        for step, queryset in steps:
+            _delete_in_chunks(job, step, queryset, chunk_size)
+
+        # The user's messages are gone from groups they stay listed in; fix previews and unread counts
+        DeletionJob.objects.filter(job_id=job_id).update(step='conversation state')
+        for start in range(0, len(affected_conversation_ids), chunk_size):
+            recompute(affected_conversation_ids[start:start + chunk_size])
+
+        DeletionJob.objects.filter(job_id=job_id).update(status='completed', step='', finished_at=timezone.now())
+        logger.info(f"Deletion job {job_id} for {job.target_type} {job.target_id} completed")
+    except Exception as e:
+        logger.error(f"Deletion job {job_id} for {job.target_type} {job.target_id} failed: {str(e)}")
+        DeletionJob.objects.filter(job_id=job_id).update(status='failed', error=str(e))
+        raise
+    job.refresh_from_db()
+    return job
+
+
+def _owned_conversation_ids(user_id):
+    return list(Conversation.objects.filter(
+        Q(privatechat__user1_id=user_id) | Q(privatechat__user2_id=user_id) | Q(groupchat__created_by_id=user_id)
+    ).values_list('conversation_id', flat=True).distinct())
+
+
+def _conversation_steps(conversation_id):
+    # Children before parents so no single DELETE has to cascade through a large table
+    return [
+        ('message statuses', MessageStatus.objects.filter(message__conversation_id=conversation_id)),
+        ('reactions', Reaction.objects.filter(message__conversation_id=conversation_id)),
+        ('attachments', Attachment.objects.filter(message__conversation_id=conversation_id)),
+        ('messages', Message.objects.filter(conversation_id=conversation_id)),
+        ('archived message statuses', ArchivedMessageStatus.objects.filter(message__conversation_id=conversation_id)),
+        ('archived reactions', ArchivedReaction.objects.filter(message__conversation_id=conversation_id)),
+        ('archived attachments', ArchivedAttachment.objects.filter(message__conversation_id=conversation_id)),
+        ('archived messages', ArchivedMessage.objects.filter(conversation_id=conversation_id)),
+        ('unread counters', UnreadCounter.objects.filter(conversation_id=conversation_id)),
+        ('group members', GroupMember.objects.filter(group_chat_id=conversation_id)),
+        ('members', ConversationMember.objects.filter(conversation_id=conversation_id)),
+        ('conversation', Conversation.objects.filter(conversation_id=conversation_id)),
+    ]
+
+
+def _user_steps(user_id):
+    return [
+        ('received message statuses', MessageStatus.objects.filter(user_id=user_id)),
+        ('sent message statuses', MessageStatus.objects.filter(message__sender_id=user_id)),
+        ('reactions', Reaction.objects.filter(user_id=user_id)),
+        ('reactions on sent messages', Reaction.objects.filter(message__sender_id=user_id)),
+        ('attachments', Attachment.objects.filter(message__sender_id=user_id)),
+        ('messages', Message.objects.filter(sender_id=user_id)),
+        ('archived received message statuses', ArchivedMessageStatus.objects.filter(user_id=user_id)),
+        ('archived sent message statuses', ArchivedMessageStatus.objects.filter(message__sender_id=user_id)),
+        ('archived reactions', ArchivedReaction.objects.filter(user_id=user_id)),
+        ('archived reactions on sent messages', ArchivedReaction.objects.filter(message__sender_id=user_id)),
+        ('archived attachments', ArchivedAttachment.objects.filter(message__sender_id=user_id)),
+        ('archived messages', ArchivedMessage.objects.filter(sender_id=user_id)),
+        ('unread counters', UnreadCounter.objects.filter(user_id=user_id)),
+        ('group memberships', GroupMember.objects.filter(user_id=user_id)),
+        ('memberships', ConversationMember.objects.filter(user_id=user_id)),
+        ('user', User.objects.filter(user_id=user_id)),
+    ]
+
+
+def _delete_in_chunks(job, step, queryset, chunk_size):
+    model = queryset.model
+    DeletionJob.objects.filter(job_id=job.job_id).update(step=step)
+    while True:
+        with transaction.atomic():
+            pks = list(queryset.values_list('pk', flat=True)[:chunk_size])
+            if not pks:
+                return
+            files = []
+            if model in FILE_MODELS:
+                files = [name for name in model.objects.filter(pk__in=pks).values_list('file', flat=True) if name]
+            deleted, _ = model.objects.filter(pk__in=pks).delete()
+            DeletionJob.objects.filter(job_id=job.job_id).update(rows_deleted=F('rows_deleted') + deleted)
+
+        # Files are removed only after the rows that point at them are committed as gone
+        removed = delete_attachment_files(files)
+        if removed:
+            DeletionJob.objects.filter(job_id=job.job_id).update(files_deleted=F('files_deleted') + removed)
+
+
+def delete_attachment_files(names):
+    """Remove attachment files from storage, logging any that fail. Returns how many were removed."""
+    removed = 0
+    for name in names:
+        try:
+            default_storage.delete(name)
+            removed += 1
+        except Exception as e:
+            logger.warning(f"Could not delete attachment file {name}: {str(e)}")
+    return removed
+
+
+class DeletionWorker(BatchWriter):
+    """Runs queued deletion jobs one at a time in the background; failed jobs are retried and resume where they stopped."""
+
+    name = 'deletion-worker'
+
+    def write_batch(self, items):
+        for job_id in items:
+            run_deletion_job(job_id)
+
+
+_deletion_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_deletion_worker():
+    global _deletion_worker
+    with _worker_lock:
+        if _deletion_worker is None:
+            _deletion_worker = DeletionWorker(batch_size=1, max_retries=getattr(settings, 'DELETION_MAX_RETRIES', 3), retry_backoff=1.0)
+            _deletion_worker.start()
+        return _deletion_worker
+
+
+def enqueue_deletion(job):
+    return get_deletion_worker().submit(job.job_id)
@@ -0,0 +1,52 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from .cursors import decode_cursor, encode_cursor
+from .models import User
+from .user_index import normalize
+
+# What the directory shows about a user; no e-mail addresses
+DIRECTORY_FIELDS = ('user_id', 'username', 'display_name', 'profile_image_url', 'is_online')
+
+
+def directory_page(query='', cursor=None, limit=20, exclude_user_id=None):
+    """
+    One page of active users ordered by username, optionally narrowed to those whose username or
+    display name starts with `query`, ignoring case and accents. First pages of short, hot
+    prefixes come from the shared cache. Returns (users, next_cursor); raises ValueError for a bad cursor.
+    """
+    prefix = normalize(query)
+    after = decode_cursor(cursor, str, int) if cursor else None
+
+    cacheable = after is None and len(prefix) <= settings.DIRECTORY_CACHE_PREFIX_LENGTH
+    key = f"directory:{limit}:{hashlib.md5(prefix.encode('utf-8'), usedforsecurity=False).hexdigest()}"
+    rows = cache.get(key) if cacheable else None
+    if rows is None:
+        # Two extra rows: one may be the requesting user, the other tells whether a next page exists
+        rows = list(directory_queryset(prefix, after)[:limit + 2])
+        if cacheable:
+            cache.set(key, rows, timeout=settings.DIRECTORY_CACHE_TIMEOUT)
+
+    rows = [row for row in rows if row['user_id'] != exclude_user_id][:limit + 1]
+    next_cursor = encode_cursor(rows[limit - 1]['username_key'], rows[limit - 1]['user_id']) if len(rows) > limit else None
+    return [{field: row[field] for field in DIRECTORY_FIELDS} for row in rows[:limit]], next_cursor
+
+
+def directory_queryset(prefix='', after=None):
+    """Active users as directory rows in (folded username, user_id) order, from `after` on."""
+    users = User.objects.filter(is_active=True)
+    if prefix:
+        users = users.filter(_prefix_range('username_key', prefix) | _prefix_range('display_name_key', prefix))
+    if after is not None:
+        username_key, user_id = after
+        users = users.filter(Q(username_key__gt=username_key) | Q(username_key=username_key, user_id__gt=user_id))
+    return users.order_by('username_key', 'user_id').values('username_key', *DIRECTORY_FIELDS)
+
+
+def _prefix_range(field, prefix):
+    """`field` starts with `prefix`, written as a range so the index on it can answer it."""
+    upper = prefix[:-1] + chr(min(ord(prefix[-1]) + 1, 0x10FFFF))
+    return Q(**{f'{field}__gte': prefix, f'{field}__lt': upper})
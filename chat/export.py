@@ -0,0 +1,78 @@
+import heapq
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+from .cursors import encode_cursor
+from .models import ArchivedMessage, Message
+
+EXPORT_PREFETCH = ('reaction_set', 'reaction_set__user', 'attachment_set')
+
+
+def export_messages(conversation_id, after=None, batch_size=None):
+    """
+    Yield every live message of a conversation, archived and hot, as export records in
+    (sent_at, message_id) order, starting after the `after` position. Reads keyset batches of
+    `batch_size` from each tier, so memory stays flat however long the conversation is.
+    """
+    batch_size = batch_size or settings.MESSAGE_EXPORT_BATCH_SIZE
+    tiers = [
+        model.objects.filter(conversation_id=conversation_id, is_deleted=False).select_related('sender').prefetch_related(*EXPORT_PREFETCH)
+        for model in (ArchivedMessage, Message)
+    ]
+
+    while True:
+        position = Q()
+        if after is not None:
+            sent_at, message_id = after
+            position = Q(sent_at__gt=sent_at) | Q(sent_at=sent_at, message_id__gt=message_id)
+        # A hot message can be older than archived ones (conversation previews stay hot), so merge the tiers
+        batch = list(heapq.merge(
+            *(tier.filter(position).order_by('sent_at', 'message_id')[:batch_size] for tier in tiers),
+            key=lambda message: (message.sent_at, message.message_id)
+        ))[:batch_size]
+        if not batch:
+            return
+        for message in batch:
+            yield export_record(message)
+        after = (batch[-1].sent_at, batch[-1].message_id)
+
+
+def export_record(message):
+    """One message with its reactions and attachment metadata; `cursor` resumes the export after it."""
+    return {
+        'message_id': message.message_id,
+        'conversation_id': message.conversation_id,
+        'sender_id': message.sender_id,
+        'sender': message.sender.username,
+        'type': message.type,
+        'content': message.content,
+        'sent_at': message.sent_at,
+        'reply_to_id': message.reply_to_id,
+        'is_edited': message.is_edited,
+        'edited_at': message.edited_at,
+        'reactions': [
+            {'user_id': reaction.user_id, 'username': reaction.user.username, 'emoji': reaction.emoji, 'created_at': reaction.created_at}
+            for reaction in message.reaction_set.all()
+        ],
+        'attachments': [
+            {
+                'attachment_id': attachment.attachment_id,
+                'file_name': attachment.file_name,
+                'mime_type': attachment.mime_type,
+                'file_size': attachment.file_size,
+                'file': attachment.file.name or None,
+                'thumbnail_url': attachment.thumbnail_url,
+            }
+            for attachment in message.attachment_set.all()
+        ],
+        'cursor': encode_cursor(message.sent_at, message.message_id),
+    }
+
+
+def export_lines(conversation_id, after=None, batch_size=None):
+    """The export as NDJSON: one UTF-8 encoded JSON object per line."""
+    for record in export_messages(conversation_id, after=after, batch_size=batch_size):
+        yield json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False).encode('utf-8') + b'\n'
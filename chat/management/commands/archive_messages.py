@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat.archive import archive_messages
+
+
+class Command(BaseCommand):
+    help = 'Move messages older than MESSAGE_ARCHIVE_AFTER_DAYS, with their reactions, attachments and statuses, to the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.MESSAGE_ARCHIVE_AFTER_DAYS, help='Archive messages older than this many days')
+        parser.add_argument('--batch-size', type=int, default=settings.MESSAGE_ARCHIVE_BATCH_SIZE, help='Messages moved per transaction')
+        parser.add_argument('--max-batches', type=int, default=None, help='Stop after this many batches')
+        parser.add_argument('--compress', action='store_true', default=settings.MESSAGE_ARCHIVE_COMPRESS, help='Store archived content zlib-compressed')
+        parser.add_argument('--no-compress', action='store_false', dest='compress')
+        parser.add_argument('--interval', type=int, default=0, help='Keep running and archive every N seconds (for use as a scheduled job)')
+
+    def handle(self, *args, **options):
+        while True:
+            archived = archive_messages(
+                older_than_days=options['days'],
+                batch_size=options['batch_size'],
+                compress=options['compress'],
+                max_batches=options['max_batches'],
+            )
+            self.stdout.write(self.style.SUCCESS(f"Archived {archived} messages older than {options['days']} days"))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
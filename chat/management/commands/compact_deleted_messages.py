@@ -0,0 +1,37 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat.compaction import compact_deleted_messages
+
+
+class Command(BaseCommand):
+    help = 'Purge the content, statuses, reactions and attachments of messages deleted more than MESSAGE_COMPACTION_GRACE_DAYS ago'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.MESSAGE_COMPACTION_GRACE_DAYS, help='Compact messages deleted more than this many days ago')
+        parser.add_argument('--batch-size', type=int, default=settings.MESSAGE_COMPACTION_BATCH_SIZE, help='Messages compacted per transaction')
+        parser.add_argument('--max-batches', type=int, default=None, help='Stop after this many batches')
+        parser.add_argument('--throttle', type=float, default=settings.MESSAGE_COMPACTION_THROTTLE, help='Seconds to sleep between batches')
+        parser.add_argument('--hard-delete', action='store_true', default=settings.MESSAGE_COMPACTION_HARD_DELETE, help='Delete the message rows instead of clearing their content')
+        parser.add_argument('--no-hard-delete', action='store_false', dest='hard_delete')
+        parser.add_argument('--interval', type=int, default=0, help='Keep running and compact every N seconds (for use as a scheduled job)')
+
+    def handle(self, *args, **options):
+        while True:
+            run = compact_deleted_messages(
+                grace_days=options['days'],
+                batch_size=options['batch_size'],
+                hard_delete=options['hard_delete'],
+                throttle=options['throttle'],
+                max_batches=options['max_batches'],
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f"Reclaimed {run.rows_reclaimed} rows: {run.messages_compacted} messages compacted, "
+                f"{run.messages_purged} purged, {run.statuses_deleted} statuses, {run.reactions_deleted} reactions, "
+                f"{run.attachments_deleted} attachments ({run.files_deleted} files)"
+            ))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.cursors import TIMESTAMP_POSITION, decode_cursor
+from chat.export import export_lines
+from chat.models import Conversation
+
+
+class Command(BaseCommand):
+    help = 'Write the history of a conversation, with reactions and attachment metadata, as NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('conversation_id', type=int)
+        parser.add_argument('--output', default='-', help='File to write (appended to when resuming); - for stdout')
+        parser.add_argument('--after', default=None, help='Resume after this cursor (the `cursor` of the last line written)')
+        parser.add_argument('--batch-size', type=int, default=settings.MESSAGE_EXPORT_BATCH_SIZE, help='Messages read per query')
+
+    def handle(self, *args, **options):
+        conversation_id = options['conversation_id']
+        if not Conversation.objects.filter(conversation_id=conversation_id).exists():
+            raise CommandError(f"Conversation {conversation_id} does not exist")
+        try:
+            after = decode_cursor(options['after'], *TIMESTAMP_POSITION) if options['after'] else None
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        lines = export_lines(conversation_id, after=after, batch_size=options['batch_size'])
+        if options['output'] == '-':
+            for line in lines:
+                self.stdout.write(line.decode('utf-8'), ending='')
+            return
+
+        written = 0
+        with open(options['output'], 'ab' if after else 'wb') as output:
+            for line in lines:
+                output.write(line)
+                written += 1
+        self.stdout.write(self.style.SUCCESS(f"Exported {written} messages of conversation {conversation_id} to {options['output']}"))
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat.audit import prune_audit_log
+
+
+class Command(BaseCommand):
+    help = 'Delete audit log entries in calendar months older than AUDIT_LOG_RETENTION_DAYS and create upcoming monthly partitions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.AUDIT_LOG_RETENTION_DAYS, help='Keep this many days of audit history')
+        parser.add_argument('--batch-size', type=int, default=settings.AUDIT_LOG_PRUNE_BATCH_SIZE, help='Entries deleted per transaction')
+
+    def handle(self, *args, **options):
+        deleted = prune_audit_log(retention_days=options['days'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} audit log entries"))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from chat.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Recreate the message full-text search index and refill it from the message table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to rebuild the index on')
+
+    def handle(self, *args, **options):
+        backend = get_search_backend(options['database'])
+        backend.install(connections[options['database']])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt search index with {type(backend).__name__}"))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from chat.conversation_state import recompute
+from chat.models import Conversation
+
+
+class Command(BaseCommand):
+    help = 'Recompute last_message, last_activity_at and unread counters for conversations in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Conversations repaired per transaction')
+        parser.add_argument('conversation_ids', nargs='*', type=int, help='Limit the repair to these conversations')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        conversations = Conversation.objects.order_by('conversation_id')
+        if options['conversation_ids']:
+            conversations = conversations.filter(conversation_id__in=options['conversation_ids'])
+
+        repaired = 0
+        last_id = 0
+        while True:
+            # Keyset batches so each transaction stays short on large tables
+            batch = list(conversations.filter(conversation_id__gt=last_id).values_list('conversation_id', flat=True)[:batch_size])
+            if not batch:
+                break
+            recompute(batch)
+            repaired += len(batch)
+            last_id = batch[-1]
+            self.stdout.write(f"Repaired {repaired} conversations")
+
+        self.stdout.write(self.style.SUCCESS(f"Conversation state repaired for {repaired} conversations"))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from chat.deletion import run_deletion_job
+from chat.models import DeletionJob
+
+
+class Command(BaseCommand):
+    help = 'Run deletion jobs that are pending or were interrupted (e.g. by a restart), optionally retrying failed ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('job_ids', nargs='*', type=int, help='Only run these jobs')
+        parser.add_argument('--include-failed', action='store_true', help='Also retry failed jobs')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Rows deleted per transaction')
+
+    def handle(self, *args, **options):
+        statuses = ['pending', 'running'] + (['failed'] if options['include_failed'] else [])
+        jobs = DeletionJob.objects.filter(status__in=statuses).order_by('created_at')
+        if options['job_ids']:
+            jobs = jobs.filter(job_id__in=options['job_ids'])
+
+        for job_id in list(jobs.values_list('job_id', flat=True)):
+            try:
+                job = run_deletion_job(job_id, chunk_size=options['chunk_size'])
+                self.stdout.write(self.style.SUCCESS(
+                    f"Job {job.job_id}: deleted {job.rows_deleted} rows and {job.files_deleted} files from {job.target_type} {job.target_id}"
+                ))
+            except Exception as e:
+                self.stderr.write(f"Job {job_id} failed: {str(e)}")
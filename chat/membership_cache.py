@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+
+def _user_key(user_id):
+    return f'user_conversations:{user_id}'
+
+
+def _conversation_key(conversation_id):
+    return f'conversation_members:{conversation_id}'
+
+
+def get_user_conversation_ids(user_id):
+    """IDs of the live (not tombstoned) conversations a user belongs to, loaded lazily into the shared cache."""
+    conversation_ids = cache.get(_user_key(user_id))
+    if conversation_ids is None:
+        from .models import ConversationMember
+        # Always from the primary: a lagging replica's rows would outlive the on-commit invalidation
+        conversation_ids = frozenset(ConversationMember.objects.using(DEFAULT_DB_ALIAS).filter(
+            user_id=user_id,
+            conversation__deleted_at__isnull=True
+        ).values_list('conversation_id', flat=True))
+        cache.set(_user_key(user_id), conversation_ids, timeout=_timeout())
+    return conversation_ids
+
+
+def get_member_ids(conversation_id):
+    """User IDs of everyone in a conversation, loaded lazily into the shared cache."""
+    member_ids = cache.get(_conversation_key(conversation_id))
+    if member_ids is None:
+        from .models import ConversationMember
+        member_ids = frozenset(ConversationMember.objects.using(DEFAULT_DB_ALIAS).filter(
+            conversation_id=conversation_id
+        ).values_list('user_id', flat=True))
+        cache.set(_conversation_key(conversation_id), member_ids, timeout=_timeout())
+    return member_ids
+
+
+def is_member(user_id, conversation_id):
+    """Whether a user belongs to a live conversation: one cache read and a set lookup."""
+    return conversation_id in get_user_conversation_ids(user_id)
+
+
+def invalidate_membership(conversation_id=None, user_ids=()):
+    """
+    Forget cached membership for a conversation and/or users. Runs now, so the current
+    transaction sees its own change, and again on commit, so a reader that loaded the old
+    rows in the meantime cannot leave them cached.
+    """
+    keys = [_user_key(user_id) for user_id in user_ids]
+    if conversation_id is not None:
+        keys.append(_conversation_key(conversation_id))
+    if not keys:
+        return
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_conversation(conversation_id):
+    """Forget a conversation and the conversation lists of all its members, e.g. when it is tombstoned."""
+    invalidate_membership(conversation_id, get_member_ids(conversation_id))
+
+
+def _timeout():
+    return getattr(settings, 'MEMBERSHIP_CACHE_TIMEOUT', 300)
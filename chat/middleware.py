@@ -0,0 +1,28 @@
+from .db_router import reset_acting_user, set_acting_user
+from .permission_cache import request_permission_cache
+
+
+class ReplicaRoutingMiddleware:
+    """Tells the database router which user a request is for, so their writes pin them to the primary."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        user = getattr(request, 'user', None)
+        token = set_acting_user(user.pk if user is not None and user.is_authenticated else None)
+        try:
+            return self.get_response(request)
+        finally:
+            reset_acting_user(token)
+
+
+class PermissionCacheMiddleware:
+    """Resolves each user's permissions at most once per request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with request_permission_cache():
+            return self.get_response(request)
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:29
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_alter_user_email'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='sent_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_alter_message_sent_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['-timestamp'], name='audit_log_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['conversation', 'sent_at'], name='message_conv_live_sent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='messagestatus',
+            index=models.Index(fields=['user', 'status'], name='message_status_user_status_idx'),
+        ),
+    ]
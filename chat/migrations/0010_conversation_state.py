@@ -0,0 +1,83 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:41
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_conversation_state(apps, schema_editor):
+    Conversation = apps.get_model('chat', 'Conversation')
+    Message = apps.get_model('chat', 'Message')
+    MessageStatus = apps.get_model('chat', 'MessageStatus')
+    UnreadCounter = apps.get_model('chat', 'UnreadCounter')
+
+    Conversation.objects.update(
+        last_message=Subquery(
+            Message.objects.filter(conversation_id=OuterRef('conversation_id'), is_deleted=False)
+            .order_by('-sent_at', '-message_id').values('message_id')[:1]
+        ),
+        last_activity_at=Coalesce(
+            Subquery(
+                Message.objects.filter(conversation_id=OuterRef('conversation_id'))
+                .values('conversation_id').annotate(latest=Max('sent_at')).values('latest')[:1]
+            ),
+            F('created_at')
+        )
+    )
+
+    counts = MessageStatus.objects.filter(
+        message__is_deleted=False,
+        status__in=['sent', 'delivered']
+    ).values('message__conversation_id', 'user_id').annotate(unread=Count('id'))
+    UnreadCounter.objects.bulk_create([
+        UnreadCounter(conversation_id=row['message__conversation_id'], user_id=row['user_id'], unread_count=row['unread'])
+        for row in counts
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_add_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnreadCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'unread_counter',
+            },
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['-last_activity_at'], name='conversation_activity_idx'),
+        ),
+        migrations.AddField(
+            model_name='unreadcounter',
+            name='conversation',
+            field=models.ForeignKey(db_column='conversation_id', on_delete=django.db.models.deletion.CASCADE, related_name='unread_counters', to='chat.conversation'),
+        ),
+        migrations.AddField(
+            model_name='unreadcounter',
+            name='user',
+            field=models.ForeignKey(db_column='user_id', on_delete=django.db.models.deletion.CASCADE, related_name='unread_counters', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='unreadcounter',
+            unique_together={('conversation', 'user')},
+        ),
+        migrations.RunPython(backfill_conversation_state, migrations.RunPython.noop),
+    ]
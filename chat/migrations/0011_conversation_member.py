@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:45
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_conversation_members(apps, schema_editor):
+    ConversationMember = apps.get_model('chat', 'ConversationMember')
+    PrivateChat = apps.get_model('chat', 'PrivateChat')
+    GroupMember = apps.get_model('chat', 'GroupMember')
+
+    members = []
+    for private_chat in PrivateChat.objects.all().iterator():
+        for user_id in {private_chat.user1_id, private_chat.user2_id}:
+            members.append(ConversationMember(
+                conversation_id=private_chat.conversation_id,
+                user_id=user_id,
+                role='member',
+                joined_at=private_chat.created_at,
+            ))
+    for group_member in GroupMember.objects.all().iterator():
+        members.append(ConversationMember(
+            conversation_id=group_member.group_chat_id,
+            user_id=group_member.user_id,
+            role=group_member.role,
+            joined_at=group_member.joined_at,
+        ))
+    ConversationMember.objects.bulk_create(members, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_conversation_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationMember',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('admin', 'Admin'), ('moderator', 'Moderator'), ('member', 'Member')], default='member', max_length=20)),
+                ('joined_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('conversation', models.ForeignKey(db_column='conversation_id', on_delete=django.db.models.deletion.CASCADE, related_name='members', to='chat.conversation')),
+                ('user', models.ForeignKey(db_column='user_id', on_delete=django.db.models.deletion.CASCADE, related_name='conversation_memberships', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'conversation_member',
+                'indexes': [models.Index(fields=['user', 'conversation'], name='conv_member_user_conv_idx')],
+                'unique_together': {('conversation', 'user')},
+            },
+        ),
+        migrations.RunPython(backfill_conversation_members, migrations.RunPython.noop),
+    ]
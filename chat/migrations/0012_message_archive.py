@@ -0,0 +1,99 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_conversation_member'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='reply_to',
+            field=models.ForeignKey(blank=True, db_column='reply_to_id', db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='chat.message'),
+        ),
+        migrations.CreateModel(
+            name='ArchivedMessage',
+            fields=[
+                ('message_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('type', models.CharField(choices=[('text', 'Text'), ('image', 'Image'), ('file', 'File'), ('system', 'System')], default='text', max_length=10)),
+                ('body', models.TextField(blank=True)),
+                ('body_compressed', models.BinaryField(blank=True, null=True)),
+                ('sent_at', models.DateTimeField()),
+                ('is_edited', models.BooleanField(default=False)),
+                ('is_deleted', models.BooleanField(default=False)),
+                ('edited_at', models.DateTimeField(blank=True, null=True)),
+                ('deleted_at', models.DateTimeField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('conversation', models.ForeignKey(db_column='conversation_id', on_delete=django.db.models.deletion.CASCADE, related_name='archived_messages', to='chat.conversation')),
+                ('reply_to', models.ForeignKey(blank=True, db_column='reply_to_id', db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='chat.message')),
+                ('sender', models.ForeignKey(db_column='sender_id', on_delete=django.db.models.deletion.CASCADE, related_name='archived_messages', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'archived_message',
+                'ordering': ['sent_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedAttachment',
+            fields=[
+                ('attachment_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('file', models.FileField(blank=True, null=True, upload_to='attachments/')),
+                ('file_name', models.CharField(max_length=255)),
+                ('mime_type', models.CharField(max_length=100)),
+                ('file_size', models.IntegerField()),
+                ('thumbnail_url', models.URLField(blank=True, null=True)),
+                ('message', models.ForeignKey(db_column='message_id', on_delete=django.db.models.deletion.CASCADE, related_name='attachment_set', to='chat.archivedmessage')),
+            ],
+            options={
+                'db_table': 'archived_attachment',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedMessageStatus',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('sent', 'Sent'), ('delivered', 'Delivered'), ('read', 'Read')], default='sent', max_length=10)),
+                ('updated_at', models.DateTimeField()),
+                ('message', models.ForeignKey(db_column='message_id', on_delete=django.db.models.deletion.CASCADE, related_name='messagestatus_set', to='chat.archivedmessage')),
+                ('user', models.ForeignKey(db_column='user_id', on_delete=django.db.models.deletion.CASCADE, related_name='archived_message_statuses', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'archived_message_status',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedReaction',
+            fields=[
+                ('reaction_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('emoji', models.CharField(max_length=10)),
+                ('created_at', models.DateTimeField()),
+                ('message', models.ForeignKey(db_column='message_id', on_delete=django.db.models.deletion.CASCADE, related_name='reaction_set', to='chat.archivedmessage')),
+                ('user', models.ForeignKey(db_column='user_id', on_delete=django.db.models.deletion.CASCADE, related_name='archived_reactions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'archived_reaction',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archivedmessage',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['conversation', 'sent_at'], name='archived_msg_conv_live_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedmessagestatus',
+            index=models.Index(fields=['user', 'status'], name='archived_status_user_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='archivedmessagestatus',
+            unique_together={('message', 'user')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='archivedreaction',
+            unique_together={('message', 'user', 'emoji')},
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_message_archive'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='archivedmessage',
+            name='archived_msg_conv_live_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='message_conv_live_sent_idx',
+        ),
+        migrations.AddIndex(
+            model_name='archivedmessage',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['conversation', 'sent_at', 'message_id'], name='archived_msg_conv_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['conversation', 'sent_at', 'message_id'], name='message_conv_live_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0013_message_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='DeletionJob',
+            fields=[
+                ('job_id', models.AutoField(primary_key=True, serialize=False)),
+                ('target_type', models.CharField(choices=[('conversation', 'Conversation'), ('user', 'User')], max_length=20)),
+                ('target_id', models.IntegerField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('step', models.CharField(blank=True, max_length=50)),
+                ('rows_deleted', models.BigIntegerField(default=0)),
+                ('files_deleted', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('requested_by', models.ForeignKey(blank=True, db_column='requested_by', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'deletion_job',
+                'indexes': [models.Index(fields=['status', 'created_at'], name='deletion_job_status_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:06
+
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Coalesce
+
+
+def backfill_deleted_at(apps, schema_editor):
+    # Messages deleted over the websocket were saved without a deletion time; date them so compaction sees them
+    for model_name in ('Message', 'ArchivedMessage'):
+        apps.get_model('chat', model_name).objects.filter(is_deleted=True, deleted_at__isnull=True).update(
+            deleted_at=Coalesce(F('edited_at'), F('sent_at'))
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0014_deletion_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompactionRun',
+            fields=[
+                ('run_id', models.AutoField(primary_key=True, serialize=False)),
+                ('grace_days', models.IntegerField()),
+                ('hard_delete', models.BooleanField(default=False)),
+                ('messages_compacted', models.IntegerField(default=0)),
+                ('messages_purged', models.IntegerField(default=0)),
+                ('statuses_deleted', models.IntegerField(default=0)),
+                ('reactions_deleted', models.IntegerField(default=0)),
+                ('attachments_deleted', models.IntegerField(default=0)),
+                ('files_deleted', models.IntegerField(default=0)),
+                ('rows_reclaimed', models.BigIntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'compaction_run',
+                'ordering': ['-started_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='archivedmessage',
+            name='compacted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='compacted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='archivedmessage',
+            index=models.Index(condition=models.Q(('compacted_at__isnull', True), ('is_deleted', True)), fields=['deleted_at'], name='archived_msg_compaction_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('compacted_at__isnull', True), ('is_deleted', True)), fields=['deleted_at'], name='message_compaction_idx'),
+        ),
+        migrations.RunPython(backfill_deleted_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0015_message_compaction'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='auditlog',
+            name='audit_log_timestamp_idx',
+        ),
+        migrations.AlterField(
+            model_name='auditlog',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['timestamp', 'log_id'], name='audit_log_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['action', 'timestamp', 'log_id'], name='audit_log_action_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+from chat.search import get_search_backend
+
+
+def install_search_index(apps, schema_editor):
+    get_search_backend(schema_editor.connection.alias).install(schema_editor.connection)
+
+
+def uninstall_search_index(apps, schema_editor):
+    get_search_backend(schema_editor.connection.alias).uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+    # On SQLite, a later migration that rebuilds the `message` table drops the FTS triggers with it;
+    # such a migration has to call install_search_index again (or run `manage.py rebuild_search_index`).
+
+    dependencies = [
+        ('chat', '0016_audit_log_pipeline'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0017_message_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attachment',
+            index=models.Index(fields=['message', 'mime_type'], name='attachment_message_mime_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['sender', 'sent_at'], name='message_sender_sent_idx'),
+        ),
+    ]
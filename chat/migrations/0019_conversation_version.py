@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0018_search_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:08
+
+from django.db import migrations, models
+
+from chat.user_index import normalize
+
+
+def backfill_name_keys(apps, schema_editor):
+    User = apps.get_model('chat', 'User')
+    users = User.objects.only('user_id', 'username', 'display_name').order_by('user_id')
+    last_id = 0
+    while True:
+        # Each chunk is written as soon as it is read, so memory stays flat however many users there are
+        chunk = list(users.filter(user_id__gt=last_id)[:1000])
+        if not chunk:
+            return
+        for user in chunk:
+            user.username_key = normalize(user.username)
+            user.display_name_key = normalize(user.display_name)
+        User.objects.bulk_update(chunk, ['username_key', 'display_name_key'])
+        last_id = chunk[-1].user_id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0019_conversation_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='display_name_key',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='username_key',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(backfill_name_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(models.F('username_key'), models.F('user_id'), condition=models.Q(('is_active', True)), name='user_username_key_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(models.F('display_name_key'), models.F('user_id'), condition=models.Q(('is_active', True)), name='user_display_name_key_idx'),
+        ),
+    ]
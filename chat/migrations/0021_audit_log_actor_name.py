@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:57
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_actor_names(apps, schema_editor):
+    AuditLog = apps.get_model('chat', 'AuditLog')
+    User = apps.get_model('chat', 'User')
+    AuditLog.objects.update(actor_name=Subquery(User.objects.filter(user_id=OuterRef('actor_id')).values('username')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0020_user_name_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='auditlog',
+            name='actor_name',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='auditlog',
+            name='actor',
+            field=models.ForeignKey(db_column='actor_id', null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_actor_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations
+
+from chat.audit_partitions import is_partitioned, partition_audit_log
+
+
+def partition_audit_log_table(apps, schema_editor):
+    # Only PostgreSQL partitions the table; SQLite keeps one table and prunes it with DELETEs
+    if is_partitioned(schema_editor.connection):
+        partition_audit_log(schema_editor, apps.get_model('chat', 'AuditLog'))
+
+
+class Migration(migrations.Migration):
+    # Reversing leaves the table partitioned, which Django reads and writes like the plain table
+
+    dependencies = [
+        ('chat', '0021_audit_log_actor_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_audit_log_table, migrations.RunPython.noop),
+    ]
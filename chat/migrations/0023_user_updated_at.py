@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0022_audit_log_partitions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['updated_at'], name='user_updated_at_idx'),
+        ),
+    ]
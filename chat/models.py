@@ -1,8 +1,13 @@
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
 from django.core.validators import MinLengthValidator
+from django.utils import timezone
 import uuid
 import logging
+import zlib
+from .membership_cache import is_member
+from .permission_cache import get_permission_codes
+from .user_index import normalize
 
 logger = logging.getLogger(__name__)
 
@@ -41,6 +46,11 @@ class User(AbstractBaseUser):
     profile_image_url = models.URLField(blank=True, null=True)
     enable_notifications = models.BooleanField(default=True)
     notification_sound = models.BooleanField(default=True)
+    # Case- and accent-folded names for directory search, written from Python (see save())
+    username_key = models.CharField(max_length=255, default='', editable=False)
+    display_name_key = models.CharField(max_length=255, default='', editable=False)
+    # When a name or is_active last changed; other processes' user indexes refresh from it (chat.user_index)
+    updated_at = models.DateTimeField(auto_now=True)
 
     objects = UserManager()
 
@@ -49,35 +59,45 @@ class User(AbstractBaseUser):
 
     class Meta:
         db_table = 'user'
+        indexes = [
+            # Directory: ordered browsing and prefix search on the folded names (chat.directory)
+            models.Index('username_key', 'user_id', name='user_username_key_idx', condition=models.Q(is_active=True)),
+            models.Index('display_name_key', 'user_id', name='user_display_name_key_idx', condition=models.Q(is_active=True)),
+            models.Index(fields=['updated_at'], name='user_updated_at_idx'),
+        ]
 
     def __str__(self):
         return self.username
 
+    def save(self, *args, **kwargs):
+        # Folded here rather than with the database's LOWER(), which only folds ASCII on SQLite.
+        # QuerySet.update(username=...) or update(display_name=...) bypasses this and leaves the keys stale.
+        self.username_key = normalize(self.username)
+        self.display_name_key = normalize(self.display_name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            extra = set()
+            if {'username', 'display_name'}.intersection(update_fields):
+                extra.update(('username_key', 'display_name_key'))
+            if {'username', 'display_name', 'is_active'}.intersection(update_fields):
+                # auto_now is only written for fields being saved; presence-only saves leave it alone
+                extra.add('updated_at')
+            if extra:
+                kwargs['update_fields'] = {*update_fields, *extra}
+        super().save(*args, **kwargs)
+
     def has_perm(self, perm, obj=None):
         """Check if user has a specific permission."""
         if self.is_superuser:
             return True
-
-        # Check permissions through roles
-        user_permissions = set()
-        for user_role in self.userrole_set.all():
-            for role_perm in user_role.role.rolepermission_set.all():
-                user_permissions.add(role_perm.permission.code)
-
-        return perm in user_permissions
+        return perm in get_permission_codes(self)
 
     def has_perms(self, perm_list, obj=None):
         """Check if user has a list of permissions."""
         if self.is_superuser:
             return True
-
-        # Check permissions through roles
-        user_permissions = set()
-        for user_role in self.userrole_set.all():
-            for role_perm in user_role.role.rolepermission_set.all():
-                user_permissions.add(role_perm.permission.code)
-
-        return all(perm in user_permissions for perm in perm_list)
+        codes = get_permission_codes(self)
+        return all(perm in codes for perm in perm_list)
 
     def has_module_perms(self, app_label):
         """Check if user has permissions for a specific app."""
@@ -87,13 +107,7 @@ class User(AbstractBaseUser):
         """Get all permissions for this user."""
         if self.is_superuser:
             return Permission.objects.all()
-
-        permissions = set()
-        for user_role in self.userrole_set.all():
-            for role_perm in user_role.role.rolepermission_set.all():
-                permissions.add(role_perm.permission)
-
-        return list(permissions)
+        return list(Permission.objects.filter(role__userrole__user=self).distinct())
 
     def get_user_roles(self):
         """Get all roles for this user."""
@@ -120,13 +134,8 @@ class User(AbstractBaseUser):
             return False
 
     def _check_conversation_access(self, conversation):
-        """Helper method to check conversation access based on type."""
-        if conversation.type == 'private':
-            private_chat = conversation.privatechat
-            return private_chat.user1 == self or private_chat.user2 == self
-        elif conversation.type == 'group':
-            return conversation.groupchat.groupmember_set.filter(user=self).exists()
-        return False
+        """Helper method to check conversation access through membership."""
+        return is_member(self.pk, conversation.pk)
 
     def can_send_message(self, conversation):
         """Check if user can send messages in a conversation."""
@@ -155,54 +164,38 @@ class User(AbstractBaseUser):
             return True
         return False
 
-    def can_manage_group(self, group_chat):
+    def can_manage_group(self, group_chat, authorization=None):
         """Check if user can manage a group chat."""
-        if not self.can_access_conversation(group_chat.conversation):
-            return False
-
-        member = group_chat.groupmember_set.filter(user=self).first()
-        if not member:
-            return False
-
-        # Group creator has admin privileges
-        if group_chat.created_by == self:
-            return True
-
-        # Check role-based permissions
-        if member.role == 'admin':
-            return True
-
-        return self.has_perm('manage_group_members') or self.has_perm('manage_group_settings')
+        authorization = authorization or GroupAuthorization.load(group_chat, [self.pk])
+        return authorization.can_manage(self)
 
-    def can_kick_member(self, group_chat, target_user):
+    def can_kick_member(self, group_chat, target_user, authorization=None):
         """Check if user can kick a member from group."""
-        if not self.can_manage_group(group_chat):
-            return False
-
-        if target_user == group_chat.created_by:
-            return False  # Cannot kick group creator
+        authorization = authorization or GroupAuthorization.load(group_chat, [self.pk, target_user.pk])
+        return authorization.can_kick(self, target_user.pk)
 
-        target_member = group_chat.groupmember_set.filter(user=target_user).first()
-        if not target_member:
-            return False
-
-        # Admins can kick moderators and members, moderators can only kick members
-        user_member = group_chat.groupmember_set.filter(user=self).first()
-        if user_member.role == 'admin':
-            return target_member.role in ['moderator', 'member']
-        elif user_member.role == 'moderator':
-            return target_member.role == 'member'
-
-        return self.has_perm('kick_members')
-
-    def can_ban_member(self, group_chat, target_user):
+    def can_ban_member(self, group_chat, target_user, authorization=None):
         """Check if user can ban a member from group."""
-        return self.has_perm('ban_members') and self.can_manage_group(group_chat)
+        authorization = authorization or GroupAuthorization.load(group_chat, [self.pk])
+        return authorization.can_ban(self)
 
-    def is_group_admin(self, group_chat):
+    def is_group_admin(self, group_chat, authorization=None):
         """Check if user is admin of the group."""
-        member = group_chat.groupmember_set.filter(user=self).first()
-        return member and (member.role == 'admin' or group_chat.created_by == self)
+        authorization = authorization or GroupAuthorization.load(group_chat, [self.pk])
+        return authorization.is_admin(self.pk)
+
+    def get_group_moderation(self, group_chat):
+        """What this user may do to every member of a group, evaluated from one query."""
+        authorization = GroupAuthorization.for_all_members(group_chat)
+        can_ban = authorization.can_ban(self)
+        return {
+            user_id: {
+                'role': role,
+                'can_kick': authorization.can_kick(self, user_id),
+                'can_ban': can_ban,
+            }
+            for user_id, role in authorization.roles.items()
+        }
 
 class Permission(models.Model):
     permission_id = models.AutoField(primary_key=True)
@@ -261,9 +254,18 @@ class Conversation(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     title = models.CharField(max_length=200, blank=True, null=True)
     last_message = models.ForeignKey('Message', on_delete=models.SET_NULL, null=True, blank=True, related_name='last_message_conversations')
+    # Maintained by chat.conversation_state alongside last_message
+    last_activity_at = models.DateTimeField(default=timezone.now)
+    # Tombstone set when a background deletion job is queued
+    deleted_at = models.DateTimeField(null=True, blank=True)
+    # Bumped whenever messages, reactions or settings of the conversation change; feeds the ETags
+    version = models.PositiveBigIntegerField(default=0)
 
     class Meta:
         db_table = 'conversation'
+        indexes = [
+            models.Index(fields=['-last_activity_at'], name='conversation_activity_idx'),
+        ]
 
     def __str__(self):
         return f"Conversation {self.conversation_id} ({self.type})"
@@ -316,6 +318,86 @@ class GroupMember(models.Model):
     def __str__(self):
         return f"{self.user.username} in {self.group_chat}"
 
+class GroupAuthorization:
+    """
+    Snapshot of the group roles needed to evaluate moderation permissions, loaded in one query.
+    Load it for the acting user and any targets, or for every member with for_all_members().
+    """
+
+    def __init__(self, group_chat, roles):
+        self.group_chat = group_chat
+        self.created_by_id = group_chat.created_by_id
+        self.roles = roles
+
+    @classmethod
+    def load(cls, group_chat, user_ids):
+        roles = dict(GroupMember.objects.filter(
+            group_chat_id=group_chat.pk,
+            user_id__in=user_ids
+        ).values_list('user_id', 'role'))
+        return cls(group_chat, roles)
+
+    @classmethod
+    def for_all_members(cls, group_chat):
+        return cls(group_chat, dict(GroupMember.objects.filter(group_chat_id=group_chat.pk).values_list('user_id', 'role')))
+
+    def role(self, user_id):
+        return self.roles.get(user_id)
+
+    def is_admin(self, user_id):
+        role = self.role(user_id)
+        return role is not None and (role == 'admin' or user_id == self.created_by_id)
+
+    def can_manage(self, user):
+        role = self.role(user.pk)
+        if role is None:
+            return False
+        if user.pk == self.created_by_id or role == 'admin':
+            return True
+        return user.has_perm('manage_group_members') or user.has_perm('manage_group_settings')
+
+    def can_kick(self, user, target_user_id):
+        if not self.can_manage(user):
+            return False
+        if target_user_id == self.created_by_id:
+            return False  # Cannot kick group creator
+
+        target_role = self.role(target_user_id)
+        if target_role is None:
+            return False
+
+        # Admins can kick moderators and members, moderators can only kick members
+        role = self.role(user.pk)
+        if role == 'admin':
+            return target_role in ['moderator', 'member']
+        elif role == 'moderator':
+            return target_role == 'member'
+
+        return user.has_perm('kick_members')
+
+    def can_ban(self, user):
+        return user.has_perm('ban_members') and self.can_manage(user)
+
+class ConversationMember(models.Model):
+    """One row per participant of any conversation, kept in sync from PrivateChat and GroupMember."""
+    ROLE_CHOICES = GroupMember.ROLE_CHOICES
+
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, db_column='conversation_id', related_name='members')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_column='user_id', related_name='conversation_memberships')
+    role = models.CharField(max_length=20, choices=ROLE_CHOICES, default='member')
+    joined_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'conversation_member'
+        unique_together = ('conversation', 'user')
+        indexes = [
+            # A user's conversations; (conversation, user) is covered by the unique constraint
+            models.Index(fields=['user', 'conversation'], name='conv_member_user_conv_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} in {self.conversation}"
+
 class Message(models.Model):
     MESSAGE_TYPES = [
         ('text', 'Text'),
@@ -329,16 +411,36 @@ class Message(models.Model):
     sender = models.ForeignKey(User, on_delete=models.CASCADE, db_column='sender_id')
     type = models.CharField(max_length=10, choices=MESSAGE_TYPES, default='text')
     content = models.TextField()
-    sent_at = models.DateTimeField(auto_now_add=True)
-    reply_to = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, db_column='reply_to_id')
+    # Stamped at construction so write-behind persistence keeps the broadcast timestamp
+    sent_at = models.DateTimeField(default=timezone.now, editable=False)
+    # Reply targets may have moved to the archive tier, so the link is not enforced by the database
+    reply_to = models.ForeignKey('self', on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, db_column='reply_to_id')
     is_edited = models.BooleanField(default=False)
     is_deleted = models.BooleanField(default=False)
     edited_at = models.DateTimeField(null=True, blank=True)
     deleted_at = models.DateTimeField(null=True, blank=True)
+    # Set once a deleted message's content, statuses and reactions have been purged
+    compacted_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         db_table = 'message'
         ordering = ['sent_at']
+        indexes = [
+            # Conversation history: live messages of a conversation in (sent_at, message_id) keyset order
+            models.Index(
+                fields=['conversation', 'sent_at', 'message_id'],
+                name='message_conv_live_keyset_idx',
+                condition=models.Q(is_deleted=False),
+            ),
+            # Compaction: deleted messages still waiting to be purged
+            models.Index(
+                fields=['deleted_at'],
+                name='message_compaction_idx',
+                condition=models.Q(is_deleted=True, compacted_at__isnull=True),
+            ),
+            # Search scoped to a sender and a date range
+            models.Index(fields=['sender', 'sent_at'], name='message_sender_sent_idx'),
+        ]
 
     def __str__(self):
         return f"Message {self.message_id} from {self.sender.username}"
@@ -354,6 +456,10 @@ class Attachment(models.Model):
 
     class Meta:
         db_table = 'attachment'
+        indexes = [
+            # Search filters: has an attachment / has an attachment of a type, answered from the index alone
+            models.Index(fields=['message', 'mime_type'], name='attachment_message_mime_idx'),
+        ]
 
     def __str__(self):
         return self.file_name
@@ -373,10 +479,27 @@ class MessageStatus(models.Model):
     class Meta:
         db_table = 'message_status'
         unique_together = ('message', 'user')
+        indexes = [
+            # Pending delivery: a user's statuses by state, joined back to the message
+            models.Index(fields=['user', 'status'], name='message_status_user_status_idx'),
+        ]
 
     def __str__(self):
         return f"{self.message.message_id} - {self.user.username}: {self.status}"
 
+class UnreadCounter(models.Model):
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, db_column='conversation_id', related_name='unread_counters')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_column='user_id', related_name='unread_counters')
+    unread_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'unread_counter'
+        unique_together = ('conversation', 'user')
+
+    def __str__(self):
+        return f"{self.user.username} in {self.conversation}: {self.unread_count} unread"
+
 class Reaction(models.Model):
     reaction_id = models.AutoField(primary_key=True)
     message = models.ForeignKey(Message, on_delete=models.CASCADE, db_column='message_id')
@@ -391,6 +514,172 @@ class Reaction(models.Model):
     def __str__(self):
         return f"{self.user.username} reacted {self.emoji} to message {self.message.message_id}"
 
+class ArchivedMessage(models.Model):
+    """Cold-tier copy of a Message; keeps the original message_id and the Message field names."""
+    message_id = models.IntegerField(primary_key=True)
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, db_column='conversation_id', related_name='archived_messages')
+    sender = models.ForeignKey(User, on_delete=models.CASCADE, db_column='sender_id', related_name='archived_messages')
+    type = models.CharField(max_length=10, choices=Message.MESSAGE_TYPES, default='text')
+    body = models.TextField(blank=True)
+    body_compressed = models.BinaryField(null=True, blank=True)
+    sent_at = models.DateTimeField()
+    reply_to = models.ForeignKey(Message, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, db_column='reply_to_id', related_name='+')
+    is_edited = models.BooleanField(default=False)
+    is_deleted = models.BooleanField(default=False)
+    edited_at = models.DateTimeField(null=True, blank=True)
+    deleted_at = models.DateTimeField(null=True, blank=True)
+    compacted_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'archived_message'
+        ordering = ['sent_at']
+        indexes = [
+            models.Index(
+                fields=['conversation', 'sent_at', 'message_id'],
+                name='archived_msg_conv_keyset_idx',
+                condition=models.Q(is_deleted=False),
+            ),
+            models.Index(
+                fields=['deleted_at'],
+                name='archived_msg_compaction_idx',
+                condition=models.Q(is_deleted=True, compacted_at__isnull=True),
+            ),
+        ]
+
+    def __str__(self):
+        return f"Archived message {self.message_id} from {self.sender.username}"
+
+    @property
+    def content(self):
+        if self.body_compressed is not None:
+            return zlib.decompress(bytes(self.body_compressed)).decode('utf-8')
+        return self.body
+
+    @classmethod
+    def from_message(cls, message, compress=False):
+        archived = cls(
+            message_id=message.message_id,
+            conversation_id=message.conversation_id,
+            sender_id=message.sender_id,
+            type=message.type,
+            sent_at=message.sent_at,
+            reply_to_id=message.reply_to_id,
+            is_edited=message.is_edited,
+            is_deleted=message.is_deleted,
+            edited_at=message.edited_at,
+            deleted_at=message.deleted_at,
+            compacted_at=message.compacted_at,
+        )
+        if compress and message.content:
+            archived.body_compressed = zlib.compress(message.content.encode('utf-8'))
+        else:
+            archived.body = message.content
+        return archived
+
+class ArchivedAttachment(models.Model):
+    attachment_id = models.IntegerField(primary_key=True)
+    message = models.ForeignKey(ArchivedMessage, on_delete=models.CASCADE, db_column='message_id', related_name='attachment_set')
+    file = models.FileField(upload_to='attachments/', blank=True, null=True)
+    file_name = models.CharField(max_length=255)
+    mime_type = models.CharField(max_length=100)
+    file_size = models.IntegerField()
+    thumbnail_url = models.URLField(blank=True, null=True)
+
+    class Meta:
+        db_table = 'archived_attachment'
+
+    def __str__(self):
+        return self.file_name
+
+class ArchivedMessageStatus(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    message = models.ForeignKey(ArchivedMessage, on_delete=models.CASCADE, db_column='message_id', related_name='messagestatus_set')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_column='user_id', related_name='archived_message_statuses')
+    status = models.CharField(max_length=10, choices=MessageStatus.STATUS_CHOICES, default='sent')
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'archived_message_status'
+        unique_together = ('message', 'user')
+        indexes = [
+            models.Index(fields=['user', 'status'], name='archived_status_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.message_id} - {self.user.username}: {self.status}"
+
+class ArchivedReaction(models.Model):
+    reaction_id = models.IntegerField(primary_key=True)
+    message = models.ForeignKey(ArchivedMessage, on_delete=models.CASCADE, db_column='message_id', related_name='reaction_set')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_column='user_id', related_name='archived_reactions')
+    emoji = models.CharField(max_length=10)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'archived_reaction'
+        unique_together = ('message', 'user', 'emoji')
+
+    def __str__(self):
+        return f"{self.user.username} reacted {self.emoji} to archived message {self.message_id}"
+
+class DeletionJob(models.Model):
+    TARGET_TYPES = [
+        ('conversation', 'Conversation'),
+        ('user', 'User'),
+    ]
+
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    job_id = models.AutoField(primary_key=True)
+    target_type = models.CharField(max_length=20, choices=TARGET_TYPES)
+    target_id = models.IntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, db_column='requested_by', related_name='+')
+    step = models.CharField(max_length=50, blank=True)
+    rows_deleted = models.BigIntegerField(default=0)
+    files_deleted = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'deletion_job'
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='deletion_job_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"Delete {self.target_type} {self.target_id} ({self.status})"
+
+class CompactionRun(models.Model):
+    """One run of the soft-deleted message compaction job and the rows it reclaimed."""
+    run_id = models.AutoField(primary_key=True)
+    grace_days = models.IntegerField()
+    hard_delete = models.BooleanField(default=False)
+    messages_compacted = models.IntegerField(default=0)
+    messages_purged = models.IntegerField(default=0)
+    statuses_deleted = models.IntegerField(default=0)
+    reactions_deleted = models.IntegerField(default=0)
+    attachments_deleted = models.IntegerField(default=0)
+    files_deleted = models.IntegerField(default=0)
+    rows_reclaimed = models.BigIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'compaction_run'
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f"Compaction run {self.run_id}: {self.rows_reclaimed} rows reclaimed"
+
 class AuditLog(models.Model):
     ACTION_CHOICES = [
         ('create', 'Create'),
@@ -408,18 +697,32 @@ class AuditLog(models.Model):
     ]
 
     log_id = models.AutoField(primary_key=True)
-    actor = models.ForeignKey(User, on_delete=models.CASCADE, db_column='actor_id')
+    # Entries outlive their actor: deleting a user clears the link and keeps the name they acted under
+    actor = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, db_column='actor_id')
+    actor_name = models.CharField(max_length=50, blank=True, default='')
     action = models.CharField(max_length=20, choices=ACTION_CHOICES)
     target_type = models.CharField(max_length=20, choices=TARGET_TYPES)
     target_id = models.IntegerField()
     old_value = models.TextField(blank=True, null=True)
     new_value = models.TextField(blank=True, null=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Stamped when the action happens, not when the audit writer flushes it
+    timestamp = models.DateTimeField(default=timezone.now)
     ip_address = models.GenericIPAddressField()
 
     class Meta:
         db_table = 'audit_log'
         ordering = ['-timestamp']
+        indexes = [
+            # Keyset pages and date ranges, newest first; also drives retention
+            models.Index(fields=['timestamp', 'log_id'], name='audit_log_keyset_idx'),
+            models.Index(fields=['action', 'timestamp', 'log_id'], name='audit_log_action_idx'),
+        ]
 
     def __str__(self):
-        return f"Audit {self.log_id}: {self.actor.username} {self.action} {self.target_type}"
+        return f"Audit {self.log_id}: {self.actor_name} {self.action} {self.target_type}"
+
+    def save(self, *args, **kwargs):
+        # log_action() fills the name itself, since the async writer inserts with bulk_create()
+        if not self.actor_name and self.actor_id is not None:
+            self.actor_name = self.actor.username
+        super().save(*args, **kwargs)
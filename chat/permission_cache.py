@@ -0,0 +1,82 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+# user_id -> permission codes for the request being served; None outside a request
+_request_permissions = contextvars.ContextVar('request_permissions', default=None)
+
+GLOBAL_VERSION_KEY = 'perm_version'
+
+
+def _user_version_key(user_id):
+    return f'perm_version:user:{user_id}'
+
+
+def get_permission_codes(user):
+    """
+    The set of permission codes a user holds through their roles. Looked up in the per-request
+    cache, then the shared cache under versioned keys, then loaded with a single query.
+    """
+    per_request = _request_permissions.get()
+    if per_request is not None and user.pk in per_request:
+        return per_request[user.pk]
+
+    global_version, user_version = _get_versions(user.pk)
+    key = f'user_perms:{user.pk}:{global_version}:{user_version}'
+    codes = cache.get(key)
+    if codes is None:
+        from .models import Permission
+        codes = frozenset(Permission.objects.using(DEFAULT_DB_ALIAS).filter(role__userrole__user_id=user.pk).values_list('code', flat=True))
+        cache.set(key, codes, timeout=getattr(settings, 'PERMISSION_CACHE_TIMEOUT', 300))
+
+    if per_request is not None:
+        per_request[user.pk] = codes
+    return codes
+
+
+def invalidate_user_permissions(user_id):
+    """Drop cached permissions of one user, e.g. after their roles change."""
+    _bump(_user_version_key(user_id))
+    per_request = _request_permissions.get()
+    if per_request is not None:
+        per_request.pop(user_id, None)
+
+
+def invalidate_all_permissions():
+    """Drop every cached permission set, e.g. after a role's permissions change."""
+    _bump(GLOBAL_VERSION_KEY)
+    per_request = _request_permissions.get()
+    if per_request is not None:
+        per_request.clear()
+
+
+@contextmanager
+def request_permission_cache():
+    """Remember resolved permissions for the duration of the block (one request)."""
+    token = _request_permissions.set({})
+    try:
+        yield
+    finally:
+        _request_permissions.reset(token)
+
+
+def _get_versions(user_id):
+    keys = [GLOBAL_VERSION_KEY, _user_version_key(user_id)]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Start from the clock so an evicted version never comes back with an old value
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return versions[GLOBAL_VERSION_KEY], versions[keys[1]]
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
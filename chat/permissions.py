@@ -94,7 +94,7 @@ def group_admin_required(view_func):
 
         from .models import Conversation
         try:
-            conversation = Conversation.objects.get(pk=conversation_id)
+            conversation = Conversation.objects.select_related('groupchat').get(pk=conversation_id)
             if conversation.type != 'group':
                 return HttpResponseForbidden("This operation is only available for group chats.")
 
@@ -168,7 +168,7 @@ class GroupAdminMixin(ConversationAccessMixin):
         if conversation_id:
             from .models import Conversation
             try:
-                conversation = Conversation.objects.get(pk=conversation_id)
+                conversation = Conversation.objects.select_related('groupchat').get(pk=conversation_id)
                 if conversation.type != 'group':
                     return HttpResponseForbidden("This operation is only available for group chats.")
 
@@ -0,0 +1,315 @@
+import atexit
+import collections
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+PERSISTENCE_SYNC = 'sync'
+PERSISTENCE_WRITE_BEHIND = 'write_behind'
+PERSISTENCE_MODES = (PERSISTENCE_SYNC, PERSISTENCE_WRITE_BEHIND)
+
+# Databases reserve_ids() can claim primary keys from; write-behind needs IDs before the insert
+ID_RESERVATION_VENDORS = ('postgresql', 'sqlite')
+
+
+def reserve_ids(model, count, using=DEFAULT_DB_ALIAS):
+    """Reserve `count` primary key values for `model` from the database's own sequence."""
+    connection = connections[using]
+    table = model._meta.db_table
+    pk_column = model._meta.pk.column
+    quote = connection.ops.quote_name
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)",
+                [table, pk_column, count]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+        if connection.vendor == 'sqlite':
+            # AUTOINCREMENT tables never hand out a rowid at or below sqlite_sequence.seq,
+            # so bumping it claims the range for us and for every other writer.
+            with transaction.atomic(using=using):
+                cursor.execute("UPDATE sqlite_sequence SET seq = seq + %s WHERE name = %s", [count, table])
+                if cursor.rowcount == 0:
+                    cursor.execute(
+                        f"INSERT INTO sqlite_sequence (name, seq) "
+                        f"SELECT %s, COALESCE(MAX({quote(pk_column)}), 0) + %s FROM {quote(table)}",
+                        [table, count]
+                    )
+                cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [table])
+                end = cursor.fetchone()[0]
+            return list(range(end - count + 1, end + 1))
+
+    raise NotImplementedError(f"ID reservation is not supported on {connection.vendor}")
+
+
+class IdAllocator:
+    """Hands out primary keys from blocks reserved up front, refilling when a block runs out."""
+
+    def __init__(self, model, block_size=100, using=DEFAULT_DB_ALIAS):
+        self.model = model
+        self.block_size = block_size
+        self.using = using
+        self._ids = collections.deque()
+        self._lock = threading.Lock()
+
+    def allocate(self):
+        with self._lock:
+            if not self._ids:
+                self._ids.extend(reserve_ids(self.model, self.block_size, using=self.using))
+            return self._ids.popleft()
+
+
+class BatchWriter:
+    """
+    Per-process background writer that groups queued items into batches.
+    Subclasses implement write_batch(); failed batches are retried with backoff
+    and, once retries are exhausted, written item by item so one bad row
+    cannot block the rest of the queue.
+    """
+
+    name = 'batch-writer'
+
+    def __init__(self, batch_size=100, flush_interval=0.05, max_retries=5, retry_backoff=0.2):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._queue = queue.Queue()
+        self._write_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
+        logger.info(f"Started {self.name} (batch_size={self.batch_size}, flush_interval={self.flush_interval}s)")
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, item):
+        """Queue an item for writing. Returns a Future resolved once the item is durable."""
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def pending_count(self):
+        return self._queue.qsize()
+
+    def flush(self):
+        """Block until everything queued so far has been written (or dropped after retries)."""
+        if self.running:
+            self._queue.join()
+            return
+        while True:
+            batch = self._take_batch(block=False)
+            if not batch:
+                return
+            self._process(batch)
+
+    def shutdown(self, timeout=30):
+        """Stop the background thread after draining the queue, then flush anything left."""
+        if self.running:
+            self._stopping.set()
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.error(f"{self.name} did not stop within {timeout}s; {self.pending_count()} items still queued")
+                return
+        self._thread = None
+        self.flush()
+
+    def write_batch(self, items):
+        raise NotImplementedError
+
+    def on_batch_written(self, items):
+        """Hook called after a batch has been committed."""
+
+    def _run(self):
+        try:
+            while not (self._stopping.is_set() and self._queue.empty()):
+                batch = self._take_batch(block=True)
+                if batch:
+                    self._process(batch)
+                    close_old_connections()
+        finally:
+            connections.close_all()
+
+    def _take_batch(self, block):
+        batch = []
+        try:
+            if block:
+                batch.append(self._queue.get(timeout=self.flush_interval))
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _process(self, batch):
+        with self._write_lock:
+            try:
+                written = self._write_with_retry(batch)
+                for item, future in written:
+                    future.set_result(item)
+                if written:
+                    try:
+                        self.on_batch_written([item for item, _ in written])
+                    except Exception as e:
+                        logger.error(f"{self.name} post-write hook failed: {str(e)}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_with_retry(self, batch):
+        items = [item for item, _ in batch]
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.write_batch(items)
+                return batch
+            except Exception as e:
+                if attempt == self.max_retries:
+                    logger.error(f"{self.name} batch of {len(batch)} failed after {attempt + 1} attempts: {str(e)}")
+                    break
+                delay = self.retry_backoff * (2 ** attempt)
+                logger.warning(f"{self.name} batch of {len(batch)} failed (attempt {attempt + 1}), retrying in {delay:.2f}s: {str(e)}")
+                time.sleep(delay)
+                if threading.current_thread() is self._thread:
+                    close_old_connections()
+
+        # Isolate the failing rows so the rest of the batch still lands
+        written = []
+        for item, future in batch:
+            try:
+                self.write_batch([item])
+                written.append((item, future))
+            except Exception as e:
+                logger.error(f"{self.name} dropped item after retries: {str(e)}")
+                future.set_exception(e)
+        return written
+
+
+class MessageWriter(BatchWriter):
+    """Batch-inserts messages together with their attachments and status rows."""
+
+    name = 'message-writer'
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+
+    def submit(self, message, attachments=None, recipient_ids=None):
+        """Queue an unsaved Message whose message_id and sent_at are already assigned."""
+        with self._pending_lock:
+            self._pending[message.message_id] = message
+        return super().submit({
+            'message': message,
+            'attachments': attachments or [],
+            'recipient_ids': recipient_ids or [],
+        })
+
+    def get_pending(self, message_id):
+        """Return a queued message that has not reached the database yet."""
+        with self._pending_lock:
+            return self._pending.get(message_id)
+
+    def write_batch(self, items):
+        from .conversation_state import record_messages_sent
+        from .models import Attachment, Message, MessageStatus
+
+        messages = [item['message'] for item in items]
+        attachments = [attachment for item in items for attachment in item['attachments']]
+        statuses = [
+            MessageStatus(message=item['message'], user_id=user_id, status='sent')
+            for item in items
+            for user_id in item['recipient_ids']
+        ]
+
+        with transaction.atomic():
+            Message.objects.bulk_create(messages)
+            if attachments:
+                Attachment.objects.bulk_create(attachments)
+            if statuses:
+                MessageStatus.objects.bulk_create(statuses)
+            record_messages_sent([(item['message'], item['recipient_ids']) for item in items])
+
+        logger.debug(f"Persisted {len(messages)} messages, {len(attachments)} attachments and {len(statuses)} statuses")
+
+    def on_batch_written(self, items):
+        with self._pending_lock:
+            for item in items:
+                self._pending.pop(item['message'].message_id, None)
+
+
+_message_writer = None
+_message_id_allocator = None
+_writer_lock = threading.Lock()
+
+
+def get_persistence_mode():
+    """The configured mode, or sync when write-behind cannot reserve message IDs on this database (see chat.W001)."""
+    mode = getattr(settings, 'MESSAGE_PERSISTENCE_MODE', PERSISTENCE_SYNC)
+    if mode == PERSISTENCE_WRITE_BEHIND and connections[DEFAULT_DB_ALIAS].vendor not in ID_RESERVATION_VENDORS:
+        return PERSISTENCE_SYNC
+    return mode
+
+
+def check_persistence_mode(app_configs=None, **kwargs):
+    """System check: reject unknown modes and report a write-behind setting that falls back to sync."""
+    from django.core.checks import Error, Warning
+
+    mode = getattr(settings, 'MESSAGE_PERSISTENCE_MODE', PERSISTENCE_SYNC)
+    if mode not in PERSISTENCE_MODES:
+        return [Error(
+            f"MESSAGE_PERSISTENCE_MODE must be one of {', '.join(PERSISTENCE_MODES)}, not {mode!r}",
+            id='chat.E001',
+        )]
+    vendor = connections[DEFAULT_DB_ALIAS].vendor
+    if mode == PERSISTENCE_WRITE_BEHIND and vendor not in ID_RESERVATION_VENDORS:
+        return [Warning(
+            f"MESSAGE_PERSISTENCE_MODE=write_behind needs ID reservation, which {vendor} does not support; messages are saved synchronously",
+            hint=f"Use {' or '.join(ID_RESERVATION_VENDORS)}, or set MESSAGE_PERSISTENCE_MODE=sync",
+            id='chat.W001',
+        )]
+    return []
+
+
+def get_message_writer():
+    """Return the per-process message writer, or None when messages are saved synchronously."""
+    global _message_writer
+    if get_persistence_mode() != PERSISTENCE_WRITE_BEHIND:
+        return None
+    with _writer_lock:
+        if _message_writer is None:
+            _message_writer = MessageWriter(
+                batch_size=getattr(settings, 'MESSAGE_WRITER_BATCH_SIZE', 100),
+                flush_interval=getattr(settings, 'MESSAGE_WRITER_FLUSH_INTERVAL', 0.05),
+                max_retries=getattr(settings, 'MESSAGE_WRITER_MAX_RETRIES', 5),
+            )
+            _message_writer.start()
+        return _message_writer
+
+
+def allocate_message_id():
+    """Assign a message_id before the row is written."""
+    global _message_id_allocator
+    from .models import Message
+    with _writer_lock:
+        if _message_id_allocator is None:
+            _message_id_allocator = IdAllocator(Message, block_size=getattr(settings, 'MESSAGE_ID_BLOCK_SIZE', 100))
+    return _message_id_allocator.allocate()
@@ -0,0 +1,224 @@
+import re
+
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVectorField
+from django.db import connections
+from django.db.models import Exists, F, FloatField, OuterRef, TextField, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+
+# Private-use characters around matches in snippets built by the database; turned into offsets before responding
+MATCH_START = '\ue000'
+MATCH_STOP = '\ue001'
+ELLIPSIS = '…'
+
+# Length of a result snippet: tokens for the full-text backends, characters for the substring fallback
+SNIPPET_WORDS = 24
+SNIPPET_CHARS = 160
+
+MARKED_MATCH = re.compile(f'{MATCH_START}(.*?){MATCH_STOP}', re.DOTALL)
+
+# Text search configuration of the PostgreSQL tsvector column; the index has to be rebuilt if it changes
+POSTGRES_SEARCH_CONFIG = 'english'
+
+SQLITE_INDEX_SQL = (
+    # External-content FTS5 table: the text lives in `message`, the index only holds the postings
+    "CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5("
+    "content, content='message', content_rowid='message_id', tokenize='porter unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS message_fts_insert AFTER INSERT ON message BEGIN "
+    "INSERT INTO message_fts(rowid, content) VALUES (new.message_id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS message_fts_delete AFTER DELETE ON message BEGIN "
+    "INSERT INTO message_fts(message_fts, rowid, content) VALUES ('delete', old.message_id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS message_fts_update AFTER UPDATE OF content ON message BEGIN "
+    "INSERT INTO message_fts(message_fts, rowid, content) VALUES ('delete', old.message_id, old.content); "
+    "INSERT INTO message_fts(rowid, content) VALUES (new.message_id, new.content); END",
+    "INSERT INTO message_fts(message_fts) VALUES ('rebuild')",
+)
+SQLITE_DROP_SQL = (
+    "DROP TRIGGER IF EXISTS message_fts_insert",
+    "DROP TRIGGER IF EXISTS message_fts_delete",
+    "DROP TRIGGER IF EXISTS message_fts_update",
+    "DROP TABLE IF EXISTS message_fts",
+)
+
+POSTGRES_INDEX_SQL = (
+    "ALTER TABLE message ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS "
+    f"(to_tsvector('{POSTGRES_SEARCH_CONFIG}', coalesce(content, ''))) STORED",
+    "CREATE INDEX IF NOT EXISTS message_search_vector_idx ON message USING gin (search_vector)",
+)
+POSTGRES_DROP_SQL = (
+    "DROP INDEX IF EXISTS message_search_vector_idx",
+    "ALTER TABLE message DROP COLUMN IF EXISTS search_vector",
+)
+
+
+# Keyset order of search results: best match first, newest first among equal ranks
+SEARCH_ORDERING = ('-search_rank', '-message_id')
+
+
+class SearchBackend:
+    """
+    Full-text search over messages. Backends filter a message queryset and annotate `search_rank`,
+    and `search_snippet` (a window around the matches, marked with MATCH_START/MATCH_STOP) where the
+    database can build it.
+    """
+
+    index_sql = ()
+    drop_sql = ()
+
+    def search(self, messages, query):
+        raise NotImplementedError
+
+    def install(self, connection):
+        """Create (or recreate) the search index and fill it from the existing messages."""
+        with connection.cursor() as cursor:
+            for statement in self.drop_sql + self.index_sql:
+                cursor.execute(statement)
+
+    def uninstall(self, connection):
+        with connection.cursor() as cursor:
+            for statement in self.drop_sql:
+                cursor.execute(statement)
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """FTS5 index kept in sync by triggers on `message`, ranked by bm25."""
+
+    index_sql = SQLITE_INDEX_SQL
+    drop_sql = SQLITE_DROP_SQL
+
+    def search(self, messages, query):
+        match = fts5_query(query)
+        if not match:
+            return messages.none()
+
+        # The FTS5 auxiliary functions only work in a query against the index, hence the correlated lookups by rowid
+        indexed = "FROM message_fts WHERE message_fts MATCH %s AND message_fts.rowid = message.message_id"
+        return messages.filter(
+            message_id__in=RawSQL("SELECT rowid FROM message_fts WHERE message_fts MATCH %s", [match])
+        ).annotate(
+            # bm25 is lower for better matches
+            search_rank=RawSQL(f"SELECT -bm25(message_fts) {indexed}", [match], output_field=FloatField()),
+            search_snippet=RawSQL(
+                f"SELECT snippet(message_fts, 0, %s, %s, %s, %s) {indexed}",
+                [MATCH_START, MATCH_STOP, ELLIPSIS, SNIPPET_WORDS, match],
+                output_field=TextField()
+            ),
+        ).order_by(*SEARCH_ORDERING)
+
+
+class PostgresSearchBackend(SearchBackend):
+    """Stored tsvector column with a GIN index, ranked by ts_rank."""
+
+    index_sql = POSTGRES_INDEX_SQL
+    drop_sql = POSTGRES_DROP_SQL
+
+    def search(self, messages, query):
+        search_query = SearchQuery(query, config=POSTGRES_SEARCH_CONFIG, search_type='websearch')
+        return messages.annotate(
+            search_vector=RawSQL('message.search_vector', [], output_field=SearchVectorField())
+        ).filter(
+            search_vector=search_query
+        ).annotate(
+            # Double precision so a rank read back from a cursor compares equal
+            search_rank=Cast(SearchRank(F('search_vector'), search_query), FloatField()),
+            search_snippet=SearchHeadline(
+                'content',
+                search_query,
+                config=POSTGRES_SEARCH_CONFIG,
+                start_sel=MATCH_START,
+                stop_sel=MATCH_STOP,
+                max_words=SNIPPET_WORDS,
+                min_words=SNIPPET_WORDS // 2,
+                max_fragments=2,
+                fragment_delimiter=f' {ELLIPSIS} '
+            ),
+        ).order_by(*SEARCH_ORDERING)
+
+
+class ContainsSearchBackend(SearchBackend):
+    """Substring match for databases without a full-text index."""
+
+    def search(self, messages, query):
+        return messages.filter(content__icontains=query).annotate(
+            search_rank=Value(0.0, output_field=FloatField())
+        ).order_by(*SEARCH_ORDERING)
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend(),
+    'postgresql': PostgresSearchBackend(),
+}
+
+
+def get_search_backend(using='default'):
+    """The search backend for the engine behind a database alias."""
+    return BACKENDS.get(connections[using].vendor, ContainsSearchBackend())
+
+
+def filter_messages(messages, conversation_id=None, sender_id=None, after=None, before=None, has_attachment=None, mime_type=None):
+    """
+    Narrow messages before they are searched, so the filters are part of the index query and only
+    matching rows get ranked. `after` is inclusive, `before` exclusive; a mime_type like `image/*`
+    matches the whole type.
+    """
+    from .models import Attachment
+
+    if conversation_id is not None:
+        messages = messages.filter(conversation_id=conversation_id)
+    if sender_id is not None:
+        messages = messages.filter(sender_id=sender_id)
+    if after is not None:
+        messages = messages.filter(sent_at__gte=after)
+    if before is not None:
+        messages = messages.filter(sent_at__lt=before)
+
+    attachments = Attachment.objects.filter(message_id=OuterRef('message_id'))
+    if mime_type:
+        if mime_type.endswith('/*'):
+            attachments = attachments.filter(mime_type__startswith=mime_type[:-1])
+        else:
+            attachments = attachments.filter(mime_type=mime_type)
+        messages = messages.filter(Exists(attachments))
+    elif has_attachment is not None:
+        messages = messages.filter(Exists(attachments) if has_attachment else ~Exists(attachments))
+    return messages
+
+
+def fts5_query(text):
+    """Turn user input into an FTS5 query matching every term, so it is never parsed as FTS5 syntax."""
+    return ' '.join(f'"{term}"' for term in re.findall(r'\w+', text))
+
+
+def compile_matcher(query):
+    """Case-insensitive matcher for the substring fallback; compile once and reuse it for a whole page."""
+    return re.compile(re.escape(query.strip()), re.IGNORECASE)
+
+
+def parse_snippet(marked):
+    """Split a database-built snippet into plain text and the [start, end) offsets of its matches."""
+    parts, matches, length, position = [], [], 0, 0
+    for match in MARKED_MATCH.finditer(marked):
+        before, term = marked[position:match.start()], match.group(1)
+        parts.extend((before, term))
+        length += len(before)
+        matches.append([length, length + len(term)])
+        length += len(term)
+        position = match.end()
+    parts.append(marked[position:])
+    return {'text': ''.join(parts), 'matches': matches}
+
+
+def window_snippet(content, matcher, size=SNIPPET_CHARS):
+    """Cut a window of about `size` characters around the first match of `matcher` and report the matches inside it."""
+    first = matcher.search(content)
+    start = 0 if first is None else max(0, min(first.start() - size // 3, len(content) - size))
+    end = min(len(content), start + size)
+    prefix = ELLIPSIS if start > 0 else ''
+    suffix = ELLIPSIS if end < len(content) else ''
+
+    matches = [
+        [len(prefix) + found.start() - start, len(prefix) + found.end() - start]
+        for found in matcher.finditer(content, start, end)
+        if found.end() > found.start()
+    ]
+    return {'text': prefix + content[start:end] + suffix, 'matches': matches}
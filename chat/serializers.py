@@ -1,6 +1,31 @@
 from rest_framework import serializers
 from .models import User, Conversation, Message, Attachment, PrivateChat, GroupChat, GroupMember, Reaction
-import re
+from .conversation_state import display_title
+from .search import compile_matcher, parse_snippet, window_snippet
+
+# Usernames listed per emoji; the count always covers everyone
+REACTION_SAMPLE_SIZE = 3
+
+
+def summarize_reactions(reactions, current_user_id=None, sample_size=REACTION_SAMPLE_SIZE):
+    """
+    Aggregate a message's reactions into one entry per emoji: count, whether the current user
+    reacted, and a sample of usernames. Expects reactions with their user already loaded.
+    """
+    summary = {}
+    for reaction in reactions:
+        entry = summary.setdefault(reaction.emoji, {'emoji': reaction.emoji, 'count': 0, 'reacted': False, 'users': []})
+        entry['count'] += 1
+        if reaction.user_id == current_user_id:
+            entry['reacted'] = True
+        if len(entry['users']) < sample_size:
+            entry['users'].append(reaction.user.username)
+    return list(summary.values())
+
+
+def _current_user_id(context):
+    request = context.get('request')
+    return request.user.pk if request is not None else None
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -9,10 +34,62 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ['user_id', 'created_at', 'last_seen']
 
 class ConversationSerializer(serializers.ModelSerializer):
+    unread_count = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Conversation
+        fields = ['conversation_id', 'type', 'created_at', 'title', 'last_message', 'last_activity_at', 'unread_count']
+        read_only_fields = ['conversation_id', 'created_at', 'last_message', 'last_activity_at']
+
+    def get_unread_count(self, obj):
+        return self.context.get('unread_counts', {}).get(obj.conversation_id, 0)
+
+class ParticipantSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ['user_id', 'username', 'display_name', 'is_online', 'last_seen', 'profile_image_url']
+        read_only_fields = fields
+
+class InboxSerializer(serializers.ModelSerializer):
+    """One conversation list entry; expects the annotations and joins of conversation_state.inbox_queryset."""
+    title = serializers.SerializerMethodField()
+    last_message = serializers.SerializerMethodField()
+    other_participant = serializers.SerializerMethodField()
+    member_count = serializers.IntegerField(read_only=True)
+    unread_count = serializers.IntegerField(read_only=True)
+
     class Meta:
         model = Conversation
-        fields = ['conversation_id', 'type', 'created_at', 'title', 'last_message']
-        read_only_fields = ['conversation_id', 'created_at']
+        fields = ['conversation_id', 'type', 'title', 'last_activity_at', 'last_message', 'other_participant', 'member_count', 'unread_count']
+        read_only_fields = fields
+
+    def get_title(self, obj):
+        other = self._other_participant(obj)
+        return display_title(obj.type, obj.title, other.display_name if other else None)
+
+    def get_last_message(self, obj):
+        message = obj.last_message
+        if message is None:
+            return None
+        return {
+            'message_id': message.message_id,
+            'sender': ParticipantSerializer(message.sender).data,
+            'type': message.type,
+            # Deleted messages keep their place in the list but not their text
+            'content': '' if message.is_deleted else message.content,
+            'is_deleted': message.is_deleted,
+            'sent_at': serializers.DateTimeField().to_representation(message.sent_at),
+        }
+
+    def get_other_participant(self, obj):
+        other = self._other_participant(obj)
+        return ParticipantSerializer(other).data if other else None
+
+    def _other_participant(self, obj):
+        private_chat = getattr(obj, 'privatechat', None) if obj.type == 'private' else None
+        if private_chat is None:
+            return None
+        return private_chat.user2 if private_chat.user1_id == _current_user_id(self.context) else private_chat.user1
 
 class MessageSerializer(serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
@@ -35,8 +112,8 @@ class MessageSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
     def get_reactions(self, obj):
-        reactions = Reaction.objects.filter(message=obj)
-        return ReactionSerializer(reactions, many=True).data
+        # reaction_set exists on both Message and ArchivedMessage and honours prefetch_related
+        return summarize_reactions(obj.reaction_set.all(), _current_user_id(self.context))
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -63,15 +140,18 @@ class ReactionSerializer(serializers.ModelSerializer):
 class MessageSearchSerializer(serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
     conversation_title = serializers.SerializerMethodField()
-    highlighted_content = serializers.SerializerMethodField()
+    snippet = serializers.SerializerMethodField()
     reactions = serializers.SerializerMethodField()
 
     class Meta:
         model = Message
-        fields = ['message_id', 'conversation', 'conversation_title', 'sender', 'type', 'content', 'highlighted_content', 'sent_at', 'reply_to', 'is_edited', 'is_deleted', 'edited_at', 'deleted_at', 'reactions']
+        fields = ['message_id', 'conversation', 'conversation_title', 'sender', 'type', 'content', 'snippet', 'sent_at', 'reply_to', 'is_edited', 'is_deleted', 'edited_at', 'deleted_at', 'reactions']
         read_only_fields = ['message_id', 'sent_at', 'edited_at', 'deleted_at']
 
     def get_conversation_title(self, obj):
+        titles = self.context.get('conversation_titles')
+        if titles is not None and obj.conversation_id in titles:
+            return titles[obj.conversation_id]
         if obj.conversation.type == 'private':
             # Get the other user in the private chat
             private_chat = obj.conversation.privatechat
@@ -81,20 +161,15 @@ class MessageSearchSerializer(serializers.ModelSerializer):
         else:
             return obj.conversation.title or "Group Chat"
 
-    def get_highlighted_content(self, obj):
-        query = self.context.get('search_query', '')
-        if not query:
-            return obj.content
+    def get_snippet(self, obj):
+        """A bounded window of the content around the matches, with [start, end) match offsets instead of markup."""
+        marked = getattr(obj, 'search_snippet', None)
+        if marked is not None:
+            # Built by the search backend, so stemming and multi-term matches agree with the ranking
+            return parse_snippet(marked)
 
-        # Simple highlighting - wrap matches with <mark> tags
-        highlighted = re.sub(
-            f'({re.escape(query)})',
-            r'<mark>\1</mark>',
-            obj.content,
-            flags=re.IGNORECASE
-        )
-        return highlighted
+        matcher = self.context.get('search_matcher') or compile_matcher(self.context.get('search_query', ''))
+        return window_snippet(obj.content, matcher)
 
     def get_reactions(self, obj):
-        reactions = Reaction.objects.filter(message=obj)
-        return ReactionSerializer(reactions, many=True).data
\ No newline at end of file
+        return summarize_reactions(obj.reaction_set.all(), _current_user_id(self.context))
@@ -0,0 +1,169 @@
+import logging
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .conversation_state import touch_conversations
+from .membership_cache import get_user_conversation_ids, invalidate_membership
+from .models import (
+    Conversation, ConversationMember, GroupMember, Message, Permission, PrivateChat, Role, RolePermission, User, UserRole
+)
+from .permission_cache import invalidate_all_permissions, invalidate_user_permissions
+from .user_index import update_user_index
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=PrivateChat)
+def sync_private_chat_members(sender, instance, created, **kwargs):
+    """Mirror both participants of a private chat into ConversationMember."""
+    ConversationMember.objects.bulk_create(
+        [
+            ConversationMember(conversation_id=instance.conversation_id, user_id=user_id, joined_at=instance.created_at)
+            for user_id in {instance.user1_id, instance.user2_id}
+        ],
+        ignore_conflicts=True
+    )
+    # bulk_create sends no ConversationMember signals
+    invalidate_membership(instance.conversation_id, {instance.user1_id, instance.user2_id})
+
+
+@receiver(post_save, sender=GroupMember)
+def sync_group_member(sender, instance, created, **kwargs):
+    """Mirror a group membership and its role into ConversationMember."""
+    ConversationMember.objects.update_or_create(
+        conversation_id=instance.group_chat_id,
+        user_id=instance.user_id,
+        defaults={'role': instance.role},
+        create_defaults={'role': instance.role, 'joined_at': instance.joined_at},
+    )
+
+
+@receiver(post_delete, sender=GroupMember)
+def remove_group_member(sender, instance, **kwargs):
+    """Drop the ConversationMember row when someone leaves or is removed from a group."""
+    deleted, _ = ConversationMember.objects.filter(
+        conversation_id=instance.group_chat_id,
+        user_id=instance.user_id
+    ).delete()
+    if not deleted:
+        logger.warning(f"No ConversationMember found for user {instance.user_id} in group {instance.group_chat_id}")
+
+
+@receiver(post_save, sender=ConversationMember)
+@receiver(post_delete, sender=ConversationMember)
+def invalidate_conversation_member(sender, instance, **kwargs):
+    """Keep the membership cache in step with group joins, leaves and role changes."""
+    invalidate_membership(instance.conversation_id, [instance.user_id])
+
+
+@receiver(post_save, sender=Conversation)
+def invalidate_new_conversation(sender, instance, created, **kwargs):
+    """A new conversation must not pick up a cached member set left by a reused ID."""
+    if created:
+        invalidate_membership(instance.conversation_id)
+
+
+@receiver(post_save, sender=Conversation)
+def touch_edited_conversation(sender, instance, created, **kwargs):
+    """Settings such as the title are part of what the conversation ETags cover."""
+    if not created:
+        touch_conversations([instance.conversation_id])
+
+
+@receiver(post_save, sender=Message)
+def touch_edited_message(sender, instance, created, **kwargs):
+    """Edits and soft deletes change the message history; new messages are covered by record_messages_sent."""
+    if not created:
+        touch_conversations([instance.conversation_id])
+
+
+# User fields that message and conversation payloads embed (see MessageSerializer's sender) and that
+# count towards their ETags. Presence is embedded too but left out: it changes on every connect and
+# disconnect, and clients keep it current from the websocket's status updates.
+USER_PAYLOAD_FIELDS = {'username', 'display_name', 'profile_image_url'}
+
+
+@receiver(post_save, sender=User)
+def touch_user_conversations(sender, instance, created, update_fields=None, **kwargs):
+    """
+    A changed name or picture is part of every conversation showing the user, so their ETags must
+    change: the user's conversations and those they left but wrote in.
+    """
+    if created or (update_fields is not None and not USER_PAYLOAD_FIELDS & set(update_fields)):
+        return
+    conversation_ids = set(get_user_conversation_ids(instance.pk))
+    conversation_ids.update(
+        Message.objects.filter(sender_id=instance.pk).values_list('conversation_id', flat=True).distinct()
+    )
+    touch_conversations(conversation_ids)
+
+
+@receiver(post_save, sender=UserRole)
+@receiver(post_delete, sender=UserRole)
+def invalidate_user_role_permissions(sender, instance, **kwargs):
+    """A role was given to or taken from a user."""
+    invalidate_user_permissions(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+def invalidate_new_user_caches(sender, instance, created, **kwargs):
+    """Start a new account with empty caches so it never sees entries left by a reused ID."""
+    if created:
+        invalidate_user_permissions(instance.pk)
+        invalidate_membership(user_ids=[instance.pk])
+
+
+# Fields the autocomplete index depends on; saves touching none of them (presence, last login) skip it
+USER_INDEX_FIELDS = {'username', 'display_name', 'is_active'}
+
+
+def _indexed_names(user):
+    return (user.username, user.display_name) if user.is_active else None
+
+
+@receiver(pre_save, sender=User)
+def remember_indexed_names(sender, instance, update_fields=None, **kwargs):
+    """Note the names the user is indexed under before they change."""
+    instance._indexed_names = None
+    if instance.pk is None or (update_fields is not None and not USER_INDEX_FIELDS & set(update_fields)):
+        return
+    old = User.objects.filter(pk=instance.pk).values_list('username', 'display_name', 'is_active').first()
+    if old is not None and old[2]:
+        instance._indexed_names = old[:2]
+
+
+@receiver(post_save, sender=User)
+def update_user_index_on_save(sender, instance, created, update_fields=None, **kwargs):
+    """Re-index a new, renamed, deactivated or reactivated user once the change is committed."""
+    if update_fields is not None and not USER_INDEX_FIELDS & set(update_fields):
+        return
+    old_names, new_names = getattr(instance, '_indexed_names', None), _indexed_names(instance)
+    if old_names != new_names:
+        transaction.on_commit(lambda: update_user_index(instance.pk, old_names, new_names))
+
+
+@receiver(post_delete, sender=User)
+def remove_user_from_index(sender, instance, **kwargs):
+    user_id, names = instance.pk, _indexed_names(instance)
+    if names:
+        transaction.on_commit(lambda: update_user_index(user_id, names))
+
+
+@receiver(post_save, sender=Role)
+@receiver(post_delete, sender=Role)
+@receiver(post_save, sender=RolePermission)
+@receiver(post_delete, sender=RolePermission)
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+def invalidate_role_permissions(sender, **kwargs):
+    """A role or permission changed, which can affect any number of users."""
+    invalidate_all_permissions()
+
+
+@receiver(m2m_changed, sender=Role.permissions.through)
+def invalidate_role_permission_set(sender, action, **kwargs):
+    """role.permissions.add()/remove()/clear() bypass RolePermission's save and delete signals."""
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_all_permissions()
@@ -1,18 +1,35 @@
 from django.test import TestCase, Client, TransactionTestCase
 from django.contrib.auth import authenticate
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.cache import cache
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.urls import reverse
+from django.utils import timezone
+from datetime import datetime, timedelta, timezone as dt_timezone
 from django.core.exceptions import ValidationError
 from django.db import IntegrityError
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from channels.testing import WebsocketCommunicator
 from channels.layers import get_channel_layer
-from asgiref.sync import sync_to_async
+from asgiref.sync import async_to_sync, sync_to_async
+import asyncio
 import json
-from unittest.mock import patch, MagicMock
+import os
+import shutil
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest.mock import patch, AsyncMock, MagicMock
 from .models import (
     User, Permission, Role, RolePermission, UserRole, Conversation,
     Message, PrivateChat, GroupChat, GroupMember, Attachment,
-    MessageStatus, Reaction, AuditLog
+    MessageStatus, UnreadCounter, ConversationMember, Reaction, AuditLog,
+    ArchivedMessage, ArchivedMessageStatus, CompactionRun, GroupAuthorization
 )
 from .consumers import ChatConsumer
 from .permissions import (
@@ -20,10 +37,82 @@ from .permissions import (
     conversation_access_required, group_admin_required,
     PermissionMixin, ConversationAccessMixin, GroupAdminMixin
 )
+from .search import (
+    MATCH_START, MATCH_STOP, SNIPPET_CHARS, SQLiteSearchBackend, compile_matcher, filter_messages,
+    fts5_query, get_search_backend, parse_snippet, window_snippet
+)
 from .serializers import (
     UserSerializer, ConversationSerializer, MessageSerializer,
-    AttachmentSerializer, ReactionSerializer, MessageSearchSerializer
+    AttachmentSerializer, ReactionSerializer, MessageSearchSerializer,
+    summarize_reactions
 )
+from .persistence import MessageWriter, IdAllocator, check_persistence_mode, get_message_writer, get_persistence_mode, reserve_ids
+from .conversation_state import deliver_message, mark_read, record_message_deleted
+from .views import get_user_conversations
+from .archive import archive_batch, archive_messages, conversation_messages, get_reply_target, recent_messages, reply_targets
+from .export import export_messages
+from .api_views import MessageCursorPagination
+from .db_router import ReplicaRouter, reset_acting_user, set_acting_user, use_replica
+from .deletion import request_conversation_deletion, request_user_deletion, run_deletion_job
+from .compaction import compact_deleted_messages
+from .audit_partitions import add_months, expired_partitions, partition_name
+from .audit import AuditLogWriter, audit_log_page, log_action, prune_audit_log
+from .permission_cache import get_permission_codes, request_permission_cache
+from .membership_cache import get_member_ids, get_user_conversation_ids, is_member
+from .user_index import SCAN_LIMIT, UserIndex, get_user_index, reset_user_index
+
+
+def make_user(username, display_name='', **extra):
+    return User.objects.create_user(
+        username=username,
+        email=f'{username}@example.com',
+        password='testpass123',
+        display_name=display_name,
+        **extra
+    )
+
+
+def make_private_chat(user1, user2):
+    conversation = Conversation.objects.create(type='private')
+    PrivateChat.objects.create(conversation=conversation, user1=user1, user2=user2)
+    return conversation
+
+
+def make_group(creator, members=(), title='Group'):
+    """A group created by `creator`, who joins as admin, with `members` as plain members. Returns the GroupChat."""
+    conversation = Conversation.objects.create(type='group', title=title)
+    group_chat = GroupChat.objects.create(conversation=conversation, created_by=creator)
+    GroupMember.objects.create(group_chat=group_chat, user=creator, role='admin')
+    for member in members:
+        GroupMember.objects.create(group_chat=group_chat, user=member, role='member')
+    return group_chat
+
+
+class ChatTestCase(TestCase):
+    """Starts each test with an empty cache, so cached permissions, membership and pages never leak between tests."""
+
+    created = 0
+
+    def setUp(self):
+        cache.clear()
+
+    def add_conversations(self, user, count, content='hello'):
+        """
+        For each of `count` new friends, a private chat with `user` where the friend says
+        '<content> private', and a group of both where `user` says '<content> group'.
+        Friends and groups are numbered on from earlier calls in the same test.
+        """
+        conversations = []
+        for _ in range(count):
+            self.created += 1
+            friend = make_user(f'friend{self.created}', f'Friend {self.created}')
+            private = make_private_chat(user, friend)
+            deliver_message(Message.objects.create(conversation=private, sender=friend, content=f'{content} private'))
+
+            group = make_group(user, [friend], title=f'Group {self.created}').conversation
+            deliver_message(Message.objects.create(conversation=group, sender=user, content=f'{content} group'))
+            conversations.extend([private, group])
+        return conversations
 
 # Model Unit Tests
 class UserModelTest(TestCase):
@@ -1157,3 +1246,1878 @@ class EdgeCaseTest(TestCase):
             file_size=10 * 1024 * 1024  # 10MB
         )
         self.assertIsNotNone(large_attachment)
+
+
+# Write-behind Persistence Tests
+class MessageWriterTest(TestCase):
+    def setUp(self):
+        self.user1 = make_user('user1', 'User 1')
+        self.user2 = make_user('user2', 'User 2')
+        self.conversation = make_private_chat(self.user1, self.user2)
+        self.allocator = IdAllocator(Message, block_size=10)
+
+    def _pending_message(self, content='Queued'):
+        return Message(
+            message_id=self.allocator.allocate(),
+            conversation=self.conversation,
+            sender=self.user1,
+            content=content,
+        )
+
+    def test_reserved_ids_are_not_reused(self):
+        """Test that reserved message IDs are skipped by regular inserts"""
+        reserved = reserve_ids(Message, 5)
+        self.assertEqual(len(set(reserved)), 5)
+
+        message = Message.objects.create(conversation=self.conversation, sender=self.user1, content='Direct')
+        self.assertGreater(message.message_id, max(reserved))
+
+    def test_flush_persists_batch(self):
+        """Test that queued messages, attachments and statuses are written together"""
+        writer = MessageWriter(retry_backoff=0)
+        message = self._pending_message()
+        sent_at = message.sent_at
+        attachment = Attachment(message=message, file_name='notes.txt', mime_type='text/plain', file_size=10)
+
+        durable = writer.submit(message, [attachment], [self.user2.user_id])
+        self.assertIs(writer.get_pending(message.message_id), message)
+        writer.flush()
+
+        stored = Message.objects.get(message_id=message.message_id)
+        self.assertEqual(stored.sent_at, sent_at)
+        self.assertEqual(stored.attachment_set.count(), 1)
+        self.assertTrue(MessageStatus.objects.filter(message=stored, user=self.user2, status='sent').exists())
+        self.assertTrue(durable.done())
+        self.assertIsNone(writer.get_pending(message.message_id))
+
+    def test_failed_batch_is_retried(self):
+        """Test that a transient failure is retried"""
+        writer = MessageWriter(retry_backoff=0)
+        message = self._pending_message()
+        write_batch = writer.write_batch
+        attempts = []
+
+        def flaky_write(items):
+            attempts.append(items)
+            if len(attempts) == 1:
+                raise Exception('database is locked')
+            return write_batch(items)
+
+        with patch.object(writer, 'write_batch', side_effect=flaky_write):
+            durable = writer.submit(message)
+            writer.flush()
+
+        self.assertEqual(len(attempts), 2)
+        self.assertIsNone(durable.exception())
+        self.assertTrue(Message.objects.filter(message_id=message.message_id).exists())
+
+    def test_bad_row_does_not_block_batch(self):
+        """Test that a row failing every retry is dropped without losing the rest of the batch"""
+        existing = Message.objects.create(conversation=self.conversation, sender=self.user1, content='Existing')
+        writer = MessageWriter(retry_backoff=0, max_retries=1)
+
+        duplicate = Message(message_id=existing.message_id, conversation=self.conversation, sender=self.user1, content='Duplicate')
+        good = self._pending_message('Good')
+        failed = writer.submit(duplicate)
+        durable = writer.submit(good)
+        writer.flush()
+
+        self.assertIsNotNone(failed.exception())
+        self.assertIsNone(durable.exception())
+        self.assertTrue(Message.objects.filter(message_id=good.message_id).exists())
+        self.assertEqual(Message.objects.get(message_id=existing.message_id).content, 'Existing')
+
+    def test_write_behind_needs_id_reservation(self):
+        """Test that write-behind on a database without ID reservation is reported and falls back to sync"""
+        with override_settings(MESSAGE_PERSISTENCE_MODE='write_behind'):
+            self.assertEqual(check_persistence_mode(), [])
+            self.assertEqual(get_persistence_mode(), 'write_behind')
+            with patch.object(connection, 'vendor', 'oracle'):
+                self.assertEqual([message.id for message in check_persistence_mode()], ['chat.W001'])
+                self.assertEqual(get_persistence_mode(), 'sync')
+                self.assertIsNone(get_message_writer())
+        with override_settings(MESSAGE_PERSISTENCE_MODE='later'):
+            self.assertEqual([message.id for message in check_persistence_mode()], ['chat.E001'])
+
+
+class ChatConsumerInitialSyncTest(TransactionTestCase):
+    def setUp(self):
+        self.user1 = make_user('testuser1', 'Test User 1')
+        self.user2 = make_user('testuser2', 'Test User 2')
+        self.conversation = make_private_chat(self.user1, self.user2)
+        Message.objects.create(conversation=self.conversation, sender=self.user2, content='Earlier message')
+
+    def _communicator(self, user):
+        room_name = str(self.conversation.conversation_id)
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), f'/ws/chat/{room_name}/')
+        communicator.scope['user'] = user
+        communicator.scope['url_route'] = {'kwargs': {'room_name': room_name}}
+        return communicator
+
+    async def test_accept_precedes_initial_state(self):
+        """Test that the handshake completes first and state is streamed with progress frames"""
+        communicator = self._communicator(self.user1)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        frames = []
+        while not frames or frames[-1].get('type') != 'sync_complete':
+            frames.append(await communicator.receive_json_from(timeout=5))
+
+        progress = [frame for frame in frames if frame.get('type') == 'sync_progress']
+        self.assertEqual([frame['stage'] for frame in progress], ['presence', 'history', 'pending'])
+        self.assertEqual(progress[1]['count'], 1)
+        self.assertIn('Earlier message', [frame.get('message') for frame in frames])
+
+        await communicator.disconnect()
+
+    async def test_disconnect_cancels_initial_sync(self):
+        """Test that a socket closed mid-sync stops the background task"""
+        communicator = self._communicator(self.user1)
+
+        async def slow_history(consumer, user, conversation, limit=50):
+            await asyncio.sleep(10)
+
+        with patch.object(ChatConsumer, 'send_message_history', slow_history):
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.disconnect()
+
+        # The application exits cleanly instead of waiting for the history stage
+        self.assertTrue(communicator.future.done())
+
+
+# Query Plan Tests
+class QueryPlanTest(TestCase):
+    """Run EXPLAIN for the hot queries and fail if one of them regresses to a full table scan."""
+
+    def setUp(self):
+        self.user = make_user('testuser', 'Test User')
+        self.conversation = Conversation.objects.create(type='private')
+
+    def explain(self, queryset):
+        from django.db import connection
+        if connection.vendor == 'postgresql':
+            # Tiny test tables always favour a sequential scan unless it is ruled out
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        elif connection.vendor != 'sqlite':
+            self.skipTest(f'No query plan checks for {connection.vendor}')
+        return queryset.explain()
+
+    def assertNoFullScan(self, queryset, table):
+        import re
+        plan = self.explain(queryset)
+        full_scan = re.compile(rf'\bSCAN "?{table}\b"?(?! USING (COVERING )?INDEX)|Seq Scan on "?{table}"?\b')
+        self.assertIsNone(full_scan.search(plan), f'Full scan of {table}:\n{plan}')
+        return plan
+
+    def assertNoSort(self, plan):
+        self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan)
+
+    def test_conversation_history_query(self):
+        """Test that message history reads the live-message index in sent_at order"""
+        queryset = Message.objects.filter(
+            conversation=self.conversation,
+            is_deleted=False
+        ).order_by('-sent_at')[:50]
+        self.assertNoSort(self.assertNoFullScan(queryset, 'message'))
+
+    def test_scoped_search_query(self):
+        """Test that search filters are answered from indexes together with the full-text lookup"""
+        messages = filter_messages(
+            Message.objects.all(),
+            conversation_id=self.conversation.conversation_id,
+            after=timezone.now() - timedelta(days=7),
+            mime_type='image/*'
+        )
+        queryset = get_search_backend().search(messages, 'report')[:20]
+        self.assertNoFullScan(queryset, 'message')
+        self.assertNoFullScan(queryset, 'attachment')
+
+        by_sender = get_search_backend().search(filter_messages(Message.objects.all(), sender_id=self.user.user_id), 'report')
+        self.assertNoFullScan(by_sender, 'message')
+
+    def test_user_directory_query(self):
+        """Test that directory prefix search and browsing read the name indexes instead of scanning users"""
+        from .directory import directory_queryset
+        self.assertNoFullScan(directory_queryset('ali')[:22], 'user')
+        self.assertNoSort(self.assertNoFullScan(directory_queryset('', ('bob', 1))[:22], 'user'))
+
+    def test_user_index_refresh_query(self):
+        """Test that the user index refresh reads recently changed users through the updated_at index"""
+        self.assertNoFullScan(User.objects.filter(updated_at__gte=timezone.now()), 'user')
+
+    def test_message_list_query(self):
+        """Test the MessageListView query"""
+        queryset = Message.objects.filter(
+            conversation_id=self.conversation.conversation_id,
+            is_deleted=False
+        ).order_by('sent_at')
+        self.assertNoSort(self.assertNoFullScan(queryset, 'message'))
+
+    def test_pending_messages_query(self):
+        """Test that pending delivery starts from the user's statuses"""
+        queryset = Message.objects.filter(
+            conversation=self.conversation,
+            messagestatus__user=self.user,
+            messagestatus__status__in=['sent', 'delivered']
+        ).order_by('sent_at')
+        self.assertNoFullScan(queryset, 'message')
+        self.assertNoFullScan(queryset, 'message_status')
+
+    def test_audit_log_query(self):
+        """Test that the audit log page is read in timestamp order from its index"""
+        queryset = AuditLog.objects.select_related('actor').order_by('-timestamp', '-log_id')[:50]
+        self.assertNoSort(self.assertNoFullScan(queryset, 'audit_log'))
+
+    def test_audit_log_keyset_query(self):
+        """Test that an action-filtered keyset page of the audit log is read from an index without sorting"""
+        from django.db.models import Q
+        now = timezone.now()
+        queryset = AuditLog.objects.select_related('actor').filter(
+            Q(timestamp__lt=now) | Q(timestamp=now, log_id__lt=100),
+            action='delete',
+            timestamp__gte=now - timedelta(days=30)
+        ).order_by('-timestamp', '-log_id')[:51]
+        self.assertNoSort(self.assertNoFullScan(queryset, 'audit_log'))
+
+    def test_message_keyset_query(self):
+        """Test that a keyset page is read from the history index without sorting"""
+        from django.db.models import Q
+        now = timezone.now()
+        queryset = Message.objects.filter(
+            Q(sent_at__lt=now) | Q(sent_at=now, message_id__lt=100),
+            conversation_id=self.conversation.conversation_id,
+            is_deleted=False
+        ).order_by('-sent_at', '-message_id')[:51]
+        self.assertNoSort(self.assertNoFullScan(queryset, 'message'))
+
+    def test_user_conversations_query(self):
+        """Test that a user's conversations are found through the membership index"""
+        self.assertNoFullScan(get_user_conversations(self.user), 'conversation_member')
+
+
+class ConversationStateTest(TestCase):
+    def setUp(self):
+        self.user1 = make_user('user1', 'User 1')
+        self.user2 = make_user('user2', 'User 2')
+        self.conversation = make_private_chat(self.user1, self.user2)
+
+    def _send(self, sender, content):
+        message = Message.objects.create(conversation=self.conversation, sender=sender, content=content)
+        deliver_message(message)
+        return message
+
+    def _unread(self, user):
+        counter = UnreadCounter.objects.filter(conversation=self.conversation, user=user).first()
+        return counter.unread_count if counter else 0
+
+    def test_websocket_send_is_atomic(self):
+        """Test that a websocket message, its statuses and the conversation state are stored together or not at all"""
+        consumer = ChatConsumer()
+        message = async_to_sync(consumer.save_message)('Hello', self.user1, self.conversation.conversation_id)
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_message_id, message.message_id)
+        self.assertEqual(self._unread(self.user2), 1)
+
+        with patch('chat.consumers.deliver_message', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                async_to_sync(consumer.save_message)('Lost', self.user1, self.conversation.conversation_id)
+        self.assertFalse(Message.objects.filter(content='Lost').exists())
+        self.assertEqual(self._unread(self.user2), 1)
+
+    def test_send_updates_preview_and_unread(self):
+        """Test that sending advances last_message and bumps only the recipient's counter"""
+        self._send(self.user1, 'First')
+        second = self._send(self.user1, 'Second')
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_message, second)
+        self.assertEqual(self.conversation.last_activity_at, second.sent_at)
+        self.assertEqual(self._unread(self.user2), 2)
+        self.assertEqual(self._unread(self.user1), 0)
+
+    def test_mark_read_decrements_once(self):
+        """Test that reading a message twice only decrements the counter once"""
+        first = self._send(self.user1, 'First')
+        self._send(self.user1, 'Second')
+
+        self.assertEqual(mark_read(self.user2, [first.message_id]), 1)
+        self.assertEqual(mark_read(self.user2, [first.message_id]), 0)
+        self.assertEqual(self._unread(self.user2), 1)
+
+    def test_delete_last_message_restores_previous_preview(self):
+        """Test that deleting the newest message falls back to the previous one"""
+        first = self._send(self.user1, 'First')
+        second = self._send(self.user1, 'Second')
+
+        record_message_deleted(second)
+        second.is_deleted = True
+        second.save(update_fields=['is_deleted'])
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_message, first)
+        self.assertEqual(self._unread(self.user2), 1)
+
+    def test_write_behind_batch_updates_state(self):
+        """Test that messages written by the batch writer update conversation state"""
+        allocator = IdAllocator(Message, block_size=10)
+        writer = MessageWriter(batch_size=10)
+        messages = [
+            Message(message_id=allocator.allocate(), conversation=self.conversation, sender=self.user1, content=f'Queued {i}')
+            for i in range(3)
+        ]
+        for message in messages:
+            writer.submit(message, recipient_ids=[self.user2.user_id])
+        writer.flush()
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_message_id, messages[-1].message_id)
+        self.assertEqual(self._unread(self.user2), 3)
+
+    def test_repair_command_recomputes_state(self):
+        """Test that the repair command rebuilds drifted previews and counters"""
+        first = self._send(self.user1, 'First')
+        self._send(self.user2, 'Reply')
+        mark_read(self.user2, [first.message_id])
+
+        Conversation.objects.filter(pk=self.conversation.pk).update(last_message=None)
+        UnreadCounter.objects.filter(conversation=self.conversation).update(unread_count=42)
+
+        call_command('repair_conversation_state', '--batch-size', '1', stdout=StringIO())
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_message.content, 'Reply')
+        self.assertEqual(self._unread(self.user1), 1)
+        self.assertEqual(self._unread(self.user2), 0)
+
+
+class ConversationMemberTest(TestCase):
+    def setUp(self):
+        self.user1 = make_user('user1', 'User 1')
+        self.user2 = make_user('user2', 'User 2')
+        self.user3 = make_user('user3', 'User 3')
+        self.private_conversation = make_private_chat(self.user1, self.user2)
+
+        self.group_chat = make_group(self.user1)
+        self.group_conversation = self.group_chat.conversation
+        self.group_member = GroupMember.objects.create(group_chat=self.group_chat, user=self.user3)
+
+    def test_members_mirrored_from_private_and_group_chats(self):
+        """Test that private chat participants and group members get ConversationMember rows"""
+        self.assertEqual(
+            set(self.private_conversation.members.values_list('user_id', flat=True)),
+            {self.user1.user_id, self.user2.user_id}
+        )
+        admin = ConversationMember.objects.get(conversation=self.group_conversation, user=self.user1)
+        self.assertEqual(admin.role, 'admin')
+
+    def test_group_role_change_and_removal_are_synced(self):
+        """Test that role updates and removals in GroupMember propagate"""
+        self.group_member.role = 'moderator'
+        self.group_member.save()
+        self.assertEqual(
+            ConversationMember.objects.get(conversation=self.group_conversation, user=self.user3).role,
+            'moderator'
+        )
+
+        self.group_member.delete()
+        self.assertFalse(self.user3._check_conversation_access(self.group_conversation))
+
+    def test_user_conversations_single_query(self):
+        """Test that a user's conversations come from one membership query"""
+        with self.assertNumQueries(1):
+            conversation_ids = set(get_user_conversations(self.user1).values_list('conversation_id', flat=True))
+        self.assertEqual(conversation_ids, {self.private_conversation.conversation_id, self.group_conversation.conversation_id})
+
+        self.assertTrue(self.user2._check_conversation_access(self.private_conversation))
+        self.assertFalse(self.user2._check_conversation_access(self.group_conversation))
+
+    def test_participants_single_query(self):
+        """Test that conversation participants are loaded in one query once the member set is cached"""
+        get_member_ids(self.group_conversation.conversation_id)
+        with self.assertNumQueries(1):
+            participants = ChatConsumer._get_conversation_participants_sync(self.group_conversation)
+        self.assertEqual({p.user_id for p in participants}, {self.user1.user_id, self.user3.user_id})
+
+
+class MessageArchiveTest(TestCase):
+    def setUp(self):
+        self.user1 = make_user('user1', 'User 1')
+        self.user2 = make_user('user2', 'User 2')
+        self.conversation = make_private_chat(self.user1, self.user2)
+
+        old = timezone.now() - timedelta(days=400)
+        self.old_messages = []
+        for i in range(5):
+            message = Message.objects.create(
+                conversation=self.conversation,
+                sender=self.user1,
+                content=f'Old message {i}',
+                sent_at=old + timedelta(minutes=i)
+            )
+            deliver_message(message)
+            self.old_messages.append(message)
+        Reaction.objects.create(message=self.old_messages[0], user=self.user2, emoji='👍')
+        Attachment.objects.create(message=self.old_messages[1], file_name='a.txt', mime_type='text/plain', file_size=1)
+
+        self.new_messages = []
+        for i in range(3):
+            message = Message.objects.create(
+                conversation=self.conversation,
+                sender=self.user2,
+                content=f'New message {i}',
+                reply_to=self.old_messages[2] if i == 0 else None
+            )
+            deliver_message(message)
+            self.new_messages.append(message)
+
+    def test_archive_moves_old_messages_with_related_rows(self):
+        """Test that old messages, reactions, attachments and statuses move to the archive"""
+        archived = archive_messages(older_than_days=30, batch_size=2, compress=True)
+
+        self.assertEqual(archived, 5)
+        self.assertEqual(Message.objects.filter(conversation=self.conversation).count(), 3)
+        self.assertEqual(ArchivedMessage.objects.count(), 5)
+        self.assertEqual(ArchivedMessageStatus.objects.count(), 5)
+
+        archived_message = ArchivedMessage.objects.get(message_id=self.old_messages[0].message_id)
+        self.assertEqual(archived_message.content, 'Old message 0')
+        self.assertIsNotNone(archived_message.body_compressed)
+        self.assertEqual(archived_message.reaction_set.get().emoji, '👍')
+        self.assertEqual(ArchivedMessage.objects.get(message_id=self.old_messages[1].message_id).attachment_set.count(), 1)
+
+        # Hot replies keep pointing at the archived message
+        self.new_messages[0].refresh_from_db()
+        self.assertEqual(self.new_messages[0].reply_to_id, self.old_messages[2].message_id)
+
+    def test_replies_to_archived_messages(self):
+        """Test that reply targets resolve from the archive and that new replies to archived messages are kept"""
+        archive_messages(older_than_days=30)
+        target_id = self.old_messages[2].message_id
+
+        targets = reply_targets(recent_messages(self.conversation.conversation_id, limit=8))
+        self.assertEqual(set(targets), {target_id})
+        self.assertIsInstance(targets[target_id], ArchivedMessage)
+        self.assertEqual(targets[target_id].content, 'Old message 2')
+        self.assertEqual(targets[target_id].sender.username, 'user1')
+        self.assertIsNone(get_reply_target(999999))
+
+        consumer = ChatConsumer()
+        reply_to = async_to_sync(consumer.find_reply_target)(None, target_id)
+        self.assertEqual(reply_to.message_id, target_id)
+        message = async_to_sync(consumer.save_message)('Late reply', self.user2, self.conversation.conversation_id, None, reply_to)
+        self.assertEqual(Message.objects.get(message_id=message.message_id).reply_to_id, target_id)
+
+    def test_reads_span_both_tiers(self):
+        """Test that paginated and recent reads return archived and hot messages in order"""
+        archive_messages(older_than_days=30)
+        expected = [m.message_id for m in self.old_messages + self.new_messages]
+
+        messages = conversation_messages(self.conversation.conversation_id)
+        self.assertEqual(messages.count(), 8)
+        self.assertEqual([m.message_id for m in messages[3:6]], expected[3:6])
+        self.assertEqual([m.message_id for m in messages], expected)
+
+        self.assertEqual([m.message_id for m in recent_messages(self.conversation.conversation_id, limit=4)], expected[-4:])
+
+    def test_message_list_api_reads_archive(self):
+        """Test that MessageListView pages through archived messages transparently"""
+        archive_messages(older_than_days=30)
+        client = APIClient()
+        client.force_authenticate(user=self.user1)
+
+        response = client.get(f'/api/conversations/{self.conversation.conversation_id}/messages/?pagination=page')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 8)
+        self.assertEqual(response.data['results'][0]['content'], 'Old message 0')
+        self.assertEqual(response.data['results'][0]['reactions'][0]['emoji'], '👍')
+
+    def test_unread_counts_include_archived_statuses(self):
+        """Test that archived unread messages still count and can be marked read"""
+        archive_messages(older_than_days=30)
+        call_command('repair_conversation_state', stdout=StringIO())
+        counter = UnreadCounter.objects.get(conversation=self.conversation, user=self.user2)
+        self.assertEqual(counter.unread_count, 5)
+
+        self.assertEqual(mark_read(self.user2, [self.old_messages[0].message_id]), 1)
+        counter.refresh_from_db()
+        self.assertEqual(counter.unread_count, 4)
+
+    def test_last_message_is_not_archived(self):
+        """Test that a conversation's preview message stays in the hot table"""
+        Message.objects.filter(message_id__in=[m.message_id for m in self.new_messages]).delete()
+        call_command('repair_conversation_state', stdout=StringIO())
+
+        archive_messages(older_than_days=30)
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_message_id, self.old_messages[-1].message_id)
+        self.assertTrue(Message.objects.filter(message_id=self.old_messages[-1].message_id).exists())
+
+
+class MessageKeysetPaginationTest(TestCase):
+    def setUp(self):
+        self.user1 = make_user('user1', 'User 1')
+        self.user2 = make_user('user2', 'User 2')
+        self.conversation = make_private_chat(self.user1, self.user2)
+
+        # Several messages share a timestamp so message_id has to break ties
+        start = timezone.now() - timedelta(days=400)
+        self.messages = [
+            Message.objects.create(
+                conversation=self.conversation,
+                sender=self.user1,
+                content=f'Message {i}',
+                sent_at=start + timedelta(minutes=i // 3)
+            )
+            for i in range(12)
+        ]
+        self.url = f'/api/conversations/{self.conversation.conversation_id}/messages/'
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user1)
+
+    def _ids(self, response):
+        return [message['message_id'] for message in response.data['results']]
+
+    def test_default_page_is_newest_without_count(self):
+        """Test that the default page returns the newest messages oldest first and no count"""
+        response = self.client.get(self.url, {'limit': 5})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', response.data)
+        self.assertEqual(self._ids(response), [m.message_id for m in self.messages[-5:]])
+        self.assertIsNone(response.data['next'])
+        self.assertIsNotNone(response.data['previous'])
+
+    def test_walk_backwards_and_forwards(self):
+        """Test that before/after cursors visit every message exactly once across both tiers"""
+        archive_messages(older_than_days=30, max_batches=1, batch_size=6)
+
+        seen = []
+        response = self.client.get(self.url, {'limit': 5})
+        while True:
+            seen = self._ids(response) + seen
+            if not response.data['previous']:
+                break
+            response = self.client.get(response.data['previous'])
+        self.assertEqual(seen, [m.message_id for m in self.messages])
+
+        forward = []
+        response = self.client.get(self.url, {'limit': 5, 'after': MessageCursorPagination.encode_cursor(self.messages[0])})
+        while True:
+            forward += self._ids(response)
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(forward, [m.message_id for m in self.messages[1:]])
+
+    def test_page_flag_keeps_numbered_pages(self):
+        """Test that ?pagination=page keeps the old count/next/previous response"""
+        response = self.client.get(self.url, {'pagination': 'page'})
+        self.assertEqual(response.data['count'], 12)
+        self.assertEqual(self._ids(response)[0], self.messages[0].message_id)
+
+    def test_invalid_cursor(self):
+        """Test that a malformed cursor is rejected"""
+        response = self.client.get(self.url, {'before': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1'], DB_REPLICA_STICKY_SECONDS=5)
+class ReplicaRouterTest(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.router = ReplicaRouter()
+        self.user1 = make_user('user1', 'User 1')
+        self.user2 = make_user('user2', 'User 2')
+
+    def _read_alias(self, user):
+        token = set_acting_user(user.user_id)
+        try:
+            with use_replica():
+                return self.router.db_for_read(Message)
+        finally:
+            reset_acting_user(token)
+
+    def test_reads_use_primary_outside_replica_paths(self):
+        """Test that only reads inside use_replica() go to a replica"""
+        self.assertIsNone(self.router.db_for_read(Message))
+        self.assertEqual(self._read_alias(self.user1), 'replica_1')
+        self.assertEqual(self.router.db_for_write(Message), 'default')
+
+    def test_writer_is_pinned_to_primary(self):
+        """Test that a user's write pins their reads to the primary without affecting others"""
+        token = set_acting_user(self.user1.user_id)
+        try:
+            self.router.db_for_write(Message)
+        finally:
+            reset_acting_user(token)
+
+        self.assertEqual(self._read_alias(self.user1), 'default')
+        self.assertEqual(self._read_alias(self.user2), 'replica_1')
+
+        cache.clear()
+        self.assertEqual(self._read_alias(self.user1), 'replica_1')
+
+    def test_cached_sets_are_filled_from_primary(self):
+        """Test that membership and permission caches never fill from a possibly lagging replica"""
+        asked = []
+        with patch.object(ReplicaRouter, 'db_for_read', autospec=True, side_effect=lambda router, model, **hints: asked.append(model)):
+            with use_replica(), request_permission_cache():
+                get_member_ids(12345)
+                get_user_conversation_ids(self.user1.user_id)
+                get_permission_codes(self.user1)
+        self.assertNotIn(ConversationMember, asked)
+        self.assertNotIn(Permission, asked)
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas_configured(self):
+        """Test that the router is inert without replicas"""
+        with use_replica():
+            self.assertIsNone(self.router.db_for_read(Message))
+
+    def test_read_views_route_to_replica_until_user_writes(self):
+        """Test that read-mostly API views read from the replica and recent writers from the primary"""
+        conversation = make_private_chat(self.user1, self.user2)
+        client = APIClient()
+        client.force_authenticate(user=self.user1)
+
+        chosen = []
+        original = ReplicaRouter.db_for_read
+
+        def spy(router, model, **hints):
+            chosen.append(original(router, model, **hints))
+            return None  # The test database has no separate replica
+
+        with patch.object(ReplicaRouter, 'db_for_read', autospec=True, side_effect=spy):
+            client.get(f'/api/conversations/{conversation.conversation_id}/messages/')
+            self.assertIn('replica_1', chosen)
+
+            client.post(f'/api/conversations/{conversation.conversation_id}/messages/', {'content': 'Hello'})
+            chosen.clear()
+            client.get(f'/api/conversations/{conversation.conversation_id}/messages/')
+            self.assertTrue(chosen)
+            self.assertNotIn('replica_1', chosen)
+
+
+class DeletionJobTest(TestCase):
+    def setUp(self):
+        self.admin = make_user('admin', 'Admin', is_staff=True, is_superuser=True)
+        self.user1 = make_user('user1', 'User 1')
+        self.user2 = make_user('user2', 'User 2')
+        self.private = make_private_chat(self.user1, self.user2)
+        self.group = make_group(self.user2, [self.user1]).conversation
+
+        for i in range(5):
+            message = Message.objects.create(conversation=self.private, sender=self.user1, content=f'Private {i}')
+            deliver_message(message)
+            Reaction.objects.create(message=message, user=self.user2, emoji='👍')
+        Attachment.objects.create(
+            message=message, file='attachments/a.txt', file_name='a.txt', mime_type='text/plain', file_size=1
+        )
+        self.group_messages = []
+        for sender in (self.user2, self.user1, self.user1):
+            message = Message.objects.create(conversation=self.group, sender=sender, content='Group')
+            deliver_message(message)
+            self.group_messages.append(message)
+
+    def test_conversation_is_hidden_immediately_and_deleted_in_chunks(self):
+        """Test that a deleted conversation disappears at once and the worker removes its rows chunk by chunk"""
+        job = request_conversation_deletion(self.private, requested_by=self.admin)
+
+        self.assertEqual(job.status, 'pending')
+        self.assertNotIn(self.private, get_user_conversations(self.user1))
+        self.assertFalse(self.user1._check_conversation_access(self.private))
+        self.assertTrue(Message.objects.filter(conversation=self.private).exists())
+
+        with patch('chat.deletion.default_storage') as storage:
+            job = run_deletion_job(job.job_id, chunk_size=2)
+
+        storage.delete.assert_called_once_with('attachments/a.txt')
+        self.assertEqual(job.status, 'completed')
+        self.assertEqual(job.files_deleted, 1)
+        self.assertIsNotNone(job.finished_at)
+        self.assertFalse(Conversation.objects.filter(conversation_id=self.private.conversation_id).exists())
+        self.assertFalse(Message.objects.filter(conversation_id=self.private.conversation_id).exists())
+        self.assertFalse(Reaction.objects.filter(message__conversation_id=self.private.conversation_id).exists())
+        self.assertFalse(MessageStatus.objects.filter(message__conversation_id=self.private.conversation_id).exists())
+        # 5 messages, 5 statuses, 5 reactions, 1 attachment, 1 counter, 2 members, the conversation and its private chat
+        self.assertEqual(job.rows_deleted, 21)
+        self.assertTrue(Message.objects.filter(conversation=self.group).exists())
+
+    def test_user_deletion_removes_their_data_and_fixes_group_state(self):
+        """Test that deleting a user removes owned chats and their group messages, then recomputes group state"""
+        job = request_user_deletion(self.user1, requested_by=self.admin)
+        self.user1.refresh_from_db()
+        self.assertFalse(self.user1.is_active)
+
+        with patch('chat.deletion.default_storage'):
+            job = run_deletion_job(job.job_id, chunk_size=2)
+
+        self.assertEqual(job.status, 'completed')
+        self.assertFalse(User.objects.filter(user_id=self.user1.user_id).exists())
+        self.assertFalse(Conversation.objects.filter(conversation_id=self.private.conversation_id).exists())
+        self.group.refresh_from_db()
+        self.assertEqual(list(Message.objects.filter(conversation=self.group)), [self.group_messages[0]])
+        self.assertEqual(self.group.last_message_id, self.group_messages[0].message_id)
+        self.assertEqual(list(ConversationMember.objects.filter(conversation=self.group).values_list('user_id', flat=True)), [self.user2.user_id])
+        self.assertFalse(UnreadCounter.objects.filter(conversation=self.group, user=self.user2, unread_count__gt=0).exists())
+
+    @override_settings(AUDIT_LOG_MODE='sync')
+    def test_user_deletion_keeps_their_audit_entries(self):
+        """Test that audit entries a deleted user made survive the job with the name they acted under"""
+        entry = log_action(self.user1, 'update', 'conversation', self.group.conversation_id, ip_address='127.0.0.1')
+        job = request_user_deletion(self.user1, requested_by=self.admin)
+        with patch('chat.deletion.default_storage'):
+            run_deletion_job(job.job_id, chunk_size=2)
+
+        entry.refresh_from_db()
+        self.assertIsNone(entry.actor_id)
+        self.assertEqual(entry.actor_name, 'user1')
+
+    def test_failed_job_resumes(self):
+        """Test that a failed job can be run again and finishes without redoing work"""
+        job = request_user_deletion(self.user1, requested_by=self.admin)
+        with patch('chat.deletion.default_storage'), patch('chat.deletion.recompute', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                run_deletion_job(job.job_id, chunk_size=2)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.step, 'conversation state')
+        rows_deleted = job.rows_deleted
+
+        job = run_deletion_job(job.job_id, chunk_size=2)
+        self.assertEqual(job.status, 'completed')
+        self.assertEqual(job.rows_deleted, rows_deleted)
+        self.assertEqual(run_deletion_job(job.job_id).status, 'completed')
+
+    @override_settings(AUDIT_LOG_MODE='sync')
+    def test_delete_views_return_job(self):
+        """Test that the management views queue a job and report its progress"""
+        client = Client()
+        client.force_login(self.admin)
+        with patch('chat.deletion.enqueue_deletion') as enqueue:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = client.post(reverse('delete_conversation', args=[self.private.conversation_id]))
+
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['job_id']
+        enqueue.assert_called_once()
+        self.assertEqual(enqueue.call_args[0][0].job_id, job_id)
+
+        response = client.get(reverse('deletion_job_status', args=[job_id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['job']['state'], 'pending')
+
+        client.force_login(self.user2)
+        self.assertEqual(client.get(reverse('deletion_job_status', args=[job_id])).status_code, 404)
+        self.assertEqual(client.post(reverse('delete_user', args=[self.user1.user_id])).status_code, 403)
+
+
+class MessageCompactionTest(TestCase):
+    def setUp(self):
+        self.user1 = make_user('user1', 'User 1')
+        self.user2 = make_user('user2', 'User 2')
+        self.conversation = make_private_chat(self.user1, self.user2)
+
+        self.messages = []
+        for i in range(4):
+            message = Message.objects.create(conversation=self.conversation, sender=self.user1, content=f'Message {i}')
+            deliver_message(message)
+            Reaction.objects.create(message=message, user=self.user2, emoji='👍')
+            self.messages.append(message)
+        Attachment.objects.create(
+            message=self.messages[0], file='attachments/a.txt', file_name='a.txt', mime_type='text/plain', file_size=1
+        )
+        # Two messages deleted long ago, one deleted just now, one live
+        Message.objects.filter(message_id__in=[m.message_id for m in self.messages[:2]]).update(
+            is_deleted=True, deleted_at=timezone.now() - timedelta(days=60)
+        )
+        Message.objects.filter(message_id=self.messages[2].message_id).update(is_deleted=True, deleted_at=timezone.now())
+
+    def test_compaction_purges_old_deleted_messages(self):
+        """Test that messages past the grace period lose their content, statuses, reactions and attachments"""
+        with patch('chat.deletion.default_storage') as storage:
+            run = compact_deleted_messages(grace_days=30, batch_size=1, throttle=0)
+
+        storage.delete.assert_called_once_with('attachments/a.txt')
+        self.assertEqual(run.messages_compacted, 2)
+        self.assertEqual(run.statuses_deleted, 2)
+        self.assertEqual(run.reactions_deleted, 2)
+        self.assertEqual(run.attachments_deleted, 1)
+        self.assertEqual(run.rows_reclaimed, 5)
+        self.assertEqual(run.files_deleted, 1)
+        self.assertIsNotNone(run.finished_at)
+
+        compacted = Message.objects.get(message_id=self.messages[0].message_id)
+        self.assertEqual(compacted.content, '')
+        self.assertIsNotNone(compacted.compacted_at)
+        self.assertFalse(Reaction.objects.filter(message=compacted).exists())
+        # Within the grace period and live messages are left alone
+        for message in self.messages[2:]:
+            message.refresh_from_db()
+            self.assertNotEqual(message.content, '')
+            self.assertTrue(MessageStatus.objects.filter(message=message).exists())
+
+        # Already compacted messages are not picked up again
+        self.assertEqual(compact_deleted_messages(grace_days=30, throttle=0).rows_reclaimed, 0)
+
+    def test_hard_delete_and_archived_tier(self):
+        """Test that hard delete removes the rows in both tiers and counts them as reclaimed"""
+        archive_messages(older_than_days=0, batch_size=10)
+        self.assertTrue(ArchivedMessage.objects.filter(message_id=self.messages[0].message_id).exists())
+
+        with patch('chat.deletion.default_storage'):
+            run = compact_deleted_messages(grace_days=30, hard_delete=True, throttle=0)
+
+        self.assertEqual(run.messages_purged, 2)
+        self.assertEqual(run.rows_reclaimed, 7)
+        self.assertFalse(ArchivedMessage.objects.filter(message_id__in=[m.message_id for m in self.messages[:2]]).exists())
+        self.assertFalse(ArchivedMessageStatus.objects.filter(message_id=self.messages[0].message_id).exists())
+        self.assertEqual(CompactionRun.objects.count(), 1)
+
+    def test_command_reports_reclaimed_rows(self):
+        """Test the compact_deleted_messages management command"""
+        out = StringIO()
+        with patch('chat.deletion.default_storage'):
+            call_command('compact_deleted_messages', '--days', '30', '--throttle', '0', stdout=out)
+        self.assertIn('Reclaimed 5 rows', out.getvalue())
+
+
+
+class AuditPipelineTest(TestCase):
+    def setUp(self):
+        self.user = make_user('admin1', 'Admin 1')
+
+    def _create_entries(self, count, start, action='update'):
+        return AuditLog.objects.bulk_create([
+            AuditLog(actor=self.user, action=action, target_type='user', target_id=i,
+                     ip_address='127.0.0.1', timestamp=start + timedelta(minutes=i))
+            for i in range(count)
+        ])
+
+    @override_settings(AUDIT_LOG_MODE='async')
+    def test_async_entries_are_written_in_batches_after_commit(self):
+        """Test that queued audit entries keep their action time and are bulk-inserted by the writer"""
+        writer = AuditLogWriter(batch_size=10)
+        with patch('chat.audit.get_audit_writer', return_value=writer):
+            with self.captureOnCommitCallbacks(execute=True):
+                entries = [
+                    log_action(self.user, 'update', 'user', i, new_value='Assigned role', ip_address='127.0.0.1')
+                    for i in range(3)
+                ]
+                self.assertEqual(writer.pending_count(), 0)
+
+            self.assertEqual(writer.pending_count(), 3)
+            self.assertEqual(AuditLog.objects.count(), 0)
+            with patch.object(AuditLog.objects, 'bulk_create', wraps=AuditLog.objects.bulk_create) as bulk_create:
+                writer.flush()
+
+        bulk_create.assert_called_once()
+        self.assertEqual(AuditLog.objects.count(), 3)
+        self.assertEqual(
+            sorted(AuditLog.objects.values_list('timestamp', flat=True)),
+            sorted(entry.timestamp for entry in entries)
+        )
+
+    @override_settings(AUDIT_LOG_MODE='sync')
+    def test_sync_mode_writes_immediately(self):
+        """Test that sync mode stores the entry on the request path"""
+        entry = log_action(self.user, 'delete', 'conversation', 1, ip_address='127.0.0.1')
+        self.assertTrue(AuditLog.objects.filter(log_id=entry.log_id).exists())
+
+    def test_keyset_pages_and_filters(self):
+        """Test that audit log pages follow each other without gaps and honour the filters"""
+        # Midday, so the entries a few minutes apart never straddle a date boundary
+        start = (timezone.now() - timedelta(days=2)).replace(hour=12, minute=0, second=0, microsecond=0)
+        self._create_entries(5, start)
+        self._create_entries(2, start, action='delete')
+
+        seen = []
+        cursor = None
+        while True:
+            logs, cursor = audit_log_page(action='update', before=cursor, limit=2)
+            seen.extend(logs)
+            if cursor is None:
+                break
+        self.assertEqual([log.target_id for log in seen], [4, 3, 2, 1, 0])
+
+        logs, cursor = audit_log_page(start_date=(start + timedelta(minutes=1)).isoformat())
+        self.assertEqual(len(logs), 5)
+        self.assertIsNone(cursor)
+        logs, _ = audit_log_page(end_date=(start - timedelta(days=1)).date().isoformat())
+        self.assertEqual(logs, [])
+        logs, _ = audit_log_page(end_date=start.date().isoformat())
+        self.assertEqual(len(logs), 7)
+
+        with self.assertRaises(ValueError):
+            audit_log_page(before='not-a-cursor')
+        with self.assertRaises(ValueError):
+            audit_log_page(start_date='yesterday')
+
+    def test_prune_removes_expired_months(self):
+        """Test that retention deletes whole months past the retention period and keeps recent entries"""
+        self._create_entries(3, timezone.now() - timedelta(days=500))
+        recent = self._create_entries(2, timezone.now() - timedelta(days=1))
+
+        out = StringIO()
+        call_command('prune_audit_log', '--days', '365', '--batch-size', '1', stdout=out)
+
+        self.assertIn('Deleted 3 audit log entries', out.getvalue())
+        self.assertEqual(set(AuditLog.objects.values_list('log_id', flat=True)), {entry.log_id for entry in recent})
+        self.assertEqual(prune_audit_log(retention_days=365), 0)
+
+    def test_expired_partitions(self):
+        """Test that only monthly partitions entirely before the cutoff are dropped, oldest first"""
+        cutoff = datetime(2026, 3, 1, tzinfo=dt_timezone.utc)
+        names = ['audit_log_2026_03', 'audit_log_default', 'audit_log_2026_02', 'audit_log_2025_12', 'audit_log_2026_01']
+        self.assertEqual(expired_partitions(names, cutoff), ['audit_log_2025_12', 'audit_log_2026_01', 'audit_log_2026_02'])
+        self.assertEqual(add_months(datetime(2025, 11, 1, tzinfo=dt_timezone.utc), 3), datetime(2026, 2, 1, tzinfo=dt_timezone.utc))
+        self.assertEqual(partition_name(cutoff), 'audit_log_2026_03')
+
+
+class PermissionCacheTest(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('moderator1', 'Moderator 1')
+        self.kick, _ = Permission.objects.get_or_create(code='kick_members', defaults={'description': 'Kick members'})
+        self.ban, _ = Permission.objects.get_or_create(code='ban_members', defaults={'description': 'Ban members'})
+        self.role = Role.objects.create(name='cache_test_role', description='Permission cache test role')
+        RolePermission.objects.create(role=self.role, permission=self.kick)
+        UserRole.objects.create(user=self.user, role=self.role)
+
+    def test_permissions_resolve_with_one_query_then_from_cache(self):
+        """Test that the permission set is loaded once and then served from the shared cache"""
+        with self.assertNumQueries(1):
+            self.assertTrue(self.user.has_perm('kick_members'))
+        # Another request loads its own User instance but shares the cached set
+        fresh = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertFalse(self.user.has_perm('ban_members'))
+            self.assertTrue(fresh.has_perms(['kick_members']))
+
+    def test_request_cache_skips_shared_cache(self):
+        """Test that within one request a user's permissions are only looked up once"""
+        with request_permission_cache():
+            get_permission_codes(self.user)
+            with patch('chat.permission_cache.cache') as shared_cache:
+                self.assertTrue(self.user.has_perm('kick_members'))
+            shared_cache.get_many.assert_not_called()
+            shared_cache.get.assert_not_called()
+
+    def test_role_changes_invalidate(self):
+        """Test that role assignments and role permission changes are seen immediately"""
+        self.assertFalse(self.user.has_perm('ban_members'))
+
+        self.role.permissions.add(self.ban)
+        self.assertTrue(self.user.has_perm('ban_members'))
+
+        RolePermission.objects.filter(role=self.role, permission=self.ban).delete()
+        self.assertFalse(self.user.has_perm('ban_members'))
+
+        with request_permission_cache():
+            self.assertTrue(self.user.has_perm('kick_members'))
+            UserRole.objects.filter(user=self.user, role=self.role).delete()
+            self.assertFalse(self.user.has_perm('kick_members'))
+
+        UserRole.objects.create(user=self.user, role=self.role)
+        self.assertTrue(self.user.has_perm('kick_members'))
+        self.role.delete()
+        self.assertFalse(self.user.has_perm('kick_members'))
+
+    def test_new_user_does_not_inherit_cached_permissions(self):
+        """Test that a recreated account with a reused ID starts with an empty permission set"""
+        self.assertTrue(self.user.has_perm('kick_members'))
+        user_id = self.user.pk
+        self.user.delete()
+        replacement = make_user('newcomer', 'Newcomer', user_id=user_id)
+        self.assertFalse(replacement.has_perm('kick_members'))
+
+
+class MembershipCacheTest(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user1 = make_user('user1', 'User 1')
+        self.user2 = make_user('user2', 'User 2')
+        self.group_chat = make_group(self.user1)
+        self.group = self.group_chat.conversation
+
+    def test_membership_is_cached_after_first_lookup(self):
+        """Test that access checks hit the database once and are then answered from the cache"""
+        with self.assertNumQueries(1):
+            self.assertTrue(is_member(self.user1.user_id, self.group.conversation_id))
+        with self.assertNumQueries(0):
+            self.assertTrue(self.user1._check_conversation_access(self.group))
+            self.assertFalse(is_member(self.user1.user_id, self.group.conversation_id + 1))
+        self.assertEqual(get_member_ids(self.group.conversation_id), {self.user1.user_id})
+
+    def test_group_joins_and_leaves_invalidate(self):
+        """Test that joining and leaving a group are seen immediately"""
+        self.assertFalse(is_member(self.user2.user_id, self.group.conversation_id))
+        self.assertEqual(get_member_ids(self.group.conversation_id), {self.user1.user_id})
+
+        member = GroupMember.objects.create(group_chat=self.group_chat, user=self.user2, role='member')
+        self.assertTrue(is_member(self.user2.user_id, self.group.conversation_id))
+        self.assertEqual(get_member_ids(self.group.conversation_id), {self.user1.user_id, self.user2.user_id})
+
+        member.delete()
+        self.assertFalse(is_member(self.user2.user_id, self.group.conversation_id))
+        self.assertEqual(get_member_ids(self.group.conversation_id), {self.user1.user_id})
+
+    def test_private_chat_and_tombstone_invalidate(self):
+        """Test that a new private chat is visible at once and a deleted conversation disappears at once"""
+        self.assertEqual(get_user_conversation_ids(self.user2.user_id), frozenset())
+        private = make_private_chat(self.user1, self.user2)
+        self.assertEqual(get_user_conversation_ids(self.user2.user_id), {private.conversation_id})
+
+        with patch('chat.deletion.enqueue_deletion'):
+            request_conversation_deletion(private)
+        self.assertFalse(is_member(self.user1.user_id, private.conversation_id))
+        self.assertFalse(is_member(self.user2.user_id, private.conversation_id))
+        self.assertTrue(is_member(self.user1.user_id, self.group.conversation_id))
+
+
+class GroupAuthorizationTest(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.users = [make_user(f'member{i}', f'Member {i}') for i in range(6)]
+        self.creator, self.moderator = self.users[0], self.users[1]
+        self.group_chat = make_group(self.creator, self.users[2:], title='Moderated Group')
+        GroupMember.objects.create(group_chat=self.group_chat, user=self.moderator, role='moderator')
+        # Moderators manage a group through the manage_group_members permission
+        manage, _ = Permission.objects.get_or_create(code='manage_group_members', defaults={'description': 'Manage group members'})
+        role = Role.objects.create(name='group_moderator_test', description='Group moderator')
+        RolePermission.objects.create(role=role, permission=manage)
+        UserRole.objects.create(user=self.moderator, role=role)
+        # Warm the permission cache so only group queries are counted
+        for user in self.users:
+            user.has_perm('ban_members')
+
+    def test_single_checks_cost_one_query(self):
+        """Test that each group permission check loads the memberships it needs in one query"""
+        with self.assertNumQueries(1):
+            self.assertTrue(self.moderator.can_kick_member(self.group_chat, self.users[2]))
+        with self.assertNumQueries(1):
+            self.assertFalse(self.moderator.can_kick_member(self.group_chat, self.creator))
+        with self.assertNumQueries(1):
+            self.assertTrue(self.creator.is_group_admin(self.group_chat))
+        with self.assertNumQueries(1):
+            self.assertFalse(self.users[2].can_manage_group(self.group_chat))
+
+    def test_snapshot_is_shared_between_checks(self):
+        """Test that one snapshot answers several checks without further queries"""
+        authorization = GroupAuthorization.load(self.group_chat, [self.moderator.pk, self.users[2].pk, self.users[3].pk])
+        with self.assertNumQueries(0):
+            self.assertTrue(self.moderator.can_manage_group(self.group_chat, authorization))
+            self.assertTrue(self.moderator.can_kick_member(self.group_chat, self.users[2], authorization))
+            self.assertTrue(self.moderator.can_kick_member(self.group_chat, self.users[3], authorization))
+            self.assertFalse(self.moderator.is_group_admin(self.group_chat, authorization))
+            self.assertFalse(self.moderator.can_ban_member(self.group_chat, self.users[2], authorization))
+
+    def test_member_list_moderation_is_one_query(self):
+        """Test that evaluating moderation for a whole member list costs one query"""
+        with self.assertNumQueries(1):
+            moderation = self.moderator.get_group_moderation(self.group_chat)
+
+        self.assertEqual(len(moderation), 6)
+        self.assertFalse(moderation[self.creator.pk]['can_kick'])
+        self.assertFalse(moderation[self.moderator.pk]['can_kick'])
+        self.assertTrue(all(moderation[user.pk]['can_kick'] for user in self.users[2:]))
+        self.assertEqual(moderation[self.users[2].pk]['role'], 'member')
+
+
+class ReactionSummaryTest(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.users = [make_user(f'reactor{i}', f'Reactor {i}') for i in range(5)]
+        self.user = self.users[0]
+        self.conversation = make_group(self.user, self.users[1:], title='Reactions').conversation
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def _add_messages(self, count):
+        for i in range(count):
+            message = Message.objects.create(conversation=self.conversation, sender=self.users[i % 5], content=f'Message {i}')
+            for user in self.users[1:]:
+                Reaction.objects.create(message=message, user=user, emoji='👍')
+            Reaction.objects.create(message=message, user=self.user, emoji='❤️')
+
+    def test_reactions_are_aggregated_per_emoji(self):
+        """Test that reactions come back as one entry per emoji with a count, a user sample and my own flag"""
+        self._add_messages(1)
+        response = self.client.get(f'/api/conversations/{self.conversation.conversation_id}/messages/')
+
+        self.assertEqual(response.status_code, 200)
+        reactions = {entry['emoji']: entry for entry in response.data['results'][0]['reactions']}
+        self.assertEqual(reactions['👍']['count'], 4)
+        self.assertEqual(len(reactions['👍']['users']), 3)
+        self.assertFalse(reactions['👍']['reacted'])
+        self.assertEqual(reactions['❤️'], {'emoji': '❤️', 'count': 1, 'reacted': True, 'users': ['reactor0']})
+
+    def test_websocket_reactions_match_rest(self):
+        """Test that reaction broadcasts carry the REST summary, with `reacted` set for each recipient"""
+        self._add_messages(1)
+        message = Message.objects.get()
+        rest = self.client.get(f'/api/conversations/{self.conversation.conversation_id}/messages/').data['results'][0]['reactions']
+
+        consumer = ChatConsumer()
+        reactions, reactor_ids = async_to_sync(consumer.get_reaction_update)(message.message_id)
+        sent = []
+        for user in (self.users[0], self.users[1]):
+            consumer.scope = {'user': user}
+            consumer.send = AsyncMock(side_effect=lambda text_data: sent.append(json.loads(text_data)['reactions']))
+            event = {'type': 'reaction_update', 'message_id': message.message_id, 'reactions': reactions, 'reactor_ids': reactor_ids}
+            async_to_sync(consumer.reaction_update)(event)
+
+        self.assertEqual(sent[0], json.loads(json.dumps(rest)))
+        self.assertEqual({entry['emoji']: entry['reacted'] for entry in sent[1]}, {'👍': True, '❤️': False})
+
+    def test_summarize_without_request_user(self):
+        """Test that summaries work outside a request"""
+        self._add_messages(1)
+        message = Message.objects.prefetch_related('reaction_set__user').get()
+        summary = summarize_reactions(message.reaction_set.all(), sample_size=10)
+        self.assertEqual([entry['count'] for entry in summary], [4, 1])
+        self.assertFalse(any(entry['reacted'] for entry in summary))
+
+    def test_message_page_query_count_is_constant(self):
+        """Test that a message page costs the same number of queries however many messages and reactions it holds"""
+        url = f'/api/conversations/{self.conversation.conversation_id}/messages/'
+        self._add_messages(2)
+        self.client.get(url)
+
+        with CaptureQueriesContext(connection) as small_page:
+            response = self.client.get(url)
+        self.assertEqual(len(response.data['results']), 2)
+
+        self._add_messages(20)
+        with CaptureQueriesContext(connection) as large_page:
+            response = self.client.get(url)
+        self.assertEqual(len(response.data['results']), 22)
+
+        self.assertEqual(len(large_page), len(small_page))
+        self.assertLessEqual(len(large_page), 10)
+
+
+class SearchTitleTest(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('searcher', 'Searcher')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def _search(self):
+        return self.client.get('/api/search/messages/', {'q': 'needle', 'page_size': 100})
+
+    def test_titles_resolved_for_viewer(self):
+        """Test that private results are titled after the other participant and groups by their title"""
+        self.add_conversations(self.user, 1, content='needle')
+        response = self._search()
+
+        self.assertEqual(response.status_code, 200)
+        titles = {result['content']: result['conversation_title'] for result in response.data['results']}
+        self.assertEqual(titles, {'needle private': 'Chat with Friend 1', 'needle group': 'Group 1'})
+
+    def test_search_query_count_is_constant(self):
+        """Test that a search page costs the same number of queries however many conversations it spans"""
+        self.add_conversations(self.user, 2, content='needle')
+        self._search()
+
+        with CaptureQueriesContext(connection) as small_page:
+            response = self._search()
+        self.assertEqual(len(response.data['results']), 4)
+
+        self.add_conversations(self.user, 20, content='needle')
+        cache.clear()
+        self._search()
+        with CaptureQueriesContext(connection) as large_page:
+            response = self._search()
+        self.assertEqual(len(response.data['results']), 44)
+        self.assertEqual(len(large_page), len(small_page))
+
+
+class SearchBackendTest(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('indexer')
+        self.conversation = make_group(self.user, title='Index').conversation
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def _send(self, content):
+        return Message.objects.create(conversation=self.conversation, sender=self.user, content=content)
+
+    def _search(self, query):
+        response = self.client.get('/api/search/messages/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [result['message_id'] for result in response.data['results']]
+
+    def test_backend_follows_engine(self):
+        """Test that SQLite databases search through the FTS5 index"""
+        self.assertIsInstance(get_search_backend(), SQLiteSearchBackend)
+
+    def test_stemmed_matches_ranked_by_relevance(self):
+        """Test that word forms match and messages with more matches rank first"""
+        once = self._send('We are running late today')
+        twice = self._send('Runs and more runs on the weekend')
+        self._send('Nothing relevant here')
+
+        self.assertEqual(self._search('run'), [twice.message_id, once.message_id])
+
+    def test_index_follows_edits_and_deletes(self):
+        """Test that the triggers keep the index in sync with message content"""
+        message = self._send('original wording')
+        message.content = 'edited wording'
+        message.save()
+        self.assertEqual(self._search('original'), [])
+        self.assertEqual(self._search('edited'), [message.message_id])
+
+        message.delete()
+        self.assertEqual(self._search('wording'), [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        """Test that FTS5 operators and quotes in user input are matched as plain words"""
+        message = self._send('Meet NEAR the station "tonight"')
+        self.assertEqual(fts5_query('near AND( "tonight'), '"near" "AND" "tonight"')
+        self.assertEqual(self._search('near AND( "tonight'), [])
+        self.assertEqual(self._search('station "tonight'), [message.message_id])
+        self.assertEqual(self._search('"*'), [])
+
+    def test_snippet_marks_stemmed_terms(self):
+        """Test that results carry a bounded snippet with offsets of the stemmed terms the index matched"""
+        filler = ' '.join(f'word{i}' for i in range(100))
+        self._send(f'{filler} Deploying the new build {filler}')
+        response = self.client.get('/api/search/messages/', {'q': 'deploy builds'})
+
+        result = response.data['results'][0]
+        self.assertNotIn('highlighted_content', result)
+        snippet = result['snippet']
+        self.assertLess(len(snippet['text']), 300)
+        self.assertTrue(snippet['text'].startswith('…') and snippet['text'].endswith('…'))
+        self.assertEqual([snippet['text'][start:end] for start, end in snippet['matches']], ['Deploying', 'build'])
+
+    def test_substring_fallback_snippet(self):
+        """Test the snippet window of backends that build none in the database"""
+        content = 'a' * 300 + 'Needle' + 'b' * 300 + 'needle'
+        snippet = window_snippet(content, compile_matcher('needle'))
+        self.assertLessEqual(len(snippet['text']), SNIPPET_CHARS + 2)
+        self.assertEqual([snippet['text'][start:end] for start, end in snippet['matches']], ['Needle'])
+        self.assertEqual(window_snippet('short text', compile_matcher('')), {'text': 'short text', 'matches': []})
+        self.assertEqual(
+            parse_snippet(f'{MATCH_START}Runs{MATCH_STOP} and {MATCH_START}running{MATCH_STOP}'),
+            {'text': 'Runs and running', 'matches': [[0, 4], [9, 16]]}
+        )
+
+
+class SearchFilterTest(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('finder')
+        self.other = make_user('poster')
+        self.conversations = [make_group(self.user, [self.other], title=title).conversation for title in ('First', 'Second')]
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def _send(self, content, conversation=None, sender=None, days_ago=0, mime_type=None):
+        message = Message.objects.create(
+            conversation=conversation or self.conversations[0],
+            sender=sender or self.user,
+            content=content
+        )
+        if days_ago:
+            Message.objects.filter(message_id=message.message_id).update(sent_at=timezone.now() - timedelta(days=days_ago))
+        if mime_type:
+            Attachment.objects.create(message=message, file_name='file', mime_type=mime_type, file_size=10)
+        return message.message_id
+
+    def _search(self, **params):
+        response = self.client.get('/api/search/messages/', {'q': 'report', **params})
+        self.assertEqual(response.status_code, 200, response.data)
+        return [result['message_id'] for result in response.data['results']]
+
+    def test_filters(self):
+        """Test the conversation, sender, date and attachment filters"""
+        plain = self._send('report plain')
+        elsewhere = self._send('report elsewhere', conversation=self.conversations[1])
+        theirs = self._send('report from them', sender=self.other)
+        old = self._send('report from last month', days_ago=30)
+        image = self._send('report with image', mime_type='image/png')
+        document = self._send('report with pdf', mime_type='application/pdf')
+
+        self.assertEqual(
+            set(self._search(conversation_id=self.conversations[0].conversation_id)),
+            {plain, theirs, old, image, document}
+        )
+        self.assertEqual(self._search(sender_id=self.other.user_id), [theirs])
+        self.assertEqual(self._search(before=(timezone.now() - timedelta(days=7)).date().isoformat()), [old])
+        self.assertNotIn(old, self._search(after=(timezone.now() - timedelta(days=7)).date().isoformat()))
+        self.assertEqual(set(self._search(has_attachment='true')), {image, document})
+        self.assertNotIn(image, self._search(has_attachment='false'))
+        self.assertEqual(self._search(mime_type='image/*'), [image])
+        self.assertEqual(self._search(mime_type='application/pdf'), [document])
+        self.assertIn(elsewhere, self._search())
+
+    def test_inaccessible_conversation_and_bad_filters(self):
+        """Test that scoping to a foreign conversation finds nothing and malformed filters are rejected"""
+        foreign = Conversation.objects.create(type='group', title='Foreign')
+        Message.objects.create(conversation=foreign, sender=self.other, content='report secret')
+
+        self.assertEqual(self._search(conversation_id=foreign.conversation_id), [])
+        for params in ({'sender_id': 'x'}, {'after': 'yesterday'}, {'has_attachment': 'maybe'}, {'cursor': '!!'}):
+            response = self.client.get('/api/search/messages/', {'q': 'report', **params})
+            self.assertEqual(response.status_code, 400, params)
+
+    def test_keyset_pages_cover_all_results_once(self):
+        """Test that following the cursor walks every match in rank order without gaps or repeats"""
+        expected = [self._send('report ' + 'report ' * (i % 3)) for i in range(7)]
+
+        seen = []
+        params = {'q': 'report', 'page_size': 3}
+        url = '/api/search/messages/'
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            seen.extend(result['message_id'] for result in response.data['results'])
+            url, params = response.data['next'], None
+
+        self.assertEqual(sorted(seen), sorted(expected))
+        self.assertEqual(len(seen), len(set(seen)))
+        # Messages repeating the term rank first; equal ranks are newest first
+        self.assertEqual(seen[:2], [expected[5], expected[2]])
+
+    def test_numbered_pages_still_available(self):
+        """Test that ?pagination=page keeps the numbered page format"""
+        self._send('report one')
+        response = self.client.get('/api/search/messages/', {'q': 'report', 'pagination': 'page'})
+        self.assertEqual(response.data['count'], 1)
+
+
+class InboxTest(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('reader', 'Reader')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_entries_carry_the_list_screen(self):
+        """Test that an inbox entry has the title, last message, other participant and counts"""
+        private, group = self.add_conversations(self.user, 1)
+        response = self.client.get('/api/inbox/')
+
+        self.assertEqual(response.status_code, 200)
+        entries = {entry['conversation_id']: entry for entry in response.data['results']}
+        self.assertEqual([entry['conversation_id'] for entry in response.data['results']], [group.conversation_id, private.conversation_id])
+
+        chat = entries[private.conversation_id]
+        self.assertEqual(chat['title'], 'Chat with Friend 1')
+        self.assertEqual(chat['other_participant']['username'], 'friend1')
+        self.assertEqual(chat['last_message']['content'], 'hello private')
+        self.assertEqual(chat['last_message']['sender']['username'], 'friend1')
+        self.assertEqual((chat['member_count'], chat['unread_count']), (2, 1))
+
+        team = entries[group.conversation_id]
+        self.assertEqual(team['title'], 'Group 1')
+        self.assertIsNone(team['other_participant'])
+        self.assertEqual((team['member_count'], team['unread_count']), (2, 0))
+
+    def test_query_count_is_constant(self):
+        """Test that an inbox page costs the same number of queries however many conversations it holds"""
+        self.add_conversations(self.user, 1)
+        with CaptureQueriesContext(connection) as small_page:
+            response = self.client.get('/api/inbox/')
+        self.assertEqual(len(response.data['results']), 2)
+
+        self.add_conversations(self.user, 10)
+        with CaptureQueriesContext(connection) as large_page:
+            response = self.client.get('/api/inbox/')
+        self.assertEqual(len(response.data['results']), 22)
+        self.assertEqual(len(large_page), len(small_page))
+
+    def test_keyset_pages_follow_activity(self):
+        """Test that the cursor walks every conversation once, most recently active first"""
+        conversations = self.add_conversations(self.user, 4)
+        Conversation.objects.filter(conversation_id=conversations[0].conversation_id).update(last_activity_at=timezone.now())
+
+        seen = []
+        url, params = '/api/inbox/', {'page_size': 3}
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(entry['conversation_id'] for entry in response.data['results'])
+            url, params = response.data['next'], None
+
+        self.assertEqual(len(seen), 8)
+        self.assertEqual(set(seen), {c.conversation_id for c in conversations})
+        self.assertEqual(seen[0], conversations[0].conversation_id)
+
+    def test_deleted_conversations_and_messages(self):
+        """Test that tombstoned conversations are left out and deleted last messages lose their text"""
+        private, group = self.add_conversations(self.user, 1)
+        Conversation.objects.filter(conversation_id=group.conversation_id).update(deleted_at=timezone.now())
+        Message.objects.filter(conversation=private).update(is_deleted=True)
+
+        response = self.client.get('/api/inbox/')
+        self.assertEqual([entry['conversation_id'] for entry in response.data['results']], [private.conversation_id])
+        self.assertEqual(response.data['results'][0]['last_message']['content'], '')
+
+
+class ConditionalGetTest(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('poller')
+        self.friend = make_user('pollee')
+        self.conversation = make_private_chat(self.user, self.friend)
+        self.message = Message.objects.create(conversation=self.conversation, sender=self.friend, content='first')
+        deliver_message(self.message)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.urls = [
+            '/api/conversations/',
+            f'/api/conversations/{self.conversation.conversation_id}/',
+            f'/api/conversations/{self.conversation.conversation_id}/messages/',
+        ]
+
+    def _etags(self):
+        etags = {}
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('private', response['Cache-Control'])
+            etags[url] = response['ETag']
+        return etags
+
+    def _assert_all_changed(self, before):
+        for url, etag in self._etags().items():
+            self.assertNotEqual(etag, before[url], url)
+
+    def test_unchanged_data_answers_304_without_serializing(self):
+        """Test that a matching If-None-Match gets 304 before the serializer runs"""
+        for url, etag in self._etags().items():
+            with patch('rest_framework.generics.GenericAPIView.get_serializer') as get_serializer:
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(response['ETag'], etag)
+            get_serializer.assert_not_called()
+            self.assertLessEqual(len(queries), 2, url)
+
+    def test_new_message_changes_etags(self):
+        """Test that a delivered message invalidates the list, detail and message ETags"""
+        before = self._etags()
+        deliver_message(Message.objects.create(conversation=self.conversation, sender=self.friend, content='second'))
+        self._assert_all_changed(before)
+
+    def test_edits_and_deletes_change_message_etag(self):
+        """Test that edits, soft deletes and renames bump the conversation version"""
+        url = self.urls[2]
+        seen = {self.client.get(url)['ETag']}
+
+        self.message.content = 'edited'
+        self.message.save(update_fields=['content'])
+        seen.add(self.client.get(url)['ETag'])
+
+        record_message_deleted(self.message)
+        self.message.is_deleted = True
+        self.message.save(update_fields=['is_deleted'])
+        seen.add(self.client.get(url)['ETag'])
+
+        self.conversation.title = 'Renamed'
+        self.conversation.save()
+        seen.add(self.client.get(url)['ETag'])
+        self.assertEqual(len(seen), 4)
+
+    def test_reading_changes_list_etag(self):
+        """Test that unread badges are part of the conversation list ETag"""
+        before = self.client.get(self.urls[0])['ETag']
+        mark_read(self.user, [self.message.message_id])
+        self.assertNotEqual(self.client.get(self.urls[0])['ETag'], before)
+
+    def test_pages_and_users_get_their_own_etags(self):
+        """Test that ETags differ per query string and per user"""
+        url = self.urls[2]
+        self.assertNotEqual(self.client.get(url)['ETag'], self.client.get(url, {'limit': 1})['ETag'])
+
+        friend_client = APIClient()
+        friend_client.force_authenticate(user=self.friend)
+        self.assertNotEqual(self.client.get(url)['ETag'], friend_client.get(url)['ETag'])
+
+    def test_sender_changes_change_etags(self):
+        """Test that a sender's rename invalidates the ETags of the payloads embedding them and presence does not"""
+        before = self._etags()
+        self.friend.display_name = 'Renamed Pollee'
+        self.friend.save()
+        self._assert_all_changed(before)
+
+        before = self._etags()
+        with CaptureQueriesContext(connection) as queries:
+            self.friend.is_online = True
+            self.friend.save(update_fields=['is_online'])
+        self.assertEqual(self._etags(), before)
+        self.assertFalse([query for query in queries.captured_queries if query['sql'].startswith('UPDATE "conversation"')])
+
+        before = self._etags()
+        self.friend.save(update_fields=['last_login'])
+        self.assertEqual(self._etags(), before)
+
+
+
+@override_settings(DIRECTORY_CACHE_TIMEOUT=30, DIRECTORY_CACHE_PREFIX_LENGTH=3)
+class UserDirectoryTest(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('looker', 'Looker')
+        for username, display_name in (
+            ('alice', 'Alice Smith'), ('Albert', 'Bert'), ('bob', 'Alfred Bob'), ('carol', 'Carol'), ('alan', 'Alan Turing')
+        ):
+            make_user(username, display_name)
+        make_user('alumnus', 'Gone', is_active=False)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def _usernames(self, **params):
+        response = self.client.get('/api/users/', params)
+        self.assertEqual(response.status_code, 200)
+        return [user['username'] for user in response.data['results']]
+
+    def test_prefix_search_on_username_and_display_name(self):
+        """Test case-insensitive prefix matches on either name, ordered by username, without inactive users"""
+        self.assertEqual(self._usernames(q='AL'), ['alan', 'Albert', 'alice', 'bob'])
+        self.assertEqual(self._usernames(q='car'), ['carol'])
+        self.assertEqual(self._usernames(q='lice'), [])
+        self.assertNotIn('looker', self._usernames(q='loo'))
+        self.assertNotIn('email', self.client.get('/api/users/', {'q': 'al'}).data['results'][0])
+
+    def test_keyset_pages(self):
+        """Test that following `next` walks the directory once in username order"""
+        seen = []
+        url, params = '/api/users/', {'page_size': 2}
+        while url:
+            response = self.client.get(url, params)
+            seen.extend(user['username'] for user in response.data['results'])
+            url, params = response.data['next'], None
+        self.assertEqual(seen, ['alan', 'Albert', 'alice', 'bob', 'carol'])
+
+        response = self.client.get('/api/users/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_hot_prefixes_are_cached(self):
+        """Test that short prefix first pages come from the shared cache and longer ones do not"""
+        self._usernames(q='al')
+        with CaptureQueriesContext(connection) as queries:
+            self._usernames(q='al')
+        self.assertFalse([query for query in queries.captured_queries if '"username_key"' in query['sql']])
+
+        with CaptureQueriesContext(connection) as queries:
+            self._usernames(q='alice')
+            self._usernames(q='alice')
+        self.assertEqual(len([query for query in queries.captured_queries if '"username_key"' in query['sql']]), 2)
+
+    def test_prefix_search_folds_accents(self):
+        """Test that non-ASCII prefixes match whatever their case and accents, on every backend"""
+        make_user('elise', 'Élise Martin')
+        zoe = make_user('zoe', 'Zoe')
+        for query in ('é', 'É', 'eli', 'ÉLI'):
+            self.assertEqual(self._usernames(q=query), ['elise'])
+
+        zoe.display_name = 'Éclair'
+        zoe.save(update_fields=['display_name'])
+        self.assertEqual(self._usernames(q='ecl'), ['zoe'])
+
+    def test_create_chat_pages_do_not_list_users(self):
+        """Test that the chat creation pages use the typeahead instead of rendering every user"""
+        self.client.force_login(self.user)
+        for url in (reverse('create_private_chat'), reverse('create_group_chat')):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotContains(response, 'carol')
+            self.assertContains(response, 'userTypeahead')
+
+
+class UserIndexTest(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        reset_user_index()
+        self.addCleanup(reset_user_index)
+        self.user = make_user('writer', 'Writer')
+        self.users = {
+            username: make_user(username, display_name)
+            for username, display_name in (('alice', 'Alice Smith'), ('alan', 'Alan Turing'), ('bob', 'Alfred Bob'), ('émile', 'Émile Zola'))
+        }
+        self.conversation_id = make_group(self.user, [self.users['bob']], title='Team').conversation_id
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def _mentions(self, q):
+        response = self.client.get(f'/api/conversations/{self.conversation_id}/mentions/', {'q': q})
+        self.assertEqual(response.status_code, 200)
+        return [user['username'] for user in response.data['results']]
+
+    def test_prefix_lookup(self):
+        """Test matches on the username or any word of the display name, ignoring case and accents"""
+        index = UserIndex([(1, 'alice', 'Alice Smith'), (2, 'alan', 'Alan Turing'), (3, 'bob', 'Alfred Bob'), (4, 'émile', 'Émile Zola')])
+        self.assertEqual(index.search('AL', limit=10), [2, 3, 1])
+        self.assertEqual(index.search('tur'), [2])
+        self.assertEqual(index.search('emile'), [4])
+        self.assertEqual(index.search('lice'), [])
+        self.assertEqual(index.search(''), [])
+
+    def test_members_rank_first(self):
+        """Test that conversation members come before other matches, then exact matches"""
+        self.assertEqual(self._mentions('al'), ['bob', 'alan', 'alice'])
+        self.assertEqual(UserIndex([(1, 'alfie', 'Alfie'), (2, 'al', 'Al')]).search('al'), [2, 1])
+
+    def test_members_beyond_scan_window(self):
+        """Test that members rank first even when a short prefix matches more keys than are scanned"""
+        index = UserIndex((user_id, f'user{user_id:05d}', 'Someone') for user_id in range(SCAN_LIMIT * 2))
+        last = SCAN_LIMIT * 2 - 1
+        self.assertEqual(index.search('u', limit=3, member_ids=frozenset({last, 7})), [7, last, 0])
+        index.discard(last, f'user{last:05d}', 'Someone')
+        self.assertEqual(index.search('u', limit=2, member_ids=frozenset({last})), [0, 1])
+
+    def test_signals_update_index(self):
+        """Test that renames, deactivation and deletion reach a built index once committed"""
+        self.assertEqual(self._mentions('zed'), [])
+        alice = self.users['alice']
+        with self.captureOnCommitCallbacks(execute=True):
+            alice.display_name = 'Zed Smith'
+            alice.save()
+            make_user('zoe', 'Zoe')
+        self.assertEqual(self._mentions('z'), ['alice', 'zoe', 'émile'])
+        self.assertNotIn('alice', self._mentions('alice s'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.users['alan'].delete()
+            self.users['émile'].is_active = False
+            self.users['émile'].save(update_fields=['is_active'])
+        self.assertEqual(get_user_index().search('alan'), [])
+        self.assertEqual(get_user_index().search('zola'), [])
+
+    def test_refresh_picks_up_changes_from_other_processes(self):
+        """Test that a refresh applies renames saved with update_fields and deactivations, and only those"""
+        index = UserIndex.build()
+        alice, bob = self.users['alice'], self.users['bob']
+        # A standalone index stands in for another process's: signals never update it
+        alice.display_name = 'Zed Jones'
+        alice.save(update_fields=['display_name'])
+        bob.is_active = False
+        bob.save(update_fields=['is_active'])
+        self.user.is_online = True
+        self.user.save(update_fields=['is_online'])
+
+        with CaptureQueriesContext(connection) as queries:
+            index.refresh()
+        self.assertEqual(index.search('zed'), [alice.pk])
+        self.assertEqual(index.search('smith'), [])
+        self.assertEqual(index.search('alfred'), [])
+        self.assertEqual(index.search('writer'), [self.user.pk])
+        self.assertIn('"updated_at" >=', queries.captured_queries[0]['sql'])
+
+    def test_presence_saves_skip_index(self):
+        """Test that saves not touching names or activation do not query for the old names"""
+        with CaptureQueriesContext(connection) as queries:
+            self.user.is_online = True
+            self.user.save(update_fields=['is_online'])
+        self.assertFalse([query for query in queries.captured_queries if query['sql'].startswith('SELECT "user"."username"')])
+
+    def test_lookup_speed(self):
+        """Test that lookups in a few hundred thousand users stay well under a millisecond"""
+        index = UserIndex((user_id, f'user{user_id}', f'Person {user_id} Example') for user_id in range(300000))
+        start = time.perf_counter()
+        for prefix in ('user1', 'person 29', 'exa', 'u', 'user29999'):
+            for _ in range(100):
+                index.search(prefix, limit=10, member_ids=frozenset({5, 12345}))
+        self.assertLess((time.perf_counter() - start) / 500, 0.001)
+
+    def test_rebuild_does_not_block_lookups(self):
+        """Test that other callers keep using the old index while one thread builds its replacement"""
+        old_index = get_user_index()
+        build = UserIndex.build
+        seen = []
+
+        def slow_build():
+            reader = threading.Thread(target=lambda: seen.append(get_user_index()))
+            reader.start()
+            reader.join(timeout=5)
+            return build()
+
+        with override_settings(USER_INDEX_REBUILD_INTERVAL=-1), patch.object(UserIndex, 'build', side_effect=slow_build):
+            new_index = get_user_index()
+        self.assertEqual(seen, [old_index])
+        self.assertIsNot(new_index, old_index)
+        self.assertIs(get_user_index(), new_index)
+
+    def test_mentions_require_membership(self):
+        """Test that only members of a conversation can complete mentions in it"""
+        outsider = APIClient()
+        outsider.force_authenticate(user=self.users['alice'])
+        response = outsider.get(f'/api/conversations/{self.conversation_id}/mentions/', {'q': 'a'})
+        self.assertEqual(response.status_code, 404)
+
+
+class BatchTest(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('starter', 'Starter')
+        friend = make_user('friend', 'Friend')
+        self.conversation = make_private_chat(self.user, friend)
+        deliver_message(Message.objects.create(conversation=self.conversation, sender=friend, content='hello'))
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def _batch(self, *specs):
+        return self.client.post('/api/batch/', {'requests': list(specs)}, format='json')
+
+    def test_responses_match_separate_requests(self):
+        """Test that each sub-request answers as the endpoint would on its own, in order"""
+        paths = ['/api/users/me/', '/api/conversations/', f'/api/conversations/{self.conversation.conversation_id}/messages/?limit=1', '/api/csrf/']
+        response = self._batch(*({'path': path} for path in paths))
+        self.assertEqual(response.status_code, 200)
+        results = response.data['responses']
+        self.assertEqual([result['status'] for result in results], [200, 200, 200, 200])
+        for path, result in zip(paths[:3], results):
+            self.assertEqual(json.loads(json.dumps(result['body'])), self.client.get(path).json())
+        self.assertIn('csrfToken', results[3]['body'])
+
+    def test_conditional_sub_requests(self):
+        """Test that an ETag from a batch can be revalidated inside a later batch"""
+        path = f'/api/conversations/{self.conversation.conversation_id}/'
+        etag = self._batch({'path': path}).data['responses'][0]['headers']['ETag']
+        result = self._batch({'path': path, 'headers': {'If-None-Match': etag}}).data['responses'][0]
+        self.assertEqual(result['status'], 304)
+        self.assertIsNone(result['body'])
+
+    def test_rejected_sub_requests(self):
+        """Test that writes, non-API paths and nested batches fail individually"""
+        results = self._batch(
+            {'path': '/api/users/me/', 'method': 'POST'}, {'path': '/login/'}, {'path': '/api/batch/'},
+            {'path': '/api/nowhere/'}, {'path': '/api/users/me/'}
+        ).data['responses']
+        self.assertEqual([result['status'] for result in results], [405, 404, 400, 404, 200])
+
+        self.assertEqual(self._batch().status_code, 400)
+        with override_settings(BATCH_MAX_REQUESTS=2):
+            self.assertEqual(self._batch(*[{'path': '/api/users/me/'}] * 3).status_code, 400)
+        self.assertEqual(APIClient().post('/api/batch/', {'requests': [{'path': '/api/users/me/'}]}, format='json').status_code, 403)
+
+    def test_streaming_sub_requests_rejected(self):
+        """Test that a streaming endpoint fails on its own without failing the rest of the batch"""
+        response = self._batch(
+            {'path': '/api/users/'}, {'path': f'/api/conversations/{self.conversation.conversation_id}/export/'}, {'path': '/api/users/me/'}
+        )
+        self.assertEqual(response.status_code, 200)
+        results = response.data['responses']
+        self.assertEqual([result['status'] for result in results], [200, 400, 200])
+        self.assertEqual(results[1]['body'], {'error': 'Streaming endpoints cannot be batched'})
+
+    def test_session_loaded_once(self):
+        """Test that the session and user are loaded once for the whole batch"""
+        client = APIClient()
+        client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post(
+                '/api/batch/', {'requests': [{'path': '/api/users/me/'}, {'path': '/api/conversations/'}, {'path': '/api/inbox/'}]},
+                format='json'
+            )
+        self.assertEqual([result['status'] for result in response.data['responses']], [200, 200, 200])
+        self.assertEqual(len([query for query in queries.captured_queries if 'django_session' in query['sql']]), 1)
+
+
+class ConversationExportTest(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('exporter', 'Exporter')
+        self.friend = make_user('friend', 'Friend')
+        self.conversation = make_private_chat(self.user, self.friend)
+        start = timezone.now() - timedelta(days=10)
+        self.messages = []
+        for number in range(6):
+            message = Message.objects.create(conversation=self.conversation, sender=self.user if number % 2 else self.friend, content=f'message {number}')
+            Message.objects.filter(pk=message.pk).update(sent_at=start + timedelta(hours=number))
+            self.messages.append(message)
+        Reaction.objects.create(message=self.messages[0], user=self.user, emoji='👍')
+        Attachment.objects.create(message=self.messages[0], file_name='plan.pdf', mime_type='application/pdf', file_size=1024)
+        Reaction.objects.create(message=self.messages[4], user=self.friend, emoji='❤️')
+        deleted = self.messages.pop(5)
+        Message.objects.filter(pk=deleted.pk).update(is_deleted=True)
+        # The oldest messages move to the archive; one hot message is older than an archived one
+        archive_batch([self.messages[0].pk, self.messages[2].pk])
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def _records(self, response):
+        self.assertTrue(response.streaming)
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_streams_both_tiers_in_order(self):
+        """Test that the export has every live message oldest first, with reactions and attachment metadata"""
+        response = self.client.get(f'/api/conversations/{self.conversation.conversation_id}/export/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = self._records(response)
+        self.assertEqual([record['message_id'] for record in records], [message.pk for message in self.messages])
+        self.assertEqual(records[0]['content'], 'message 0')
+        self.assertEqual(records[0]['reactions'][0]['emoji'], '👍')
+        self.assertEqual(records[0]['attachments'][0]['file_name'], 'plan.pdf')
+        self.assertEqual(records[4]['reactions'][0]['username'], 'friend')
+        self.assertEqual(records[1]['attachments'], [])
+
+    def test_resume_from_cursor(self):
+        """Test that `after` continues right after the line that carried the cursor"""
+        url = f'/api/conversations/{self.conversation.conversation_id}/export/'
+        records = self._records(self.client.get(url))
+        resumed = self._records(self.client.get(url, {'after': records[1]['cursor']}))
+        self.assertEqual(resumed, records[2:])
+        self.assertEqual(self.client.get(url, {'after': 'bad'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/conversations/999999/export/').status_code, 404)
+
+        # Export cursors are message list cursors
+        page = self.client.get(f'/api/conversations/{self.conversation.conversation_id}/messages/', {'after': records[1]['cursor'], 'page_size': 2})
+        self.assertEqual([message['message_id'] for message in page.data['results']], [record['message_id'] for record in records[2:4]])
+
+    def test_members_only(self):
+        """Test that users outside the conversation cannot export it"""
+        outsider = APIClient()
+        outsider.force_authenticate(user=make_user('outsider', 'Outsider'))
+        response = outsider.get(f'/api/conversations/{self.conversation.conversation_id}/export/')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.streaming)
+
+    def test_queries_per_batch_not_per_message(self):
+        """Test that the export reads in batches whose query count does not grow with the messages"""
+        with CaptureQueriesContext(connection) as few:
+            small = list(export_messages(self.conversation.conversation_id, batch_size=100))
+        for number in range(20):
+            message = Message.objects.create(conversation=self.conversation, sender=self.user, content=f'more {number}')
+            Reaction.objects.create(message=message, user=self.friend, emoji='👍')
+        with CaptureQueriesContext(connection) as many:
+            large = list(export_messages(self.conversation.conversation_id, batch_size=100))
+        self.assertEqual(len(large), len(small) + 20)
+        self.assertEqual(len(many.captured_queries), len(few.captured_queries))
+
+        self.assertEqual(
+            [record['message_id'] for record in export_messages(self.conversation.conversation_id, batch_size=2)],
+            [record['message_id'] for record in large]
+        )
+
+    def test_management_command(self):
+        """Test that the command writes NDJSON and appends when resuming"""
+        out = StringIO()
+        call_command('export_conversation', self.conversation.conversation_id, stdout=out)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(len(records), 5)
+
+        path = os.path.join(tempfile.mkdtemp(), 'export.ndjson')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        call_command('export_conversation', self.conversation.conversation_id, output=path, batch_size=2, stdout=StringIO())
+        with open(path, 'rb') as exported:
+            lines = exported.read().splitlines()
+        with open(path, 'wb') as exported:
+            exported.write(b'\n'.join(lines[:3]) + b'\n')
+        call_command('export_conversation', self.conversation.conversation_id, output=path, after=json.loads(lines[2])['cursor'], stdout=StringIO())
+        with open(path, 'rb') as exported:
+            self.assertEqual(exported.read().splitlines(), lines)
+
+        with self.assertRaises(CommandError):
+            call_command('export_conversation', 999999, stdout=StringIO())
@@ -23,6 +23,9 @@ urlpatterns = [
     path('chat/<int:conversation_id>/send/', views.SendMessageView.as_view(), name='send_message'),
     path('upload-attachment/', views.upload_attachment, name='upload_attachment'),
     path('search/', views.user_search, name='user_search'),
+    path('manage/conversations/<int:conversation_id>/delete/', views.delete_conversation, name='delete_conversation'),
+    path('manage/users/<int:user_id>/delete/', views.delete_user, name='delete_user'),
+    path('deletion-jobs/<int:job_id>/', views.deletion_job_status, name='deletion_job_status'),
 
     # API views
     path('api/users/me/', api_views.UserDetailView.as_view(), name='api_auth_user'),
@@ -30,8 +33,12 @@ urlpatterns = [
     path('api/users/', api_views.UserListView.as_view(), name='api_user_list'),
     path('api/users/<int:user_id>/', api_views.UserDetailView.as_view(), name='api_user_detail'),
     path('api/conversations/', api_views.ConversationListView.as_view(), name='api_conversation_list'),
+    path('api/inbox/', api_views.InboxView.as_view(), name='api_inbox'),
+    path('api/batch/', api_views.BatchView.as_view(), name='api_batch'),
     path('api/conversations/<int:conversation_id>/', api_views.ConversationDetailView.as_view(), name='api_conversation_detail'),
     path('api/conversations/<int:conversation_id>/messages/', api_views.MessageListView.as_view(), name='api_message_list'),
+    path('api/conversations/<int:conversation_id>/mentions/', api_views.MentionView.as_view(), name='api_mention_list'),
+    path('api/conversations/<int:conversation_id>/export/', api_views.ConversationExportView.as_view(), name='api_conversation_export'),
     path('api/messages/<int:message_id>/', api_views.MessageDetailView.as_view(), name='api_message_detail'),
     path('api/attachments/', api_views.AttachmentListView.as_view(), name='api_attachment_list'),
     path('api/messages/<int:message_id>/attachments/', api_views.AttachmentListView.as_view(), name='api_message_attachment_list'),
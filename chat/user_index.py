@@ -0,0 +1,236 @@
+import logging
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Index entries examined per lookup; bounds the cost of one-letter prefixes
+SCAN_LIMIT = 2000
+
+
+def normalize(text):
+    """Case- and accent-insensitive form used for both index keys and queries."""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold().strip()
+
+
+def index_keys(username, display_name):
+    """Keys a user is found under: the username, the display name and each later word of it."""
+    keys = {normalize(username), normalize(display_name)}
+    keys.update(normalize(word) for word in (display_name or '').split()[1:])
+    keys.discard('')
+    return keys
+
+
+class UserIndex:
+    """
+    Prefix index over usernames and display names for autocomplete. Keys are kept in one sorted
+    list with the matching user IDs in a parallel array('q'), so a lookup is a bisect plus a short
+    scan. Lookups return user IDs only; callers load the few rows they display.
+    """
+
+    def __init__(self, rows=()):
+        entries = sorted(
+            (key, user_id)
+            for user_id, username, display_name in rows
+            for key in index_keys(username, display_name)
+        )
+        self._keys = [key for key, _ in entries]
+        self._ids = array('q', (user_id for _, user_id in entries))
+        # Each user's keys, for finding conversation members that sort beyond the scanned window
+        keys_by_user = {}
+        for key, user_id in entries:
+            keys_by_user.setdefault(user_id, []).append(key)
+        self._keys_by_user = {user_id: tuple(keys) for user_id, keys in keys_by_user.items()}
+        self._lock = threading.Lock()
+        self.built_at = time.monotonic()
+        self.synced_at = timezone.now()
+        self.refreshed_at = self.built_at
+
+    @classmethod
+    def build(cls):
+        from .models import User
+        started = timezone.now()
+        rows = User.objects.filter(is_active=True).values_list('user_id', 'username', 'display_name').iterator(chunk_size=5000)
+        index = cls(rows)
+        index.synced_at = started
+        logger.info(f"Built user index with {len(index)} keys")
+        return index
+
+    def __len__(self):
+        return len(self._keys)
+
+    def search(self, prefix, limit=10, member_ids=frozenset()):
+        """
+        IDs of users with a key starting with `prefix`: members of `member_ids` first, then in key
+        order, which puts exact matches ahead of longer names.
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        with self._lock:
+            start = bisect_left(self._keys, prefix)
+            stop = bisect_left(self._keys, prefix + '\U0010ffff', start)
+            end = min(stop, start + SCAN_LIMIT)
+            window = self._ids[start:end]
+            # A short prefix can match more keys than are scanned; members are then looked up by their own keys
+            member_keys = {user_id: self._keys_by_user.get(user_id, ()) for user_id in member_ids} if stop > end else None
+
+        # Distinct IDs in key order; the set and dict work stays in C, so wide prefixes are cheap too
+        candidates = list(dict.fromkeys(window))
+        members = []
+        if member_keys is not None:
+            # Same order as the window: by first matching key, then user ID
+            matched = (
+                (min((key for key in keys if key.startswith(prefix)), default=None), user_id)
+                for user_id, keys in member_keys.items()
+            )
+            members = [user_id for key, user_id in sorted(match for match in matched if match[0] is not None)]
+        elif member_ids:
+            positions = {user_id: position for position, user_id in enumerate(candidates)}
+            members = sorted(member_ids.intersection(candidates), key=positions.__getitem__)
+        ranked = members[:limit]
+        for user_id in candidates:
+            if len(ranked) >= limit:
+                break
+            if user_id not in member_ids:
+                ranked.append(user_id)
+        return ranked
+
+    def add(self, user_id, username, display_name):
+        with self._lock:
+            for key in index_keys(username, display_name):
+                if self._find(key, user_id) is None:
+                    position = bisect_right(self._keys, key)
+                    self._keys.insert(position, key)
+                    self._ids.insert(position, user_id)
+                    self._keys_by_user[user_id] = (*self._keys_by_user.get(user_id, ()), key)
+
+    def discard(self, user_id, username, display_name):
+        with self._lock:
+            for key in index_keys(username, display_name):
+                position = self._find(key, user_id)
+                if position is not None:
+                    del self._keys[position]
+                    del self._ids[position]
+                    remaining = tuple(other for other in self._keys_by_user.get(user_id, ()) if other != key)
+                    if remaining:
+                        self._keys_by_user[user_id] = remaining
+                    else:
+                        self._keys_by_user.pop(user_id, None)
+
+    def _find(self, key, user_id):
+        position = bisect_left(self._keys, key)
+        while position < len(self._keys) and self._keys[position] == key:
+            if self._ids[position] == user_id:
+                return position
+            position += 1
+        return None
+
+    def remove(self, user_id):
+        """Drop every key of a user, including those of names they no longer have."""
+        with self._lock:
+            for key in self._keys_by_user.pop(user_id, ()):
+                position = self._find(key, user_id)
+                if position is not None:
+                    del self._keys[position]
+                    del self._ids[position]
+
+    def refresh(self):
+        """
+        Pick up users renamed, deactivated or reactivated by other processes since the last sync,
+        through the index on updated_at. Users deleted elsewhere stay until the next rebuild, which is
+        why callers check the rows they load.
+        """
+        from .models import User
+        started = timezone.now()
+        changed = User.objects.filter(updated_at__gte=self.synced_at).values_list('user_id', 'username', 'display_name', 'is_active')
+        for user_id, username, display_name, is_active in changed:
+            self.remove(user_id)
+            if is_active:
+                self.add(user_id, username, display_name)
+        self.synced_at = started
+        self.refreshed_at = time.monotonic()
+
+
+_user_index = None
+_index_lock = threading.Lock()
+# Held by the one thread building or refreshing the index, so the others never wait on the database
+_build_lock = threading.Lock()
+
+
+def get_user_index():
+    """
+    Return the per-process user index, building it on first use and rebuilding or refreshing it
+    when due. The new index is built outside _index_lock and swapped in under it; meanwhile other
+    callers keep using the old one, and only callers with no index at all wait for the first build.
+    """
+    global _user_index
+    index = _user_index
+    now = time.monotonic()
+    if index is None or now - index.built_at > settings.USER_INDEX_REBUILD_INTERVAL:
+        if _build_lock.acquire(blocking=index is None):
+            try:
+                index = _user_index
+                if index is None or time.monotonic() - index.built_at > settings.USER_INDEX_REBUILD_INTERVAL:
+                    index = UserIndex.build()
+                    with _index_lock:
+                        _user_index = index
+            finally:
+                _build_lock.release()
+    elif now - index.refreshed_at > settings.USER_INDEX_REFRESH_INTERVAL:
+        if _build_lock.acquire(blocking=False):
+            try:
+                index.refresh()
+            finally:
+                _build_lock.release()
+    return index
+
+
+def reset_user_index():
+    """Drop the per-process index; the next lookup rebuilds it."""
+    global _user_index
+    with _index_lock:
+        _user_index = None
+
+
+def update_user_index(user_id, old_names=None, new_names=None):
+    """Apply a committed user change to this process's index, if it has been built."""
+    index = _user_index
+    if index is None:
+        return
+    if old_names:
+        index.discard(user_id, *old_names)
+    if new_names:
+        index.add(user_id, *new_names)
+
+
+def autocomplete_users(prefix, limit=10, conversation_id=None, exclude_user_id=None):
+    """
+    Active users matching a name prefix, members of `conversation_id` first. One primary-key
+    query loads the rows to show; rows whose names no longer match (renamed elsewhere) are dropped.
+    """
+    from .membership_cache import get_member_ids
+    from .models import User
+
+    member_ids = get_member_ids(conversation_id) if conversation_id is not None else frozenset()
+    # A few spare candidates make up for stale entries and the excluded user
+    user_ids = [
+        user_id for user_id in get_user_index().search(prefix, limit + 5, member_ids)
+        if user_id != exclude_user_id
+    ]
+    users = User.objects.filter(user_id__in=user_ids, is_active=True).in_bulk()
+
+    query = normalize(prefix)
+    matches = [
+        users[user_id] for user_id in user_ids
+        if user_id in users and any(key.startswith(query) for key in index_keys(users[user_id].username, users[user_id].display_name))
+    ]
+    return matches[:limit]
@@ -4,17 +4,23 @@ from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, authenticate, logout
 from django.contrib import messages
-from django.db import models
+from django.db import transaction
 from django.views import View
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 import json
 import logging
-from .models import User, Conversation, Message, AuditLog, PrivateChat, GroupChat, GroupMember, Role, UserRole, Attachment
+from .audit import audit_log_page, log_action
+from .conversation_state import deliver_message
+from .deletion import request_conversation_deletion, request_user_deletion
+from .db_router import read_from_replica
+from .user_index import autocomplete_users
+from .models import User, Conversation, Message, AuditLog, DeletionJob, PrivateChat, GroupChat, GroupMember, Role, UserRole, Attachment
 
 logger = logging.getLogger(__name__)
 
 @permission_required('view_admin_panel')
+@read_from_replica
 def admin_panel(request):
     try:
         # Get basic stats
@@ -23,7 +29,7 @@ def admin_panel(request):
         total_messages = Message.objects.count()
 
         # Get recent audit logs
-        recent_logs = AuditLog.objects.select_related('actor').order_by('-timestamp')[:50]
+        recent_logs = AuditLog.objects.select_related('actor').order_by('-timestamp', '-log_id')[:50]
 
         context = {
             'total_users': total_users,
@@ -77,7 +83,7 @@ def assign_user_role(request):
         UserRole.objects.create(user=target_user, role=role)
 
         # Log the action
-        AuditLog.objects.create(
+        log_action(
             actor=request.user,
             action='update',
             target_type='user',
@@ -123,7 +129,7 @@ def remove_user_role(request):
         UserRole.objects.filter(user=target_user, role=role).delete()
 
         # Log the action
-        AuditLog.objects.create(
+        log_action(
             actor=request.user,
             action='update',
             target_type='user',
@@ -145,29 +151,22 @@ def remove_user_role(request):
 @permission_required('view_audit_logs')
 def audit_logs(request):
     try:
-        logs = AuditLog.objects.select_related('actor').order_by('-timestamp')
-
-        # Filter by date range if provided
-        start_date = request.GET.get('start_date')
-        end_date = request.GET.get('end_date')
-        if start_date:
-            logs = logs.filter(timestamp__gte=start_date)
-        if end_date:
-            logs = logs.filter(timestamp__lte=end_date)
-
-        # Filter by action type if provided
-        action = request.GET.get('action')
-        if action:
-            logs = logs.filter(action=action)
-
-        # Paginate results
-        from django.core.paginator import Paginator
-        paginator = Paginator(logs, 50)  # 50 logs per page
-        page_number = request.GET.get('page')
-        page_obj = paginator.get_page(page_number)
+        # Keyset pagination: `before` is the cursor of the last entry on the previous page
+        try:
+            logs, next_cursor = audit_log_page(
+                start_date=request.GET.get('start_date'),
+                end_date=request.GET.get('end_date'),
+                action=request.GET.get('action'),
+                before=request.GET.get('before'),
+                limit=50
+            )
+        except ValueError as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
 
         return render(request, 'chat/audit_logs.html', {
-            'page_obj': page_obj,
+            'logs': logs,
+            'next_cursor': next_cursor,
+            'filters': {key: request.GET.get(key, '') for key in ('start_date', 'end_date', 'action')},
             'actions': AuditLog.ACTION_CHOICES,
             'targets': AuditLog.TARGET_TYPES
         })
@@ -181,24 +180,25 @@ def delete_conversation(request, conversation_id):
         return JsonResponse({'status': 'error', 'message': 'Method not allowed'}, status=405)
 
     try:
-        conversation = Conversation.objects.get(conversation_id=conversation_id)
+        conversation = Conversation.objects.get(conversation_id=conversation_id, deleted_at__isnull=True)
 
         # Log the action before deletion
-        AuditLog.objects.create(
+        log_action(
             actor=request.user,
             action='delete',
             target_type='conversation',
             target_id=conversation.conversation_id,
             old_value=f'Deleted conversation: {conversation.title or "Untitled"}',
             new_value='',
-            ip_address=get_client_ip(request)
+            ip_address=get_client_ip(request),
+            durable=True
         )
 
-        # Delete the conversation (this will cascade delete related objects)
-        conversation.delete()
+        # Hide the conversation now; messages, attachments and files are removed in the background
+        job = request_conversation_deletion(conversation, requested_by=request.user)
 
-        logger.info(f"User {request.user.username} deleted conversation {conversation_id}")
-        return JsonResponse({'status': 'success', 'message': 'Conversation deleted successfully'})
+        logger.info(f"User {request.user.username} deleted conversation {conversation_id} (deletion job {job.job_id})")
+        return JsonResponse({'status': 'success', 'message': 'Conversation deletion started', 'job_id': job.job_id}, status=202)
 
     except Conversation.DoesNotExist:
         return JsonResponse({'status': 'error', 'message': 'Conversation not found'}, status=404)
@@ -206,6 +206,63 @@ def delete_conversation(request, conversation_id):
         logger.error(f"Error deleting conversation {conversation_id} by user {request.user.username}: {str(e)}")
         return JsonResponse({'status': 'error', 'message': 'Failed to delete conversation'}, status=500)
 
+@permission_required('manage_users')
+def delete_user(request, user_id):
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Method not allowed'}, status=405)
+
+    try:
+        target_user = User.objects.get(user_id=user_id)
+        if target_user == request.user:
+            return JsonResponse({'status': 'error', 'message': 'You cannot delete your own account here'}, status=400)
+
+        log_action(
+            actor=request.user,
+            action='delete',
+            target_type='user',
+            target_id=target_user.user_id,
+            old_value=f'Deleted user: {target_user.username}',
+            new_value='',
+            ip_address=get_client_ip(request),
+            durable=True
+        )
+
+        # Deactivate now; the account and everything it owns are removed in the background
+        job = request_user_deletion(target_user, requested_by=request.user)
+
+        logger.info(f"User {request.user.username} deleted user {target_user.username} (deletion job {job.job_id})")
+        return JsonResponse({'status': 'success', 'message': 'User deletion started', 'job_id': job.job_id}, status=202)
+
+    except User.DoesNotExist:
+        return JsonResponse({'status': 'error', 'message': 'User not found'}, status=404)
+    except Exception as e:
+        logger.error(f"Error deleting user {user_id} by user {request.user.username}: {str(e)}")
+        return JsonResponse({'status': 'error', 'message': 'Failed to delete user'}, status=500)
+
+@login_required
+def deletion_job_status(request, job_id):
+    try:
+        job = DeletionJob.objects.get(job_id=job_id)
+        if job.requested_by_id != request.user.user_id and not request.user.is_superuser:
+            return JsonResponse({'status': 'error', 'message': 'Deletion job not found'}, status=404)
+        return JsonResponse({
+            'status': 'success',
+            'job': {
+                'job_id': job.job_id,
+                'target_type': job.target_type,
+                'target_id': job.target_id,
+                'state': job.status,
+                'step': job.step,
+                'rows_deleted': job.rows_deleted,
+                'files_deleted': job.files_deleted,
+                'error': job.error,
+                'created_at': job.created_at.isoformat(),
+                'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+            }
+        })
+    except DeletionJob.DoesNotExist:
+        return JsonResponse({'status': 'error', 'message': 'Deletion job not found'}, status=404)
+
 def get_client_ip(request):
     """Get the client IP address from the request."""
 class LoginView(View):
@@ -264,13 +321,13 @@ class RegisterView(View):
 
 @login_required
 def chat_list(request):
-    conversations = get_user_conversations(request.user)
+    conversations = get_user_conversations(request.user).order_by('-last_activity_at')
     return render(request, 'chat/chat_list.html', {'conversations': conversations})
 
 @login_required
 def chat_detail(request, conversation_id):
     try:
-        conversation = Conversation.objects.get(conversation_id=conversation_id)
+        conversation = Conversation.objects.get(conversation_id=conversation_id, deleted_at__isnull=True)
 
         # Check if user has access to this conversation
         if not request.user.can_access_conversation(conversation):
@@ -328,9 +385,8 @@ def create_private_chat(request):
             logger.error(f"Error creating private chat: {str(e)}")
             messages.error(request, 'Unable to create chat at this time. Please try again later.')
 
-    # Get users excluding current user
-    users = User.objects.exclude(user_id=request.user.user_id)
-    return render(request, 'chat/create_private_chat.html', {'users': users})
+    # Members are picked through the directory typeahead (/api/users/?q=) instead of a full user list
+    return render(request, 'chat/create_private_chat.html')
 
 @login_required
 def create_group_chat(request):
@@ -378,9 +434,8 @@ def create_group_chat(request):
             logger.error(f"Error creating group chat: {str(e)}")
             messages.error(request, 'Failed to create group chat')
 
-    # Get users excluding current user
-    users = User.objects.exclude(user_id=request.user.user_id)
-    return render(request, 'chat/create_group_chat.html', {'users': users})
+    # Members are picked through the directory typeahead (/api/users/?q=) instead of a full user list
+    return render(request, 'chat/create_group_chat.html')
 
 @login_required
 def user_search(request):
@@ -388,11 +443,8 @@ def user_search(request):
     results = []
 
     if query:
-        # Search by username or display name
-        users = User.objects.filter(
-            models.Q(username__icontains=query) |
-            models.Q(display_name__icontains=query)
-        ).exclude(user_id=request.user.user_id)[:10]
+        # Prefix of the username or of a word in the display name, from the in-process index
+        users = autocomplete_users(query, limit=10, exclude_user_id=request.user.user_id)
 
         results = [{
             'user_id': user.user_id,
@@ -417,17 +469,19 @@ class SendMessageView(View):
                 return JsonResponse({'status': 'error', 'message': 'Message content is required'})
 
             # Verify conversation access
-            conversation = Conversation.objects.get(conversation_id=conversation_id)
+            conversation = Conversation.objects.get(conversation_id=conversation_id, deleted_at__isnull=True)
             if not request.user.can_access_conversation(conversation):
                 return JsonResponse({'status': 'error', 'message': 'You do not have permission to send messages in this conversation'})
 
             # Create message
-            message = Message.objects.create(
-                conversation_id=conversation_id,
-                sender=request.user,
-                content=content,
-                reply_to_id=reply_to_id if reply_to_id else None
-            )
+            with transaction.atomic():
+                message = Message.objects.create(
+                    conversation=conversation,
+                    sender=request.user,
+                    content=content,
+                    reply_to_id=reply_to_id if reply_to_id else None
+                )
+                deliver_message(message)
 
             return JsonResponse({
                 'status': 'ok',
@@ -437,7 +491,7 @@ class SendMessageView(View):
                     'content': message.content,
                     'sender': message.sender.display_name,
                     'sent_at': message.sent_at.isoformat(),
-                    'reply_to': message.reply_to.message_id if message.reply_to else None
+                    'reply_to': message.reply_to_id
                 }
             })
 
@@ -544,17 +598,4 @@ def get_client_ip(request):
 
 def get_user_conversations(user):
     """Get all conversations for a user (private and group)."""
-    # Get private chats where user is user1 or user2
-    private_conversations = Conversation.objects.filter(
-        privatechat__user1=user
-    ) | Conversation.objects.filter(
-        privatechat__user2=user
-    )
-
-    # Get group chats where user is a member
-    group_conversations = Conversation.objects.filter(
-        groupchat__groupmember__user=user
-    )
-
-    # Combine the querysets using union (distinct is implicit in union)
-    return private_conversations.union(group_conversations)
+    return Conversation.objects.filter(members__user=user, deleted_at__isnull=True)
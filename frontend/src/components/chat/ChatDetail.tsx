@@ -32,6 +32,7 @@ interface Message {
     emoji: string;
     count: number;
     users: string[];
+    reacted?: boolean;
   }>;
   is_edited?: boolean;
   is_deleted?: boolean;
@@ -96,7 +97,7 @@ const ChatDetail: React.FC = () => {
     try {
       setLoading(true);
       const response = await chatAPI.getMessages(parseInt(conversationId!));
-      setMessages(response.data);
+      setMessages(response.data.results ?? response.data);
     } catch (err) {
       setError('Failed to load messages');
       console.error('Error loading messages:', err);
@@ -28,7 +28,8 @@ const CreateGroupChat: React.FC = () => {
     try {
       setLoading(true);
       const response = await userAPI.getUsers();
-      setUsers(response.data);
+      // First page of the user directory, ordered by username
+      setUsers(response.data.results);
     } catch (err) {
       setError('Failed to load users');
       console.error('Error loading users:', err);
@@ -46,9 +46,22 @@ export const authAPI = {
 export const chatAPI = {
   getConversations: () => api.get('/api/conversations/'),
 
+  // Conversation list with last message, participant and unread counts; pass `cursor` from `next` to page
+  getInbox: (params?: { cursor?: string; page_size?: number }) => api.get('/api/inbox/', { params }),
+
   getConversation: (id: number) => api.get(`/api/conversations/${id}/`),
 
-  getMessages: (conversationId: number) => api.get(`/api/conversations/${conversationId}/messages/`),
+  // Newest page by default; pass `before`/`after` cursors from a previous response to page
+  getMessages: (conversationId: number, cursor?: { before?: string; after?: string; page_size?: number }) =>
+    api.get(`/api/conversations/${conversationId}/messages/`, { params: cursor }),
+
+  // Full history as NDJSON; pass the `cursor` of the last line received as `after` to resume
+  exportConversation: (conversationId: number, after?: string) =>
+    api.get(`/api/conversations/${conversationId}/export/`, { params: { after }, responseType: 'blob' }),
+
+  // Mention autocomplete: members of the conversation first
+  getMentionCandidates: (conversationId: number, q: string, pageSize?: number) =>
+    api.get(`/api/conversations/${conversationId}/mentions/`, { params: { q, page_size: pageSize } }),
 
   sendMessage: (conversationId: number, content: string, replyTo?: number) =>
     api.post(`/chat/${conversationId}/send/`, { content, reply_to: replyTo }),
@@ -59,21 +72,41 @@ export const chatAPI = {
   createGroupChat: (data: { title: string; member_ids: number[]; description?: string }) =>
     api.post('/api/create-group-chat/', data),
 
-  searchMessages: (query: string) =>
-    api.get('/api/search/messages/', { params: { q: query } }),
+  // Best matches first; pass `cursor` from a previous response's `next` link to continue
+  searchMessages: (
+    query: string,
+    filters?: {
+      conversation_id?: number;
+      sender_id?: number;
+      after?: string;
+      before?: string;
+      has_attachment?: boolean;
+      mime_type?: string;
+      cursor?: string;
+      page_size?: number;
+    }
+  ) =>
+    api.get('/api/search/messages/', { params: { q: query, ...filters } }),
 };
 
 // User API
 export const userAPI = {
   searchUsers: (query: string) => api.get('/search/', { params: { q: query } }),
 
-  getUsers: () => api.get('/api/users/'),
+  // User directory ordered by username; `q` is a prefix of the username or display name
+  getUsers: (params?: { q?: string; cursor?: string; page_size?: number }) => api.get('/api/users/', { params }),
 
   getUser: (id: number) => api.get(`/api/users/${id}/`),
 
   updateUser: (id: number, data: any) => api.put(`/api/users/${id}/`, data),
 };
 
+// Several GETs in one round trip; responses come back in order as { status, headers, body }
+export const batchAPI = {
+  run: (requests: { path: string; headers?: { 'If-None-Match'?: string } }[]) =>
+    api.post('/api/batch/', { requests }),
+};
+
 // File upload API
 export const fileAPI = {
   uploadAttachment: (file: File, messageId: number) => {
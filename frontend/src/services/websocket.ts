@@ -13,6 +13,8 @@ class WebSocketService {
   private messageEditedCallbacks: ((data: any) => void)[] = [];
   private messageDeletedCallbacks: ((data: any) => void)[] = [];
   private readReceiptCallbacks: ((data: any) => void)[] = [];
+  private messageAckCallbacks: ((data: any) => void)[] = [];
+  private syncCallbacks: ((data: any) => void)[] = [];
   private connectionPromise: Promise<WebSocket> | null = null;
 
   connect(roomName: string): Promise<WebSocket> {
@@ -97,6 +99,12 @@ class WebSocketService {
     } else if (data.type === 'read_receipt') {
       console.log('[WebSocket Debug] Processing read receipt message');
       this.readReceiptCallbacks.forEach(callback => callback(data));
+    } else if (data.type === 'message_ack') {
+      console.log('[WebSocket Debug] Processing message ack');
+      this.messageAckCallbacks.forEach(callback => callback(data));
+    } else if (data.type === 'sync_progress' || data.type === 'sync_complete') {
+      console.log(`[WebSocket Debug] Processing initial sync ${data.type === 'sync_complete' ? 'completion' : data.stage}`);
+      this.syncCallbacks.forEach(callback => callback(data));
     } else {
       // Assume it's a regular message
       console.log('[WebSocket Debug] Processing regular message');
@@ -252,6 +260,14 @@ class WebSocketService {
     this.readReceiptCallbacks.push(callback);
   }
 
+  onMessageAck(callback: (data: any) => void) {
+    this.messageAckCallbacks.push(callback);
+  }
+
+  onSync(callback: (data: any) => void) {
+    this.syncCallbacks.push(callback);
+  }
+
   off(event: string, callback?: (data: any) => void) {
     let callbacks: ((data: any) => void)[] = [];
     switch (event) {
@@ -276,6 +292,12 @@ class WebSocketService {
       case 'read_receipt':
         callbacks = this.readReceiptCallbacks;
         break;
+      case 'message_ack':
+        callbacks = this.messageAckCallbacks;
+        break;
+      case 'sync':
+        callbacks = this.syncCallbacks;
+        break;
     }
     if (callback) {
       const index = callbacks.indexOf(callback);
@@ -60,6 +60,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'chat.middleware.ReplicaRoutingMiddleware',
+    'chat.middleware.PermissionCacheMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -127,6 +129,111 @@ DATABASES = {
     }
 }
 
+# Read replicas
+# DB_REPLICAS is a comma-separated list of replica hosts (database file paths on SQLite).
+# Read-mostly views use them; a user who has just written reads from the primary for
+# DB_REPLICA_STICKY_SECONDS. Pinning is stored in the cache, so use a shared cache
+# when running more than one process.
+DATABASE_REPLICAS = []
+for index, replica in enumerate(filter(None, os.getenv('DB_REPLICAS', '').split(','))):
+    alias = f'replica_{index + 1}'
+    location = 'NAME' if DATABASES['default']['ENGINE'].endswith('sqlite3') else 'HOST'
+    DATABASES[alias] = {**DATABASES['default'], location: replica.strip(), 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['chat.db_router.ReplicaRouter']
+DB_REPLICA_STICKY_SECONDS = int(os.getenv('DB_REPLICA_STICKY_SECONDS', '5'))
+
+# Message persistence
+# 'sync' saves each message before broadcasting it. 'write_behind' assigns the message ID
+# up front, broadcasts immediately and lets a per-process writer batch the inserts
+# (SQLite and PostgreSQL only).
+MESSAGE_PERSISTENCE_MODE = os.getenv('MESSAGE_PERSISTENCE_MODE', 'sync')
+MESSAGE_WRITER_BATCH_SIZE = int(os.getenv('MESSAGE_WRITER_BATCH_SIZE', '100'))
+MESSAGE_WRITER_FLUSH_INTERVAL = float(os.getenv('MESSAGE_WRITER_FLUSH_INTERVAL', '0.05'))
+MESSAGE_WRITER_MAX_RETRIES = int(os.getenv('MESSAGE_WRITER_MAX_RETRIES', '5'))
+MESSAGE_ID_BLOCK_SIZE = int(os.getenv('MESSAGE_ID_BLOCK_SIZE', '100'))
+
+# Message archival
+# Messages older than MESSAGE_ARCHIVE_AFTER_DAYS are moved to the archive tables by
+# `manage.py archive_messages`; reads go through both tiers.
+MESSAGE_ARCHIVE_AFTER_DAYS = int(os.getenv('MESSAGE_ARCHIVE_AFTER_DAYS', '180'))
+MESSAGE_ARCHIVE_BATCH_SIZE = int(os.getenv('MESSAGE_ARCHIVE_BATCH_SIZE', '500'))
+MESSAGE_ARCHIVE_COMPRESS = os.getenv('MESSAGE_ARCHIVE_COMPRESS', 'False') == 'True'
+
+# Messages read per query by conversation exports (API endpoint and export_conversation command)
+MESSAGE_EXPORT_BATCH_SIZE = int(os.getenv('MESSAGE_EXPORT_BATCH_SIZE', '1000'))
+
+# Background deletion
+# Conversations and users are tombstoned immediately and deleted by a background
+# worker in chunks of DELETION_CHUNK_SIZE rows per transaction.
+DELETION_CHUNK_SIZE = int(os.getenv('DELETION_CHUNK_SIZE', '1000'))
+DELETION_MAX_RETRIES = int(os.getenv('DELETION_MAX_RETRIES', '3'))
+
+# Deleted message compaction
+# `manage.py compact_deleted_messages` purges messages deleted more than
+# MESSAGE_COMPACTION_GRACE_DAYS ago, sleeping MESSAGE_COMPACTION_THROTTLE seconds between batches.
+MESSAGE_COMPACTION_GRACE_DAYS = int(os.getenv('MESSAGE_COMPACTION_GRACE_DAYS', '30'))
+MESSAGE_COMPACTION_BATCH_SIZE = int(os.getenv('MESSAGE_COMPACTION_BATCH_SIZE', '500'))
+MESSAGE_COMPACTION_THROTTLE = float(os.getenv('MESSAGE_COMPACTION_THROTTLE', '0.1'))
+MESSAGE_COMPACTION_HARD_DELETE = os.getenv('MESSAGE_COMPACTION_HARD_DELETE', 'False') == 'True'
+
+# Audit log
+# 'async' queues entries and batch-inserts them from a per-process writer once the action's
+# transaction commits; the queue is drained on shutdown. 'sync' writes on the request path.
+# Entries older than AUDIT_LOG_RETENTION_DAYS are removed a month at a time by `manage.py prune_audit_log`.
+AUDIT_LOG_MODE = os.getenv('AUDIT_LOG_MODE', 'async')
+AUDIT_LOG_BATCH_SIZE = int(os.getenv('AUDIT_LOG_BATCH_SIZE', '100'))
+AUDIT_LOG_FLUSH_INTERVAL = float(os.getenv('AUDIT_LOG_FLUSH_INTERVAL', '0.5'))
+AUDIT_LOG_MAX_RETRIES = int(os.getenv('AUDIT_LOG_MAX_RETRIES', '5'))
+AUDIT_LOG_DURABLE_TIMEOUT = float(os.getenv('AUDIT_LOG_DURABLE_TIMEOUT', '5'))
+AUDIT_LOG_RETENTION_DAYS = int(os.getenv('AUDIT_LOG_RETENTION_DAYS', '365'))
+AUDIT_LOG_PRUNE_BATCH_SIZE = int(os.getenv('AUDIT_LOG_PRUNE_BATCH_SIZE', '1000'))
+# PostgreSQL only: monthly partitions created ahead of time, so entries never land in the default partition
+AUDIT_LOG_PARTITION_MONTHS_AHEAD = int(os.getenv('AUDIT_LOG_PARTITION_MONTHS_AHEAD', '3'))
+
+# Shared cache
+# The permission, membership, replica pinning and directory caches are invalidated by writes in
+# whichever process made them, so every process must read the same cache: Redis when REDIS_URL
+# is set. The per-process LocMem fallback is only correct with a single server process.
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Permission cache
+# Effective permission sets are cached per request and in the shared cache; role changes
+# invalidate them through versioned keys, so the timeout only bounds memory use.
+PERMISSION_CACHE_TIMEOUT = int(os.getenv('PERMISSION_CACHE_TIMEOUT', '300'))
+
+# Membership cache
+# user -> conversation IDs and conversation -> member IDs, filled lazily and cleared by
+# membership signals; shared between processes through the cache above.
+MEMBERSHIP_CACHE_TIMEOUT = int(os.getenv('MEMBERSHIP_CACHE_TIMEOUT', '300'))
+
+# User directory
+# First pages of directory searches for prefixes up to DIRECTORY_CACHE_PREFIX_LENGTH characters
+# are kept in the shared cache for DIRECTORY_CACHE_TIMEOUT seconds.
+DIRECTORY_CACHE_TIMEOUT = int(os.getenv('DIRECTORY_CACHE_TIMEOUT', '30'))
+DIRECTORY_CACHE_PREFIX_LENGTH = int(os.getenv('DIRECTORY_CACHE_PREFIX_LENGTH', '3'))
+
+# Per-process name index for mention autocomplete. Users saved by other processes are picked up
+# every USER_INDEX_REFRESH_INTERVAL seconds; the index is rebuilt every USER_INDEX_REBUILD_INTERVAL.
+USER_INDEX_REFRESH_INTERVAL = int(os.getenv('USER_INDEX_REFRESH_INTERVAL', '30'))
+USER_INDEX_REBUILD_INTERVAL = int(os.getenv('USER_INDEX_REBUILD_INTERVAL', '3600'))
+
+# Most sub-requests one POST to /api/batch/ may carry
+BATCH_MAX_REQUESTS = int(os.getenv('BATCH_MAX_REQUESTS', '20'))
+
 # Custom user model
 AUTH_USER_MODEL = 'chat.User'
 